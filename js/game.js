@@ -5331,13 +5331,46 @@ const HumanModel = (() => {
       const snap = await firebase.database().ref(path).once("value");
       const v = snap && typeof snap.val === "function" ? snap.val() : null;
       if (!v || !v.version || !v.file) return null;
-      return { version: String(v.version), file: String(v.file) };
+      // Content-addressed pointers are cached under their sha256, so a republished
+      // byte-identical model is never downloaded again; older pointers fall back to the version.
+      if (v.lite && v.lite.file && preferLite()) {
+        const sha = String(v.lite.sha256 || "").trim();
+        return { version: sha || `${v.version}-lite`, file: String(v.lite.file), sha256: sha };
+      }
+      if (v.int8 && v.int8.file && preferInt8()) {
+        const sha = String(v.int8.sha256 || "").trim();
+        return { version: sha || `${v.version}-int8`, file: String(v.int8.file), sha256: sha };
+      }
+      const sha = String(v.sha256 || "").trim();
+      return { version: sha || String(v.version), file: String(v.file), sha256: sha };
     } catch {
       return null;
     }
     return null;
   }
 
+  // Low-memory or few-core devices use the policy-only student when the pointer offers one.
+  function preferLite() {
+    try {
+      const mem = Number(navigator.deviceMemory || 0);
+      const cores = Number(navigator.hardwareConcurrency || 0);
+      return (mem > 0 && mem <= 2) || (cores > 0 && cores <= 2);
+    } catch {
+      return false;
+    }
+  }
+
+  // Data-saver or slow connections take the quantized copy, about a quarter of the download.
+  function preferInt8() {
+    try {
+      const conn = navigator.connection;
+      if (!conn) return false;
+      return !!conn.saveData || ["slow-2g", "2g", "3g"].includes(String(conn.effectiveType || ""));
+    } catch {
+      return false;
+    }
+  }
+
   function normalizeHumanFile(file) {
     let f = String(file || "").trim();
     if (!f) return "";
@@ -5375,6 +5408,18 @@ const HumanModel = (() => {
 
 
 
+  async function sha256Matches(buf, expected) {
+    // Without SubtleCrypto (insecure origins) the download is trusted as before.
+    if (!(window.crypto && crypto.subtle)) return true;
+    try {
+      const digest = new Uint8Array(await crypto.subtle.digest("SHA-256", buf));
+      const hex = Array.from(digest, (b) => b.toString(16).padStart(2, "0")).join("");
+      return hex === String(expected).toLowerCase();
+    } catch {
+      return true;
+    }
+  }
+
   async function createSession(buf) {
     const opts = { executionProviders: ["wasm"], graphOptimizationLevel: "all" };
     return ort.InferenceSession.create(buf, opts);
@@ -5401,6 +5446,11 @@ const HumanModel = (() => {
     }
     buf = await resp.arrayBuffer();
 
+    if (ptr.sha256 && !(await sha256Matches(buf, ptr.sha256))) {
+      failedVersions.add(version);
+      throw new Error("human_sha256_mismatch");
+    }
+
     try { await cachePut(version, buf); } catch {}
     try { localStorage.setItem(LOCAL_VER_KEY, version); } catch {}
 
@@ -5593,7 +5643,9 @@ if (!ok) {
     const feeds = { state: input };
     const results = await session.run(feeds);
     let logits = results["policy_value_logits"]?.data;
-    const value = results["value"]?.data?.[0];
+    // The policy-only lite graph has no value output; null tells callers to use their own estimate.
+    const v = results["value"]?.data?.[0];
+    const value = Number.isFinite(v) ? v : null;
 
     
     if (!logits) {
@@ -6019,7 +6071,7 @@ function setAIBadge(state, type = "onnx") {
     if (modelTotal <= 0) return null;
 
     let logitsOnnx = null, valueOnnx = 0;
-    let logitsHuman = null, valueHuman = 0;
+    let logitsHuman = null, valueHuman = null;
 
     if (w.onnx > 0) {
       try {
@@ -6037,7 +6089,7 @@ function setAIBadge(state, type = "onnx") {
         await HumanModel.load();
         const pvj = await HumanModel.policyValue();
         logitsHuman = pvj?.logits || null;
-        valueHuman = Number.isFinite(pvj?.value) ? pvj.value : 0;
+        valueHuman = Number.isFinite(pvj?.value) ? pvj.value : null;
       } catch (_) {
         logitsHuman = null;
       }
@@ -6059,7 +6111,7 @@ function setAIBadge(state, type = "onnx") {
       out[i] = a * lo + b * lj;
     }
 
-    return { logits: out, value: a * valueOnnx + b * valueHuman };
+    return { logits: out, value: valueHuman == null ? valueOnnx : a * valueOnnx + b * valueHuman };
   }
 
 
@@ -6728,25 +6780,29 @@ if (Game.settings.aiCaptureMode === "mandatory" && captureMask) {
       return s;
     }
 
-    async function policyValueForCurrentPlayer() {
-      try {
-        const { value } = await policyValueHybrid();
-        return value;
-      } catch {
-        let my = 0, opp = 0;
-        for (let r = 0; r < BOARD_N; r++) {
-          for (let c = 0; c < BOARD_N; c++) {
-            const v = Game.board[r][c];
-            if (!v) continue;
-            const owner = pieceOwner(v);
-            const kind = pieceKind(v);
-            const w = kind === KING ? 3 : 1;
-            if (owner === Game.player) my += w;
-            else opp += w;
-          }
+    function materialForCurrentPlayer() {
+      let my = 0, opp = 0;
+      for (let r = 0; r < BOARD_N; r++) {
+        for (let c = 0; c < BOARD_N; c++) {
+          const v = Game.board[r][c];
+          if (!v) continue;
+          const owner = pieceOwner(v);
+          const kind = pieceKind(v);
+          const w = kind === KING ? 3 : 1;
+          if (owner === Game.player) my += w;
+          else opp += w;
         }
-        return my - opp;
       }
+      return my - opp;
+    }
+
+    // Falls back to material when no model runs or the active one has no value head.
+    async function policyValueForCurrentPlayer() {
+      try {
+        const pv = await policyValueHybrid();
+        if (Number.isFinite(pv?.value)) return pv.value;
+      } catch {}
+      return materialForCurrentPlayer();
     }
 
     
@@ -0,0 +1,523 @@
+# Section: training/dhamet.py — Python utility script
+"""Dhamet rules engine for the training pipeline.
+
+A port of the rules in js/game.js (generateStepsFrom, generateCapturesFrom, legalActions,
+maxCaptureLenFrom, computeLongestForPlayer, Turn.computeSouflaPending, checkEndConditions).
+A Position holds one 81-bit integer per piece type (bit r*9+c); step masks, jumps and
+king rays are precomputed from DIAG_A_SEGMENTS / DIAG_B_SEGMENTS.
+
+Run `python training/dhamet.py verify games.json` to cross-check a trainGamesV3 export.
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import json
+import sys
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+BOARD_N = 9
+N_CELLS = BOARD_N * BOARD_N
+ACTION_ENDCHAIN = N_CELLS * N_CELLS
+N_ACTIONS = ACTION_ENDCHAIN + 1
+
+TOP = +1
+BOT = -1
+MAN = 1
+KING = 2
+
+# TrainRecorder stores soufla penalty choices as these pseudo-actions (from == to).
+ACTION_SOUFLA_REMOVE = 0
+ACTION_SOUFLA_FORCE = N_CELLS + 1
+
+# Same segments as js/game.js.
+DIAG_A_SEGMENTS = [
+    [[0, 2], [2, 0]],
+    [[0, 4], [4, 0]],
+    [[0, 6], [6, 0]],
+    [[0, 8], [8, 0]],
+    [[2, 8], [8, 2]],
+    [[4, 8], [8, 4]],
+    [[6, 8], [8, 6]],
+]
+DIAG_B_SEGMENTS = [
+    [[0, 6], [2, 8]],
+    [[0, 4], [4, 8]],
+    [[0, 2], [6, 8]],
+    [[0, 0], [8, 8]],
+    [[2, 0], [8, 6]],
+    [[4, 0], [8, 4]],
+    [[6, 0], [8, 2]],
+]
+
+DIRS_ORTHO = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+DIRS_DIAG_A = [(-1, 1), (1, -1)]
+DIRS_DIAG_B = [(-1, -1), (1, 1)]
+
+FULL = (1 << N_CELLS) - 1
+ROW_TOP = sum(1 << c for c in range(BOARD_N))
+ROW_BOT = ROW_TOP << (N_CELLS - BOARD_N)
+
+
+def _segment_cells(segments, dc: int) -> List[bool]:
+    on = [False] * N_CELLS
+    for (r0, c0), (r1, c1) in segments:
+        r, c = r0, c0
+        while True:
+            on[r * BOARD_N + c] = True
+            if r == r1 and c == c1:
+                break
+            r += 1
+            c += dc
+    return on
+
+
+IN_DIAG_A = _segment_cells(DIAG_A_SEGMENTS, -1)
+IN_DIAG_B = _segment_cells(DIAG_B_SEGMENTS, +1)
+
+
+def _inside(r: int, c: int) -> bool:
+    return 0 <= r < BOARD_N and 0 <= c < BOARD_N
+
+
+def _dir_allowed(idx: int, dr: int, dc: int) -> bool:
+    if (dr, dc) in DIRS_ORTHO:
+        return True
+    if (dr, dc) in DIRS_DIAG_A:
+        return IN_DIAG_A[idx]
+    if (dr, dc) in DIRS_DIAG_B:
+        return IN_DIAG_B[idx]
+    return False
+
+
+def _build_tables():
+    steps: Dict[int, List[int]] = {TOP: [], BOT: []}
+    jumps = []
+    rays = []
+    for idx in range(N_CELLS):
+        r, c = divmod(idx, BOARD_N)
+        for side in (TOP, BOT):
+            r2 = r + side
+            mask = 0
+            if _inside(r2, c):
+                mask |= 1 << (r2 * BOARD_N + c)
+            if IN_DIAG_A[idx] or IN_DIAG_B[idx]:
+                for dc in (1, -1):
+                    if not _inside(r2, c + dc):
+                        continue
+                    to = r2 * BOARD_N + c + dc
+                    if (IN_DIAG_A[idx] and IN_DIAG_A[to]) or (IN_DIAG_B[idx] and IN_DIAG_B[to]):
+                        mask |= 1 << to
+            steps[side].append(mask)
+
+        dirs = DIRS_ORTHO + (DIRS_DIAG_A if IN_DIAG_A[idx] else []) + (DIRS_DIAG_B if IN_DIAG_B[idx] else [])
+        cell_jumps = []
+        cell_rays = []
+        for dr, dc in dirs:
+            if _inside(r + 2 * dr, c + 2 * dc) and _dir_allowed(idx, dr, dc):
+                cell_jumps.append(((r + dr) * BOARD_N + c + dc, (r + 2 * dr) * BOARD_N + c + 2 * dc))
+            ray = []
+            rr, cc = r + dr, c + dc
+            while _inside(rr, cc) and _dir_allowed((rr - dr) * BOARD_N + cc - dc, dr, dc):
+                ray.append(rr * BOARD_N + cc)
+                rr += dr
+                cc += dc
+            if ray:
+                cell_rays.append(tuple(ray))
+        jumps.append(tuple(cell_jumps))
+        rays.append(tuple(cell_rays))
+    return tuple(steps[TOP]), tuple(steps[BOT]), tuple(jumps), tuple(rays)
+
+
+MAN_STEPS_TOP, MAN_STEPS_BOT, MAN_JUMPS, RAYS = _build_tables()
+
+
+def iter_bits(x: int) -> Iterator[int]:
+    while x:
+        low = x & -x
+        yield low.bit_length() - 1
+        x ^= low
+
+
+class Position(NamedTuple):
+    """Bitboards per piece type plus the side to move and the capturing piece mid-chain (-1 if none)."""
+
+    top_men: int
+    top_kings: int
+    bot_men: int
+    bot_kings: int
+    player: int = TOP
+    chain: int = -1
+
+    @classmethod
+    def from_board(cls, board: Sequence[int], player: int = TOP, chain: int = -1) -> "Position":
+        tm = tk = bm = bk = 0
+        for idx, v in enumerate(board):
+            if v == MAN:
+                tm |= 1 << idx
+            elif v == KING:
+                tk |= 1 << idx
+            elif v == -MAN:
+                bm |= 1 << idx
+            elif v == -KING:
+                bk |= 1 << idx
+        return cls(tm, tk, bm, bk, BOT if player == BOT else TOP, chain)
+
+    @classmethod
+    def from_snapshot(cls, snap: Dict[str, Any]) -> "Position":
+        """Decode a TrainRecorder state {b, p, ic, cp} (b: base64 of 81 int8)."""
+        raw = base64.b64decode(str(snap.get("b") or ""), validate=True)
+        if len(raw) != N_CELLS:
+            raise ValueError(f"board has {len(raw)} bytes, expected {N_CELLS}")
+        board = [x - 256 if x > 127 else x for x in raw]
+        cp = int(snap.get("cp", -1))
+        chain = cp if int(snap.get("ic", 0)) == 1 and 0 <= cp < N_CELLS else -1
+        return cls.from_board(board, int(snap.get("p", TOP)), chain)
+
+    def board(self) -> List[int]:
+        out = [0] * N_CELLS
+        for bits, v in ((self.top_men, MAN), (self.top_kings, KING), (self.bot_men, -MAN), (self.bot_kings, -KING)):
+            for idx in iter_bits(bits):
+                out[idx] = v
+        return out
+
+    @property
+    def occupied(self) -> int:
+        return self.top_men | self.top_kings | self.bot_men | self.bot_kings
+
+    def pieces(self, side: int) -> int:
+        return (self.top_men | self.top_kings) if side == TOP else (self.bot_men | self.bot_kings)
+
+    def at(self, idx: int) -> int:
+        bit = 1 << idx
+        if self.top_men & bit:
+            return MAN
+        if self.top_kings & bit:
+            return KING
+        if self.bot_men & bit:
+            return -MAN
+        if self.bot_kings & bit:
+            return -KING
+        return 0
+
+
+def _owner(v: int) -> int:
+    return TOP if v > 0 else BOT if v < 0 else 0
+
+
+def steps_from(pos: Position, idx: int) -> List[int]:
+    v = pos.at(idx)
+    occ = pos.occupied
+    if abs(v) == MAN:
+        table = MAN_STEPS_TOP if v > 0 else MAN_STEPS_BOT
+        return list(iter_bits(table[idx] & ~occ))
+    out = []
+    for ray in RAYS[idx]:
+        for to in ray:
+            if occ >> to & 1:
+                break
+            out.append(to)
+    return out
+
+
+def captures_from(pos: Position, idx: int, v: Optional[int] = None) -> List[Tuple[int, int]]:
+    """(landing cell, jumped cell) pairs for the piece on idx (or a piece of value v placed there)."""
+    v = pos.at(idx) if v is None else v
+    side = _owner(v)
+    if side == 0:
+        return []
+    occ = pos.occupied
+    enemy = pos.pieces(-side)
+    out = []
+    if abs(v) == MAN:
+        for mid, to in MAN_JUMPS[idx]:
+            if enemy >> mid & 1 and not occ >> to & 1:
+                out.append((to, mid))
+        return out
+    for ray in RAYS[idx]:
+        jumped = -1
+        for cell in ray:
+            if not occ >> cell & 1:
+                if jumped >= 0:
+                    out.append((cell, jumped))
+                continue
+            if not enemy >> cell & 1 or jumped >= 0:
+                break
+            jumped = cell
+    return out
+
+
+def legal_actions(pos: Position) -> List[int]:
+    """Action ids (from*81+to, ACTION_ENDCHAIN) as legalActions() outside the forced opening.
+
+    Captures are never compulsory here; skipping the longest capture is punished by soufla.
+    """
+    if pos.chain >= 0:
+        acts = [pos.chain * N_CELLS + to for to, _mid in captures_from(pos, pos.chain)]
+        acts.append(ACTION_ENDCHAIN)
+        return acts
+    acts = []
+    for idx in iter_bits(pos.pieces(pos.player)):
+        base = idx * N_CELLS
+        acts.extend(base + to for to in steps_from(pos, idx))
+        acts.extend(base + to for to, _mid in captures_from(pos, idx))
+    return acts
+
+
+@lru_cache(maxsize=262_144)
+def legal_actions_cached(board: bytes, player: int, chain_pos: int = -1) -> Tuple[int, ...]:
+    """legal_actions keyed by the packed int8 board; chain_pos >= 0 means the position is mid-chain."""
+    cells = [b - 256 if b > 127 else b for b in board]
+    return tuple(legal_actions(Position.from_board(cells, player, chain_pos)))
+
+
+def _move(pos: Position, fr: int, to: int, jumped: int = -1) -> Position:
+    fbit, tbit = 1 << fr, 1 << to
+    clear = ~(fbit | ((1 << jumped) if jumped >= 0 else 0)) & FULL
+    boards = []
+    for bits in pos[:4]:
+        moved = tbit if bits & fbit else 0
+        boards.append((bits & clear) | moved)
+    return pos._replace(top_men=boards[0], top_kings=boards[1], bot_men=boards[2], bot_kings=boards[3])
+
+
+def _promote(pos: Position, idx: int) -> Position:
+    """Crown a man standing on its far rank, as promoteIfNeeded() does at the end of a turn."""
+    bit = 1 << idx
+    if pos.top_men & bit and bit & ROW_BOT:
+        return pos._replace(top_men=pos.top_men & ~bit, top_kings=pos.top_kings | bit)
+    if pos.bot_men & bit and bit & ROW_TOP:
+        return pos._replace(bot_men=pos.bot_men & ~bit, bot_kings=pos.bot_kings | bit)
+    return pos
+
+
+def capture_of(pos: Position, fr: int, to: int) -> int:
+    """Jumped cell when fr->to is a capture for the piece on fr, else -1 (classifyCapture)."""
+    for land, mid in captures_from(pos, fr):
+        if land == to:
+            return mid
+    return -1
+
+
+def play(pos: Position, action: int) -> Tuple[Position, int]:
+    """Apply one action; returns (next position, jumped cell or -1).
+
+    After a capture the turn stays with the mover while further captures exist. A man that
+    reaches its far rank is crowned only when the turn ends, so it keeps capturing as a man.
+    """
+    if action == ACTION_ENDCHAIN:
+        if pos.chain < 0:
+            raise ValueError("ACTION_ENDCHAIN outside a capture chain")
+        return _promote(pos, pos.chain)._replace(player=-pos.player, chain=-1), -1
+    fr, to = divmod(action, N_CELLS)
+    if fr == to or _owner(pos.at(fr)) != pos.player:
+        raise ValueError(f"action {action} does not move a piece of the side to move")
+    jumped = capture_of(pos, fr, to)
+    nxt = _move(pos, fr, to, jumped)
+    if jumped >= 0 and captures_from(nxt, to):
+        return nxt._replace(chain=to), jumped
+    return _promote(nxt, to)._replace(player=-pos.player, chain=-1), jumped
+
+
+def max_capture_len(pos: Position, idx: int, v: Optional[int] = None) -> int:
+    """Longest capture sequence available to the piece on idx (maxCaptureLenFrom)."""
+    v = pos.at(idx) if v is None else v
+    best = 0
+    for to, mid in captures_from(pos, idx, v):
+        nxt = _move(pos, idx, to, mid)
+        best = max(best, 1 + max_capture_len(nxt, to, v))
+    return best
+
+
+def longest_for_player(pos: Position, side: int) -> Tuple[Dict[int, int], int, List[int]]:
+    """(longest capture per piece, overall longest, pieces achieving it) (computeLongestForPlayer)."""
+    by_piece = {}
+    for idx in iter_bits(pos.pieces(side)):
+        n = max_capture_len(pos, idx)
+        if n > 0:
+            by_piece[idx] = n
+    longest = max(by_piece.values(), default=0)
+    return by_piece, longest, [idx for idx, n in by_piece.items() if n == longest]
+
+
+def longest_paths(pos: Position, idx: int, length: int) -> List[Tuple[List[int], List[int]]]:
+    """All capture paths of exactly `length` jumps from idx as (landings, jumped cells)."""
+    v = pos.at(idx)
+    out: List[Tuple[List[int], List[int]]] = []
+
+    def dfs(p: Position, cur: int, path: List[int], jumps: List[int]) -> None:
+        if len(path) == length:
+            out.append((path, jumps))
+            return
+        for to, mid in captures_from(p, cur, v):
+            nxt = _move(p, cur, to, mid)
+            if max_capture_len(nxt, to, v) >= length - len(path) - 1:
+                dfs(nxt, to, path + [to], jumps + [mid])
+
+    dfs(pos, idx, [], [])
+    return out
+
+
+def soufla_offenders(turn_start: Position, started_from: Optional[int], captures_done: int) -> List[int]:
+    """Pieces the opponent may punish after a turn (Turn.computeSouflaPending).
+
+    turn_start is the position before the mover's first action; started_from is the piece
+    that captured this turn (None if the turn was a plain step).
+    """
+    by_piece, longest, candidates = longest_for_player(turn_start, turn_start.player)
+    if longest <= 0:
+        return []
+    if started_from is None:
+        return candidates
+    own = by_piece.get(started_from, 0)
+    offenders = []
+    if own > 0 and captures_done < own:
+        offenders.append(started_from)
+    if own < longest:
+        offenders.extend(idx for idx in candidates if idx != started_from)
+    return list(dict.fromkeys(offenders))
+
+
+def outcome(pos: Position) -> Optional[int]:
+    """TOP/BOT if that side has won, 0 for the lone-king draw, None while the game goes on.
+
+    A side to move without legal actions loses, as in simTerminalScore.
+    """
+    top, bot = pos.pieces(TOP), pos.pieces(BOT)
+    if not top or not bot:
+        return TOP if top else BOT
+    if bin(top).count("1") == 1 and bin(bot).count("1") == 1 and pos.top_kings and pos.bot_kings:
+        return 0
+    if pos.chain < 0 and not legal_actions(pos):
+        return -pos.player
+    return None
+
+
+# Forced opening sequences (FO_TOP / FO_BOT in js/game.js): ten plies, the seventh a two-jump chain.
+FORCED_OPENING = {
+    TOP: [[(3, 5), (4, 4)], [(5, 3), (3, 5)], [(2, 6), (4, 4)], [(4, 8), (2, 6)], [(1, 7), (3, 5)],
+          [(4, 6), (2, 6)], [(4, 4), (4, 6), (4, 8)], [(2, 6), (4, 4)], [(4, 3), (4, 5)], [(5, 5), (3, 5)]],
+    BOT: [[(5, 3), (4, 4)], [(3, 5), (5, 3)], [(6, 2), (4, 4)], [(4, 0), (6, 2)], [(7, 1), (5, 3)],
+          [(4, 2), (6, 2)], [(4, 4), (4, 2), (4, 0)], [(6, 2), (4, 4)], [(4, 5), (4, 3)], [(3, 3), (5, 3)]],
+}
+
+
+def initial_position(starter: int = TOP) -> Position:
+    """setupInitialBoard(): four full rows each, row 4 split with the centre empty."""
+    board = [0] * N_CELLS
+    for idx in range(N_CELLS):
+        r, c = divmod(idx, BOARD_N)
+        if r < 4 or (r == 4 and c < 4):
+            board[idx] = MAN
+        elif r > 4 or (r == 4 and c > 4):
+            board[idx] = -MAN
+    return Position.from_board(board, starter)
+
+
+def play_forced_opening(pos: Position) -> Position:
+    """Play the ten forced plies for the side that moved first; each ply ends the turn."""
+    for ply in FORCED_OPENING[pos.player]:
+        for (r0, c0), (r1, c1) in zip(ply, ply[1:]):
+            pos, _jumped = play(pos, (r0 * BOARD_N + c0) * N_CELLS + r1 * BOARD_N + c1)
+        if pos.chain >= 0:
+            pos, _jumped = play(pos, ACTION_ENDCHAIN)
+    return pos
+
+
+def remove_piece(pos: Position, idx: int) -> Position:
+    """Soufla "remove" option: take the offending piece off the board."""
+    keep = ~(1 << idx) & FULL
+    return pos._replace(
+        top_men=pos.top_men & keep, top_kings=pos.top_kings & keep,
+        bot_men=pos.bot_men & keep, bot_kings=pos.bot_kings & keep,
+    )
+
+
+def _cell(s: Any) -> int:
+    r, c = str(s).split(".")
+    return int(r) * BOARD_N + int(c)
+
+
+def cross_check_game(game: Dict[str, Any]) -> List[str]:
+    """Replay a trainGamesV3 record against the engine; returns human-readable mismatches.
+
+    Every recorded action must be legal in its recorded state, the parallel `steps` entry
+    must name the same squares, and a capture followed by a mid-chain sample must lead to
+    exactly that sample's board.
+    """
+    problems = []
+    samples = game.get("samples") or []
+    steps = game.get("steps") or []
+    aligned = len(steps) == len(samples)
+    for i, s in enumerate(samples):
+        if not isinstance(s, dict) or not isinstance(s.get("s"), dict):
+            continue
+        a = int(s.get("a", -1))
+        if s.get("sfPenaltyChoice") or (aligned and isinstance(steps[i], list) and steps[i][:1] == ["SF"]):
+            continue
+        try:
+            pos = Position.from_snapshot(s["s"])
+        except Exception as e:
+            problems.append(f"sample {i}: bad state ({e})")
+            continue
+        if a not in legal_actions(pos):
+            problems.append(f"sample {i}: action {_fmt(a)} not legal for {'TOP' if pos.player == TOP else 'BOT'}")
+            continue
+        if aligned and isinstance(steps[i], list) and len(steps[i]) == 2 and a != ACTION_ENDCHAIN:
+            try:
+                if (_cell(steps[i][0]), _cell(steps[i][1])) != divmod(a, N_CELLS):
+                    problems.append(f"sample {i}: step {steps[i]} disagrees with action {_fmt(a)}")
+            except ValueError:
+                pass
+        if i + 1 < len(samples) and a != ACTION_ENDCHAIN:
+            nxt_s = samples[i + 1].get("s") if isinstance(samples[i + 1], dict) else None
+            if isinstance(nxt_s, dict) and int(nxt_s.get("ic", 0)) == 1 and int(nxt_s.get("cp", -1)) == a % N_CELLS:
+                # The client keeps the chain open after every capture until the player ends it,
+                # so compare the board before play() would end the turn and crown.
+                fr, to = divmod(a, N_CELLS)
+                got = _move(pos, fr, to, capture_of(pos, fr, to))
+                try:
+                    want = Position.from_snapshot(nxt_s)
+                except Exception:
+                    continue
+                if got[:4] != want[:4] or want.chain != to:
+                    problems.append(f"sample {i}: capture {_fmt(a)} does not reproduce the next chain state")
+    return problems
+
+
+def _fmt(a: int) -> str:
+    if a == ACTION_ENDCHAIN:
+        return "END"
+    fr, to = divmod(a, N_CELLS)
+    return f"{fr // BOARD_N}.{fr % BOARD_N}->{to // BOARD_N}.{to % BOARD_N}"
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Dhamet rules engine utilities")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    v = sub.add_parser("verify", help="cross-check recorded games (trainGamesV3 JSON export) against the engine")
+    v.add_argument("path", help="JSON object of gameId -> game record")
+    v.add_argument("--show", type=int, default=20, help="mismatches printed per game")
+    args = ap.parse_args()
+
+    with open(args.path, "r", encoding="utf-8") as f:
+        games = json.load(f) or {}
+    bad_games = checked = 0
+    for gid, g in games.items():
+        if not isinstance(g, dict):
+            continue
+        checked += 1
+        problems = cross_check_game(g)
+        if problems:
+            bad_games += 1
+            print(f"{gid}: {len(problems)} mismatches")
+            for p in problems[: args.show]:
+                print(f"  {p}")
+    print(f"[verify] {checked} games checked, {bad_games} with mismatches")
+    return 1 if bad_games else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -30,7 +30,9 @@ import argparse
 import json
 import os
 import time
-from typing import Any, Dict, Iterable, Optional, Set, Tuple
+from typing import Any, Dict, Iterable, Iterator, Optional, Set, Tuple
+
+from rtdb_stream import iter_json_object_items
 
 
 
@@ -80,6 +82,15 @@ def _rtdb_rest_get(path: str) -> Dict[str, Any]:
     return data if isinstance(data, dict) else {}
 
 
+def _rtdb_rest_iter(path: str, params: Optional[Dict[str, Any]] = None) -> Iterator[Tuple[str, Any]]:
+    """Stream the top-level children of an RTDB node without materializing the body."""
+    import requests
+
+    with requests.get(_rest_url(path), params=params, timeout=60, stream=True) as r:
+        r.raise_for_status()
+        yield from iter_json_object_items(r.iter_content(chunk_size=64 * 1024))
+
+
 def _rtdb_rest_patch(path: str, payload: Dict[str, Any]) -> None:
     import requests
 
@@ -97,6 +108,19 @@ def _safe_get_dict(db, path: str) -> Dict[str, Any]:
         return {}
 
 
+def _iter_items(db, path: str) -> Iterator[Tuple[str, Any]]:
+    """Yield (key, child) pairs of a node, streamed over REST.
+
+    Read errors propagate, including mid-stream ones, so a pass never acts on part of a node.
+    """
+    if db is None:
+        yield from _rtdb_rest_iter(path)
+        return
+    d = db.reference(path).get()
+    if isinstance(d, dict):
+        yield from d.items()
+
+
 def _chunked_root_update(db, updates: Dict[str, Any], chunk_size: int = 400) -> None:
     if not updates:
         return
@@ -142,51 +166,58 @@ def cleanup_stale_players(db, now_ms: int, stale_minutes: int, protect_statuses:
     """
     stale_ms = max(1, int(stale_minutes)) * 60 * 1000
 
-    games = _safe_get_dict(db, "games")
     protected_uids: Set[str] = set()
-    for _gid, g in games.items():
-        if not isinstance(g, dict):
-            continue
-        st = str(g.get("status") or "").strip()
-        if st not in protect_statuses:
-            continue
-        for uid in _iter_game_player_uids(g):
-            protected_uids.add(uid)
+    try:
+        for _gid, g in _iter_items(db, "games"):
+            if not isinstance(g, dict):
+                continue
+            st = str(g.get("status") or "").strip()
+            if st not in protect_statuses:
+                continue
+            for uid in _iter_game_player_uids(g):
+                protected_uids.add(uid)
+    except Exception as e:
+        # Without every live room, players still in a game would look stale.
+        print(f"[maintenance] stale players: /games read interrupted ({e}); pass skipped.")
+        return 0, 0, 0
 
-    players = _safe_get_dict(db, "players")
     delete_uids: list[str] = []
     considered = 0
     protected = 0
 
-    for uid, p in players.items():
-        if not uid:
-            continue
-        if not isinstance(p, dict):
+    try:
+        for uid, p in _iter_items(db, "players"):
+            if not uid:
+                continue
+            if not isinstance(p, dict):
+
+                if uid in protected_uids:
+                    protected += 1
+                else:
+                    delete_uids.append(uid)
+                continue
 
+            considered += 1
             if uid in protected_uids:
                 protected += 1
-            else:
-                delete_uids.append(uid)
-            continue
-
-        considered += 1
-        if uid in protected_uids:
-            protected += 1
-            continue
+                continue
 
-        updated_at = p.get("updatedAt")
-        try:
-            updated_ms = int(updated_at or 0)
-        except Exception:
-            updated_ms = 0
+            updated_at = p.get("updatedAt")
+            try:
+                updated_ms = int(updated_at or 0)
+            except Exception:
+                updated_ms = 0
 
 
-        age = now_ms - updated_ms
-        if age < 0:
+            age = now_ms - updated_ms
+            if age < 0:
 
-            continue
-        if age > stale_ms:
-            delete_uids.append(uid)
+                continue
+            if age > stale_ms:
+                delete_uids.append(uid)
+    except Exception as e:
+        print(f"[maintenance] stale players: /players read interrupted ({e}); pass skipped.")
+        return 0, 0, 0
 
     updates: Dict[str, Any] = {}
     for uid in delete_uids:
@@ -214,47 +245,50 @@ def cleanup_stale_game_presence(
     """
     stale_ms = max(1, int(stale_minutes)) * 60 * 1000
 
-    games = _safe_get_dict(db, "games")
     updates: Dict[str, Any] = {}
     games_scanned = 0
     considered = 0
     deleted = 0
 
-    for gid, g in games.items():
-        if not gid or not isinstance(g, dict):
-            continue
-        st = str(g.get("status") or "").strip()
-        if st not in protect_statuses:
-            continue
-        games_scanned += 1
-
-        pres = g.get("presence")
-        if not isinstance(pres, dict):
-            continue
-
-        for uid, pr in pres.items():
-            if not uid:
+    try:
+        for gid, g in _iter_items(db, "games"):
+            if not gid or not isinstance(g, dict):
                 continue
-            considered += 1
-            if not isinstance(pr, dict):
-                updates[f"games/{gid}/presence/{uid}"] = None
-                deleted += 1
+            st = str(g.get("status") or "").strip()
+            if st not in protect_statuses:
                 continue
+            games_scanned += 1
 
+            pres = g.get("presence")
+            if not isinstance(pres, dict):
+                continue
 
-            updated_at = pr.get("updatedAt") or pr.get("joinedAt") or 0
-            try:
-                updated_ms = int(updated_at or 0)
-            except Exception:
-                updated_ms = 0
+            for uid, pr in pres.items():
+                if not uid:
+                    continue
+                considered += 1
+                if not isinstance(pr, dict):
+                    updates[f"games/{gid}/presence/{uid}"] = None
+                    deleted += 1
+                    continue
 
-            age = now_ms - updated_ms
-            if age < 0:
 
-                continue
-            if age > stale_ms:
-                updates[f"games/{gid}/presence/{uid}"] = None
-                deleted += 1
+                updated_at = pr.get("updatedAt") or pr.get("joinedAt") or 0
+                try:
+                    updated_ms = int(updated_at or 0)
+                except Exception:
+                    updated_ms = 0
+
+                age = now_ms - updated_ms
+                if age < 0:
+
+                    continue
+                if age > stale_ms:
+                    updates[f"games/{gid}/presence/{uid}"] = None
+                    deleted += 1
+    except Exception as e:
+        print(f"[maintenance] stale game presence: /games read interrupted ({e}); pass skipped.")
+        return 0, 0, 0
 
     if updates and not dry_run:
         _chunked_root_update(db, updates)
@@ -298,63 +332,66 @@ def cleanup_stale_rooms(
     abandoned_ms = max(1, int(abandoned_room_minutes)) * 60 * 1000
     limit = max(1, int(delete_limit))
 
-    games = _safe_get_dict(db, "games")
     updates: Dict[str, Any] = {}
 
     considered = 0
     ended_deleted = 0
     abandoned_deleted = 0
 
-    for gid, g in games.items():
-        if not gid or not isinstance(g, dict):
-            continue
-
-        considered += 1
-        st = str(g.get("status") or "").strip()
-        ended_at = _best_ts(g.get("endedAt"))
-        created_at = _best_ts(g.get("createdAt"))
-        accepted_at = _best_ts(g.get("acceptedAt"))
-
-        last_ts = _best_ts(ended_at, accepted_at, created_at)
-
-        pres = g.get("presence")
-        pres_empty = True
-        if isinstance(pres, dict):
-            pres_empty = len([k for k in pres.keys() if k]) == 0
-
-        # 1) Ended or rejected: remove after a short retention.
-        is_endedish = (st in {"ended", "rejected"}) or (ended_at > 0)
-        if is_endedish:
-            age = now_ms - (ended_at or last_ts or now_ms)
-            if age >= ended_ms:
-                ended_deleted += 1
-            else:
+    try:
+        for gid, g in _iter_items(db, "games"):
+            if not gid or not isinstance(g, dict):
                 continue
 
-        # 2) Abandoned: active/pending with no presence for a while.
-        elif st in protect_statuses and pres_empty:
-            age = now_ms - (last_ts or now_ms)
-            if age >= abandoned_ms:
-                abandoned_deleted += 1
-            else:
-                continue
-        else:
-            continue
+            considered += 1
+            st = str(g.get("status") or "").strip()
+            ended_at = _best_ts(g.get("endedAt"))
+            created_at = _best_ts(g.get("createdAt"))
+            accepted_at = _best_ts(g.get("acceptedAt"))
+
+            last_ts = _best_ts(ended_at, accepted_at, created_at)
 
-        # Respect batch limits
-        if (ended_deleted + abandoned_deleted) > limit:
-            # roll back the last increment and stop
+            pres = g.get("presence")
+            pres_empty = True
+            if isinstance(pres, dict):
+                pres_empty = len([k for k in pres.keys() if k]) == 0
+
+            # 1) Ended or rejected: remove after a short retention.
+            is_endedish = (st in {"ended", "rejected"}) or (ended_at > 0)
             if is_endedish:
-                ended_deleted -= 1
+                age = now_ms - (ended_at or last_ts or now_ms)
+                if age >= ended_ms:
+                    ended_deleted += 1
+                else:
+                    continue
+
+            # 2) Abandoned: active/pending with no presence for a while.
+            elif st in protect_statuses and pres_empty:
+                age = now_ms - (last_ts or now_ms)
+                if age >= abandoned_ms:
+                    abandoned_deleted += 1
+                else:
+                    continue
             else:
-                abandoned_deleted -= 1
-            break
+                continue
 
-        updates[f"games/{gid}"] = None
-        updates[f"chats/{gid}"] = None
-        updates[f"rtc/{gid}"] = None
-        updates[f"spectators/{gid}"] = None
-        updates[f"roomArchivesV1/{gid}"] = None
+            # Respect batch limits
+            if (ended_deleted + abandoned_deleted) > limit:
+                # roll back the last increment and stop
+                if is_endedish:
+                    ended_deleted -= 1
+                else:
+                    abandoned_deleted -= 1
+                break
+
+            updates[f"games/{gid}"] = None
+            updates[f"chats/{gid}"] = None
+            updates[f"rtc/{gid}"] = None
+            updates[f"spectators/{gid}"] = None
+            updates[f"roomArchivesV1/{gid}"] = None
+    except Exception as e:
+        print(f"[maintenance] stale rooms: /games read interrupted ({e}); pass skipped.")
+        return 0, 0, 0, 0
 
     if updates and not dry_run:
         _chunked_root_update(db, updates)
@@ -365,13 +402,8 @@ def cleanup_stale_rooms(
 
 
 def _rtdb_rest_get_query(path: str, params: Dict[str, Any]) -> Dict[str, Any]:
-    import requests
-
     # _rest_url already includes auth= secret; requests will merge query params safely
-    r = requests.get(_rest_url(path), params=params, timeout=60)
-    r.raise_for_status()
-    data = r.json()
-    return data if isinstance(data, dict) else {}
+    return dict(_rtdb_rest_iter(path, params))
 
 
 def cleanup_expired_training_games(db, now_ms: int, delete_limit: int, dry_run: bool) -> Tuple[int, int]:
@@ -499,36 +531,36 @@ def cleanup_expired_stats_markers(db, now_ms: int, delete_limit: int, dry_run: b
     """
     limit = max(1, int(delete_limit))
 
-    root = _safe_get_dict(db, "statsMarkersV1")
     updates: Dict[str, Any] = {}
     considered = 0
     deleted = 0
 
-    if not isinstance(root, dict):
-        return 0, 0
-
-    for uid, bucket in root.items():
-        if not uid or not isinstance(bucket, dict):
-            continue
-        for mid, row in bucket.items():
-            if not mid:
+    try:
+        for uid, bucket in _iter_items(db, "statsMarkersV1"):
+            if not uid or not isinstance(bucket, dict):
                 continue
-            considered += 1
-            purge_at = 0
-            if isinstance(row, dict):
-                try:
-                    purge_at = int(row.get("purgeAt") or 0)
-                except Exception:
-                    purge_at = 0
-
-            # If purgeAt missing/invalid, keep it (defensive).
-            if purge_at and purge_at <= now_ms:
-                updates[f"statsMarkersV1/{uid}/{mid}"] = None
-                deleted += 1
-                if deleted >= limit:
-                    break
-        if deleted >= limit:
-            break
+            for mid, row in bucket.items():
+                if not mid:
+                    continue
+                considered += 1
+                purge_at = 0
+                if isinstance(row, dict):
+                    try:
+                        purge_at = int(row.get("purgeAt") or 0)
+                    except Exception:
+                        purge_at = 0
+
+                # If purgeAt missing/invalid, keep it (defensive).
+                if purge_at and purge_at <= now_ms:
+                    updates[f"statsMarkersV1/{uid}/{mid}"] = None
+                    deleted += 1
+                    if deleted >= limit:
+                        break
+            if deleted >= limit:
+                break
+    except Exception as e:
+        print(f"[maintenance] stats markers: /statsMarkersV1 read interrupted ({e}); pass skipped.")
+        return 0, 0
 
     if updates and not dry_run:
         _chunked_root_update(db, updates)
@@ -47,10 +47,12 @@ from __future__ import annotations
 import json
 import os
 import time
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 import requests
 
+from rtdb_stream import iter_json_object_items
+
 
 def _env_int(name: str, default: int) -> int:
     try:
@@ -109,6 +111,13 @@ def _rest_get(path: str, extra: str = "") -> Any:
     return r.json()
 
 
+def _rest_iter(path: str, extra: str = "") -> Iterator[Tuple[str, Any]]:
+    """Stream the top-level children of a node without materializing the body."""
+    with requests.get(_rest_url(path, extra), timeout=30, stream=True) as r:
+        r.raise_for_status()
+        yield from iter_json_object_items(r.iter_content(chunk_size=64 * 1024))
+
+
 def _rest_patch(path: str, obj: Dict[str, Any]) -> None:
     r = requests.patch(_rest_url(path), json=obj, timeout=30)
     r.raise_for_status()
@@ -135,6 +144,15 @@ class RTDB:
             return ref.get()
         return _rest_get(path, extra)
 
+    def iter_items(self, path: str) -> Iterator[Tuple[str, Any]]:
+        """Yield (key, child) pairs under `path`; streamed over REST, single get() on Admin."""
+        if self.use_admin:
+            v = self.get(path)
+            if isinstance(v, dict):
+                yield from v.items()
+            return
+        yield from _rest_iter(path)
+
     def put(self, path: str, obj: Any) -> None:
         if DRY_RUN:
             print(f"[DRY_RUN] PUT {path}: {type(obj).__name__}")
@@ -496,75 +514,33 @@ def cleanup_operational_play_data(rtdb: RTDB) -> None:
     stale_ended_ms = max(1, stale_ended_min) * 60 * 1000
     stale_abandoned_ms = max(1, stale_abandoned_min) * 60 * 1000
 
-    games = rtdb.get("games") or {}
-    if not isinstance(games, dict):
-        games = {}
-
-    # Collect protected players currently in active/pending games
+    # Single streamed pass over /games: collect protected players plus candidate
+    # presence rows and rooms in order; the shared op_limit budget is applied after
+    # players, exactly as the sequential passes did.
     protected_uids = set()
-    for gid, g in games.items():
+    presence_paths: List[str] = []
+    room_gids: List[str] = []
+    for gid, g in rtdb.iter_items("games"):
         if not isinstance(g, dict):
             continue
         st = str(g.get("status") or "")
-        if st in protect_statuses:
-            pres = g.get("presence")
-            if isinstance(pres, dict):
-                for uid in pres.keys():
-                    protected_uids.add(str(uid))
-
-    updates: Dict[str, Any] = {}
-    deleted = 0
-
-    # 1) delete stale /players presence rows (not in active/pending games)
-    players = rtdb.get("players") or {}
-    if isinstance(players, dict):
-        for uid, row in players.items():
-            if deleted >= op_limit:
-                break
-            if not isinstance(row, dict):
-                continue
-            if str(uid) in protected_uids:
-                continue
-            ts = row.get("updatedAt") or row.get("lastActiveAt") or row.get("lastSeenAt")
-            try:
-                ts = int(ts)
-            except Exception:
-                continue
-            if now - ts > stale_player_ms:
-                updates[f"players/{uid}"] = None
-                deleted += 1
-
-    # 2) delete stale in-room presence rows under /games/{gid}/presence
-    for gid, g in games.items():
-        if deleted >= op_limit:
-            break
-        if not isinstance(g, dict):
-            continue
         pres = g.get("presence")
-        if not isinstance(pres, dict):
-            continue
-        for uid, prow in list(pres.items()):
-            if deleted >= op_limit:
-                break
-            if not isinstance(prow, dict):
-                continue
-            ts = prow.get("updatedAt") or prow.get("lastActiveAt") or prow.get("lastSeenAt")
-            try:
-                ts = int(ts)
-            except Exception:
-                continue
-            if now - ts > stale_presence_ms:
-                updates[f"games/{gid}/presence/{uid}"] = None
-                deleted += 1
-
-    # 3) delete ended/rejected rooms (and companion nodes) and abandoned rooms
-    for gid, g in games.items():
-        if deleted >= op_limit:
-            break
-        if not isinstance(g, dict):
-            continue
+        if st in protect_statuses and isinstance(pres, dict):
+            for uid in pres.keys():
+                protected_uids.add(str(uid))
+
+        if isinstance(pres, dict):
+            for uid, prow in list(pres.items()):
+                if not isinstance(prow, dict):
+                    continue
+                ts = prow.get("updatedAt") or prow.get("lastActiveAt") or prow.get("lastSeenAt")
+                try:
+                    ts = int(ts)
+                except Exception:
+                    continue
+                if now - ts > stale_presence_ms:
+                    presence_paths.append(f"games/{gid}/presence/{uid}")
 
-        st = str(g.get("status") or "")
         ended_at = g.get("endedAt")
         try:
             ended_at_i = int(ended_at) if ended_at is not None else None
@@ -581,14 +557,11 @@ def cleanup_operational_play_data(rtdb: RTDB) -> None:
                 except Exception:
                     ended_at_i = None
             if ended_at_i is not None and (now - ended_at_i) > stale_ended_ms:
-                for p in (f"games/{gid}", f"chats/{gid}", f"rtc/{gid}", f"spectators/{gid}", f"roomArchivesV1/{gid}"):
-                    updates[p] = None
-                deleted += 1
+                room_gids.append(gid)
                 continue
 
         # abandoned: status protected but presence empty, old timestamp
         if st in protect_statuses:
-            pres = g.get("presence")
             is_empty = not (isinstance(pres, dict) and len(pres) > 0)
             if is_empty:
                 ts = g.get("updatedAt") or g.get("createdAt") or g.get("startedAt")
@@ -597,9 +570,42 @@ def cleanup_operational_play_data(rtdb: RTDB) -> None:
                 except Exception:
                     ts = None
                 if ts is not None and (now - ts) > stale_abandoned_ms:
-                    for p in (f"games/{gid}", f"chats/{gid}", f"rtc/{gid}", f"spectators/{gid}", f"roomArchivesV1/{gid}"):
-                        updates[p] = None
-                    deleted += 1
+                    room_gids.append(gid)
+
+    updates: Dict[str, Any] = {}
+    deleted = 0
+
+    # 1) delete stale /players presence rows (not in active/pending games)
+    for uid, row in rtdb.iter_items("players"):
+        if deleted >= op_limit:
+            break
+        if not isinstance(row, dict):
+            continue
+        if str(uid) in protected_uids:
+            continue
+        ts = row.get("updatedAt") or row.get("lastActiveAt") or row.get("lastSeenAt")
+        try:
+            ts = int(ts)
+        except Exception:
+            continue
+        if now - ts > stale_player_ms:
+            updates[f"players/{uid}"] = None
+            deleted += 1
+
+    # 2) delete stale in-room presence rows under /games/{gid}/presence
+    for path in presence_paths:
+        if deleted >= op_limit:
+            break
+        updates[path] = None
+        deleted += 1
+
+    # 3) delete ended/rejected rooms (and companion nodes) and abandoned rooms
+    for gid in room_gids:
+        if deleted >= op_limit:
+            break
+        for p in (f"games/{gid}", f"chats/{gid}", f"rtc/{gid}", f"spectators/{gid}", f"roomArchivesV1/{gid}"):
+            updates[p] = None
+        deleted += 1
 
     if updates:
         print(f"Applying operational cleanup updates: {len(updates)} paths")
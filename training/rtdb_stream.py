@@ -0,0 +1,95 @@
+# Section: training/rtdb_stream.py — Python utility script
+"""Streaming parser for large RTDB REST responses, shared by the training and maintenance scripts."""
+
+from __future__ import annotations
+
+import codecs
+import json
+import re
+from typing import Any, Iterable, Iterator, Tuple
+
+_JSON_WS = re.compile(r"[ \t\n\r]*")
+# Characters that may continue a number cut off at a chunk boundary.
+_NUM_TAIL = re.compile(r"[0-9eE.+-]*")
+
+
+def iter_json_object_items(chunks: Iterable[bytes]) -> Iterator[Tuple[str, Any]]:
+    """Incrementally parse a top-level JSON object and yield its children one by one.
+
+    Only the child currently being decoded is buffered, so a large node is never held
+    as one string or one fully built dict. A non-object body (e.g. null) yields nothing.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    source = iter(chunks)
+    buf = ""
+    pos = 0
+    eof = False
+
+    def _fill(min_len: int) -> None:
+        nonlocal buf, pos, eof
+        buf = buf[pos:]
+        pos = 0
+        while not eof and len(buf) < min_len:
+            chunk = next(source, None)
+            if chunk is None:
+                buf += utf8.decode(b"", final=True)
+                eof = True
+            elif chunk:
+                buf += utf8.decode(chunk)
+
+    def _decode() -> Any:
+        nonlocal pos
+        while True:
+            try:
+                val, end = decoder.raw_decode(buf, pos)
+                # A number is only complete once something other than a digit, sign, dot or
+                # exponent follows it; "1." may be the start of "1.5".
+                number = isinstance(val, (int, float)) and not isinstance(val, bool)
+                if eof or (end < len(buf) and not (number and _NUM_TAIL.match(buf, end).end() == len(buf))):
+                    pos = end
+                    return val
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            _fill(2 * (len(buf) - pos) + 65536)
+
+    state = "open"
+    while True:
+        pos = _JSON_WS.match(buf, pos).end()
+        if pos >= len(buf):
+            if eof:
+                if state != "open":
+                    raise ValueError("Truncated JSON object in response body")
+                return
+            _fill(1)
+            continue
+
+        ch = buf[pos]
+        if state == "open":
+            if ch != "{":
+                return
+            pos += 1
+            state = "first"
+        elif state in ("first", "key"):
+            if state == "first" and ch == "}":
+                return
+            key = _decode()
+            if not isinstance(key, str):
+                raise ValueError("Expected object key in JSON body")
+            state = "colon"
+        elif state == "colon":
+            if ch != ":":
+                raise ValueError("Expected ':' in JSON body")
+            pos += 1
+            state = "value"
+        elif state == "value":
+            yield key, _decode()
+            state = "sep"
+        else:
+            if ch == "}":
+                return
+            if ch != ",":
+                raise ValueError("Expected ',' or '}' in JSON body")
+            pos += 1
+            state = "key"
@@ -0,0 +1,188 @@
+/* Section: training/tests/record_games.js — Node fixture recorder */
+
+// Plays seeded hot-seat games through the browser code (js/game.js + js/ui.js) and writes
+// what TrainRecorder uploads to trainGamesV3. Moves go through Input.onBoardClick and
+// endKillPressed, so samples, steps and turn bookkeeping come from the client, not dhamet.py.
+//
+//   node training/tests/record_games.js [games] [out.json]
+
+"use strict";
+
+const fs = require("fs");
+const path = require("path");
+const vm = require("vm");
+
+const ROOT = path.resolve(__dirname, "..", "..");
+const CELL_PX = 100;
+
+// Any DOM, canvas or i18n call the game code makes lands here and does nothing.
+function inert() {
+  const store = {};
+  return new Proxy(function () {}, {
+    get(_t, k) {
+      if (k === "then") return undefined;
+      if (k === Symbol.toPrimitive) return () => 0;
+      if (!(k in store)) store[k] = inert();
+      return store[k];
+    },
+    set(_t, k, v) {
+      store[k] = v;
+      return true;
+    },
+    apply: () => inert(),
+    construct: () => inert(),
+  });
+}
+
+function mulberry32(seed) {
+  return function () {
+    seed = (seed + 0x6d2b79f5) | 0;
+    let t = Math.imul(seed ^ (seed >>> 15), 1 | seed);
+    t = (t + Math.imul(t ^ (t >>> 7), 61 | t)) ^ t;
+    return ((t ^ (t >>> 14)) >>> 0) / 4294967296;
+  };
+}
+
+function loadClient(records) {
+  const canvas = inert();
+  const document = inert();
+  document.querySelector = (sel) => (sel === "#board" ? canvas : inert());
+  document.getElementById = (id) => (id === "board" ? canvas : inert());
+  canvas.width = 9 * CELL_PX;
+  canvas.height = 9 * CELL_PX;
+  canvas.getBoundingClientRect = () => ({ left: 0, top: 0, width: 9 * CELL_PX, height: 9 * CELL_PX });
+
+  let pushes = 0;
+  const trainRef = {
+    push: () => ({
+      key: `-Nrecorded${String(pushes++).padStart(3, "0")}`,
+      set: async (record) => { records.push(JSON.parse(JSON.stringify(record))); },
+    }),
+  };
+  const firebase = {
+    apps: [{}],
+    database: () => ({ ref: (p) => (p === "trainGamesV3" ? trainRef : inert()) }),
+  };
+
+  const sandbox = {
+    console: { log() {}, info() {}, warn() {}, error() {}, debug() {} },
+    setTimeout: () => 0,
+    clearTimeout() {},
+    setInterval: () => 0,
+    clearInterval() {},
+    requestAnimationFrame: () => 0,
+    btoa: (s) => Buffer.from(s, "binary").toString("base64"),
+    atob: (s) => Buffer.from(s, "base64").toString("binary"),
+    performance: { now: () => 0 },
+    document,
+    navigator: {},
+    localStorage: inert(),
+    sessionStorage: inert(),
+    firebase,
+    popup() {},
+    Modal: inert(),
+  };
+  const ctx = vm.createContext(sandbox);
+  sandbox.window = vm.runInContext("globalThis", ctx);
+  sandbox.window.addEventListener = () => {};
+  // pages/game.html defines qs, t, sideLabel and the kill-timer check inline before game.js.
+  const page = fs.readFileSync(path.join(ROOT, "pages", "game.html"), "utf8");
+  const inline = [...page.matchAll(/<script>([\s\S]*?)<\/script>/g)].map((m) => m[1]).find((s) => s.includes("shouldShowKillTimerAlert"));
+  vm.runInContext(inline, ctx, { filename: "pages/game.html" });
+  for (const f of ["js/game.js", "js/ui.js"]) {
+    vm.runInContext(fs.readFileSync(path.join(ROOT, f), "utf8"), ctx, { filename: f });
+  }
+  // Rendering and logging need the page; the rules, Turn and TrainRecorder do not.
+  vm.runInContext(`
+    for (const o of [UI, Visual, Board3D]) {
+      for (const k of Object.keys(o)) if (typeof o[k] === "function") o[k] = () => {};
+    }
+    var __clock = 1760000000000;
+    Date.now = () => __clock;
+    window.Online = {
+      isActive: true,
+      isSpectator: false,
+      _isApplyingRemote: false,
+      get mySide() { return Game.player; },
+      recordLocalStep() {},
+      sendMoveToFirebase() {},
+      cacheSouflaPending() {},
+      clearPendingLocalMove() {},
+    };
+  `, ctx);
+  return ctx;
+}
+
+function click(ctx, idx) {
+  ctx.__idx = idx;
+  vm.runInContext(`
+    (() => {
+      const [vr, vc] = toViewRC(Math.floor(__idx / BOARD_N), __idx % BOARD_N);
+      Input.onBoardClick({ clientX: (vc + 0.5) * ${CELL_PX}, clientY: (vr + 0.5) * ${CELL_PX} });
+    })();
+  `, ctx);
+}
+
+// Mostly takes captures and keeps chains going, as people do; sometimes steps or stops early.
+function pickAction(ctx, rand) {
+  const acts = vm.runInContext(`
+    (() => {
+      const { mask } = legalActions();
+      const out = [];
+      for (let a = 0; a < N_ACTIONS; a++) {
+        if (!mask[a]) continue;
+        const cap = a === ACTION_ENDCHAIN ? false : classifyCapture(Math.floor(a / N_CELLS), a % N_CELLS)[0];
+        out.push([a, cap]);
+      }
+      // A forced-opening capture offers no further jump; the player presses "end kill".
+      if (Game.inChain && !out.some(([a]) => a === ACTION_ENDCHAIN || Math.floor(a / N_CELLS) === Game.chainPos)) {
+        return [[ACTION_ENDCHAIN, false]];
+      }
+      return out;
+    })();
+  `, ctx);
+  if (!acts.length) return null;
+  const caps = acts.filter(([, cap]) => cap).map(([a]) => a);
+  if (caps.length && rand() < 0.9) return caps[Math.floor(rand() * caps.length)];
+  const end = acts.find(([a]) => a === ctx.ACTION_ENDCHAIN_ID);
+  if (end && rand() < 0.7) return end[0];
+  return acts[Math.floor(rand() * acts.length)][0];
+}
+
+async function playGame(ctx, records, seed, maxPlies) {
+  const rand = mulberry32(seed);
+  const before = records.length;
+  vm.runInContext(`Game.settings.starter = ${seed % 2 ? '"white"' : '"black"'}; setupInitialBoard(); Turn.start();`, ctx);
+  ctx.ACTION_ENDCHAIN_ID = vm.runInContext("ACTION_ENDCHAIN", ctx);
+  for (let ply = 0; ply < maxPlies && records.length === before; ply++) {
+    if (vm.runInContext("Game.gameOver", ctx)) break;
+    const a = pickAction(ctx, rand);
+    if (a == null) break;
+    ctx.__clock += 800 + Math.floor(rand() * 3000);
+    if (a === ctx.ACTION_ENDCHAIN_ID) {
+      vm.runInContext("endKillPressed()", ctx);
+    } else {
+      click(ctx, Math.floor(a / 81));
+      click(ctx, a % 81);
+    }
+    await new Promise((r) => setImmediate(r));
+  }
+  for (let i = 0; i < 20 && records.length === before; i++) await new Promise((r) => setImmediate(r));
+  return records.length > before;
+}
+
+async function main() {
+  const want = Number(process.argv[2] || 2);
+  const out = process.argv[3] || path.join(__dirname, "data", "train_games_sample.json");
+  const records = [];
+  const ctx = loadClient(records);
+  for (let seed = 1; records.length < want && seed < 500; seed++) {
+    await playGame(ctx, records, seed, 400);
+  }
+  const games = {};
+  for (const r of records) games[r.id] = r;
+  fs.writeFileSync(out, JSON.stringify(games) + "\n");
+  console.log(`wrote ${records.length} games to ${out}`);
+}
+
+main();
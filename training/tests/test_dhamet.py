@@ -0,0 +1,147 @@
+# Section: training/tests/test_dhamet.py — Python test module
+"""Rules checks for training/dhamet.py. Run with `python -m pytest training/tests`."""
+
+from __future__ import annotations
+
+import copy
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import dhamet as d  # noqa: E402
+
+DATA = Path(__file__).resolve().parent / "data"
+
+
+def cell(r: int, c: int) -> int:
+    return r * d.BOARD_N + c
+
+
+def action(fr: int, to: int) -> int:
+    return fr * d.N_CELLS + to
+
+
+def position(pieces, player: int = d.TOP) -> d.Position:
+    board = [0] * d.N_CELLS
+    for (r, c), v in pieces.items():
+        board[cell(r, c)] = v
+    return d.Position.from_board(board, player)
+
+
+# Uploaded by the browser's TrainRecorder while record_games.js clicks through js/game.js + js/ui.js;
+# regenerate with `node training/tests/record_games.js 3`.
+@pytest.fixture(scope="module")
+def games():
+    with open(DATA / "train_games_sample.json", "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_sample_games_replay_cleanly(games):
+    assert games
+    for gid, g in games.items():
+        assert d.cross_check_game(g) == [], gid
+
+
+def test_sample_games_cover_capture_chains(games):
+    samples = [s for g in games.values() for s in g["samples"]]
+    assert any(s["s"]["ic"] == 1 for s in samples)
+    assert any(s["a"] == d.ACTION_ENDCHAIN for s in samples)
+
+
+def test_sample_games_actor_is_side_to_move(games):
+    for g in games.values():
+        assert all(s["actor"] == s["s"]["p"] for s in g["samples"])
+        assert len(g["steps"]) == len(g["samples"])
+
+
+def test_cross_check_flags_illegal_action(games):
+    g = copy.deepcopy(next(iter(games.values())))
+    s = g["samples"][0]
+    pos = d.Position.from_snapshot(s["s"])
+    legal = set(d.legal_actions(pos))
+    s["a"] = next(a for a in range(d.N_ACTIONS) if a not in legal)
+    problems = d.cross_check_game(g)
+    assert problems and problems[0].startswith("sample 0:")
+
+
+def test_cross_check_flags_wrong_chain_state(games):
+    g = copy.deepcopy(next(iter(games.values())))
+    samples = g["samples"]
+    i = next(
+        i
+        for i in range(len(samples) - 1)
+        if samples[i]["a"] != d.ACTION_ENDCHAIN and samples[i + 1]["s"]["cp"] == samples[i]["a"] % d.N_CELLS
+    )
+    samples[i + 1]["s"] = dict(samples[i + 1]["s"], b=samples[i]["s"]["b"])
+    assert any("does not reproduce" in p for p in d.cross_check_game(g))
+
+
+@pytest.mark.parametrize("starter", [d.TOP, d.BOT])
+def test_forced_opening(starter):
+    pos = d.play_forced_opening(d.initial_position(starter))
+    assert bin(pos.pieces(d.TOP)).count("1") == 35
+    assert bin(pos.pieces(d.BOT)).count("1") == 35
+    assert pos.player == starter
+    assert pos.chain == -1
+    assert not pos.top_kings and not pos.bot_kings
+
+
+def test_promotion_waits_for_end_of_chain():
+    pos = position({(6, 4): d.MAN, (7, 4): -d.MAN, (8, 3): -d.MAN, (0, 0): -d.MAN})
+    mid, jumped = d.play(pos, action(cell(6, 4), cell(8, 4)))
+    assert jumped == cell(7, 4)
+    # On the far rank but still capturing, so still a man.
+    assert mid.chain == cell(8, 4)
+    assert mid.player == d.TOP
+    assert mid.at(cell(8, 4)) == d.MAN
+
+    done, jumped = d.play(mid, action(cell(8, 4), cell(8, 2)))
+    assert jumped == cell(8, 3)
+    assert done.chain == -1
+    assert done.player == d.BOT
+    assert done.at(cell(8, 2)) == d.KING
+
+
+def test_promotion_on_endchain():
+    pos = position({(6, 4): d.MAN, (7, 4): -d.MAN, (8, 3): -d.MAN, (0, 0): -d.MAN})
+    mid, _jumped = d.play(pos, action(cell(6, 4), cell(8, 4)))
+    done, _jumped = d.play(mid, d.ACTION_ENDCHAIN)
+    assert done.player == d.BOT
+    assert done.at(cell(8, 4)) == d.KING
+    with pytest.raises(ValueError):
+        d.play(done, d.ACTION_ENDCHAIN)
+
+
+# A can take two pieces, B only one.
+A, B = cell(2, 2), cell(2, 6)
+SOUFLA = {(2, 2): d.MAN, (3, 2): -d.MAN, (5, 2): -d.MAN, (2, 6): d.MAN, (3, 6): -d.MAN, (8, 8): -d.MAN}
+
+
+def test_longest_capture():
+    pos = position(SOUFLA)
+    assert d.max_capture_len(pos, A) == 2
+    assert d.max_capture_len(pos, B) == 1
+    assert d.longest_for_player(pos, d.TOP) == ({A: 2, B: 1}, 2, [A])
+    assert d.longest_paths(pos, A, 2) == [([cell(4, 2), cell(6, 2)], [cell(3, 2), cell(5, 2)])]
+
+
+@pytest.mark.parametrize(
+    "started_from, captures_done, offenders",
+    [
+        (None, 0, [A]),  # plain step while a capture was available
+        (B, 1, [A]),  # captured with a piece that had the shorter sequence
+        (A, 1, [A]),  # stopped the longest sequence early
+        (A, 2, []),  # took the longest sequence in full
+    ],
+)
+def test_soufla_offenders(started_from, captures_done, offenders):
+    assert d.soufla_offenders(position(SOUFLA), started_from, captures_done) == offenders
+
+
+def test_no_offenders_without_captures():
+    pos = position({(2, 2): d.MAN, (8, 8): -d.MAN})
+    assert d.soufla_offenders(pos, None, 0) == []
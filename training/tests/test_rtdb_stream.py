@@ -0,0 +1,74 @@
+# Section: training/tests/test_rtdb_stream.py — Python test module
+"""Chunk-boundary checks for training/rtdb_stream.py. Run with `python -m pytest training/tests`."""
+
+from __future__ import annotations
+
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from rtdb_stream import iter_json_object_items  # noqa: E402
+
+DOC = {
+    "-Na": {"n": 12345, "f": -1.5e-3, "ok": True, "none": None, "list": [1, 2.25, "x"]},
+    "-Nb": 1.5,
+    "-Nc": -42,
+    "-Nd": 6e10,
+    "quote\"key": "back\\slash \"quoted\" é 😀 tab\t",
+    "-Ne": "déjà vu",
+    "-Nf": False,
+    "-Ng": 0,
+}
+
+
+def chunked(raw: bytes, *cuts: int):
+    bounds = [0, *cuts, len(raw)]
+    return [raw[a:b] for a, b in zip(bounds, bounds[1:])]
+
+
+@pytest.mark.parametrize("ensure_ascii", [True, False])
+def test_every_single_split(ensure_ascii):
+    # Covers cuts inside numbers, exponents, literals, escapes and multi-byte UTF-8.
+    raw = json.dumps(DOC, ensure_ascii=ensure_ascii, separators=(",", ":")).encode("utf-8")
+    for cut in range(1, len(raw)):
+        assert dict(iter_json_object_items(chunked(raw, cut))) == DOC, cut
+
+
+def test_byte_at_a_time():
+    raw = json.dumps(DOC, ensure_ascii=False, indent=1).encode("utf-8")
+    assert dict(iter_json_object_items(raw[i : i + 1] for i in range(len(raw)))) == DOC
+
+
+@pytest.mark.parametrize(
+    "chunks, expected",
+    [
+        ([b'{"a": 1.', b"5}"], {"a": 1.5}),
+        ([b'{"a": 1', b'2, "b": 3}'], {"a": 12, "b": 3}),
+        ([b'{"a": 2e', b"3}"], {"a": 2000.0}),
+        ([b'{"a": -', b"7}"], {"a": -7}),
+        ([b'{"a": 7', b"}"], {"a": 7}),
+        ([b'{"a": 7 ', b"}"], {"a": 7}),
+        ([b'{"a": "x\\', b'"y"}'], {"a": 'x"y'}),
+        ([b'{"a": "\\u00', b'e9"}'], {"a": "é"}),
+        ([b'{"a": tr', b"ue}"], {"a": True}),
+    ],
+)
+def test_splits_inside_values(chunks, expected):
+    assert dict(iter_json_object_items(chunks)) == expected
+
+
+def test_non_object_bodies_yield_nothing():
+    assert list(iter_json_object_items([b"null"])) == []
+    assert list(iter_json_object_items([b"{}"])) == []
+    assert list(iter_json_object_items([])) == []
+
+
+def test_truncated_body_raises():
+    with pytest.raises(ValueError):
+        list(iter_json_object_items([b'{"a": 1, "b": {"c"']))
+    with pytest.raises(ValueError):
+        list(iter_json_object_items([b'{"a": 1,']))
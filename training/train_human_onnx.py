@@ -4,13 +4,23 @@ from __future__ import annotations
 
 import argparse
 import base64
-import dataclasses
+import binascii
+import hashlib
+import copy
 import json
 import os
+import queue
 import re
+import signal
+import threading
 import time
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, replace
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
 
 import numpy as np
 
@@ -20,6 +30,9 @@ import torch.nn as nn
 import torch.nn.functional as F
 import onnx
 
+import dhamet
+from rtdb_stream import iter_json_object_items
+
 
 
 
@@ -48,6 +61,8 @@ DIAG_A_SEGMENTS = [
     [[0, 6], [6, 0]],
     [[0, 8], [8, 0]],
     [[2, 8], [8, 2]],
+    [[4, 8], [8, 4]],
+    [[6, 8], [8, 6]],
 ]
 DIAG_B_SEGMENTS = [
     [[0, 6], [2, 8]],
@@ -55,6 +70,8 @@ DIAG_B_SEGMENTS = [
     [[0, 2], [6, 8]],
     [[0, 0], [8, 8]],
     [[2, 0], [8, 6]],
+    [[4, 0], [8, 4]],
+    [[6, 0], [8, 2]],
 ]
 
 
@@ -112,6 +129,42 @@ def _make_masks() -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.nd
 
 IS_WIDE, MASK_BACK_TOP, MASK_BACK_BOT, MASK_CORNERS, MASK_EYES, MASK_MIDBACK = _make_masks()
 
+# Planes 6..11 never depend on the position; built once and broadcast per batch.
+STATIC_PLANES = np.stack(
+    [IS_WIDE, MASK_BACK_TOP, MASK_BACK_BOT, MASK_CORNERS, MASK_EYES, MASK_MIDBACK],
+    axis=0,
+).astype(np.float32)
+
+# Bumped whenever the input planes mean something else, so checkpoints trained on the old
+# encoding start over. 2: IS_WIDE covers all seven diagonal segments, as in js/game.js.
+FEATURE_VERSION = 2
+
+
+def _make_symmetries() -> Tuple[np.ndarray, np.ndarray]:
+    """Cell and action lookup tables for the board symmetries that preserve the rules.
+
+    0: identity, 1: left-right mirror, 2: vertical flip with TOP/BOT swapped, 3: both.
+    Every table is its own inverse; ACTION_ENDCHAIN maps to itself.
+    """
+    r, c = np.divmod(np.arange(N_CELLS), BOARD_N)
+    cells = np.stack([
+        r * BOARD_N + c,
+        r * BOARD_N + (BOARD_N - 1 - c),
+        (BOARD_N - 1 - r) * BOARD_N + c,
+        (BOARD_N - 1 - r) * BOARD_N + (BOARD_N - 1 - c),
+    ]).astype(np.int64)
+    actions = np.empty((len(cells), N_ACTIONS), dtype=np.int16)
+    fr, to = np.divmod(np.arange(ACTION_ENDCHAIN), N_CELLS)
+    for k, perm in enumerate(cells):
+        actions[k, :ACTION_ENDCHAIN] = perm[fr] * N_CELLS + perm[to]
+        actions[k, ACTION_ENDCHAIN] = ACTION_ENDCHAIN
+    return cells, actions
+
+
+SYM_CELLS, SYM_ACTIONS = _make_symmetries()
+SYM_COLOR_SWAP = np.array([False, False, True, True])
+AUGMENT_SYMMETRIES = {"none": (0,), "mirror": (0, 1), "all": (0, 1, 2, 3)}
+
 
 
 
@@ -131,22 +184,69 @@ class ResidualBlock(nn.Module):
         return F.relu(x + h)
 
 
+class FactorizedPolicy(nn.Module):
+    """Scores action from*81+to as <from-embedding, to-embedding> plus per-square biases.
+
+    1x1 convs give every square a `dim`-wide from and to embedding; the 81x81 pair logits
+    come from one batched matmul and a pooled linear adds the ACTION_ENDCHAIN logit, so
+    the output keeps the dense head's (B, N_ACTIONS) layout at a fraction of its weights.
+    """
+
+    def __init__(self, channels: int, dim: int = 32):
+        super().__init__()
+        self.dim = dim
+        self.maps = nn.Sequential(
+            nn.Conv2d(channels, channels, 1, bias=False),
+            nn.BatchNorm2d(channels),
+            nn.ReLU(inplace=True),
+            nn.Conv2d(channels, 2 * dim + 2, 1),
+        )
+        self.end = nn.Linear(channels, 1)
+        self.scale = float(dim) ** -0.5
+
+    def forward(self, h: torch.Tensor) -> torch.Tensor:
+        m = self.maps(h).flatten(2)
+        d = self.dim
+        fr = m[:, :d].transpose(1, 2)
+        to = m[:, d : 2 * d]
+        pair = torch.bmm(fr, to) * self.scale + m[:, 2 * d].unsqueeze(2) + m[:, 2 * d + 1].unsqueeze(1)
+        end = self.end(h.mean(dim=(2, 3)))
+        return torch.cat([pair.flatten(1), end], dim=1)
+
+
 class ZamatNet(nn.Module):
-    def __init__(self, in_channels: int = 12, channels: int = 64, num_blocks: int = 4, n_actions: int = N_ACTIONS):
+    def __init__(
+        self,
+        in_channels: int = 12,
+        channels: int = 64,
+        num_blocks: int = 4,
+        n_actions: int = N_ACTIONS,
+        policy_head: str = "dense",
+    ):
         super().__init__()
+        self.channels = channels
+        self.num_blocks = num_blocks
+        self.policy_head = policy_head
         self.stem = nn.Sequential(
             nn.Conv2d(in_channels, channels, 3, padding=1, bias=False),
             nn.BatchNorm2d(channels),
             nn.ReLU(inplace=True),
         )
         self.blocks = nn.Sequential(*[ResidualBlock(channels) for _ in range(num_blocks)])
-        self.policy = nn.Sequential(
-            nn.Conv2d(channels, 2, 1, bias=False),
-            nn.BatchNorm2d(2),
-            nn.ReLU(inplace=True),
-            nn.Flatten(),
-            nn.Linear(2 * BOARD_N * BOARD_N, n_actions),
-        )
+        if policy_head == "factorized":
+            if n_actions != N_ACTIONS:
+                raise ValueError("factorized policy head needs the from*81+to action layout")
+            self.policy: nn.Module = FactorizedPolicy(channels)
+        elif policy_head == "dense":
+            self.policy = nn.Sequential(
+                nn.Conv2d(channels, 2, 1, bias=False),
+                nn.BatchNorm2d(2),
+                nn.ReLU(inplace=True),
+                nn.Flatten(),
+                nn.Linear(2 * BOARD_N * BOARD_N, n_actions),
+            )
+        else:
+            raise ValueError(f"unknown policy head: {policy_head}")
         self.value_head = nn.Sequential(
             nn.Conv2d(channels, 1, 1, bias=False),
             nn.BatchNorm2d(1),
@@ -158,6 +258,10 @@ class ZamatNet(nn.Module):
             nn.Tanh(),
         )
 
+    def arch(self) -> Dict[str, Any]:
+        """Constructor arguments recorded in checkpoint meta to rebuild this network."""
+        return {"channels": self.channels, "num_blocks": self.num_blocks, "policy_head": self.policy_head}
+
     def forward(self, x: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
         h = self.stem(x)
         h = self.blocks(h)
@@ -166,8 +270,50 @@ class ZamatNet(nn.Module):
         return logits, value.squeeze(-1)
 
 
-def export_onnx_model(net: ZamatNet, path: Path, opset_version: int = 14) -> None:
+def _fuse_conv_bn(net: nn.Module) -> nn.Module:
+    """Eval-mode copy of net with every Conv2d+BatchNorm2d pair folded into one Conv2d."""
+    from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+    fused = copy.deepcopy(net).eval()
+    for mod in fused.modules():
+        if isinstance(mod, ResidualBlock):
+            mod.conv1, mod.bn1 = fuse_conv_bn_eval(mod.conv1, mod.bn1), nn.Identity()
+            mod.conv2, mod.bn2 = fuse_conv_bn_eval(mod.conv2, mod.bn2), nn.Identity()
+        elif isinstance(mod, nn.Sequential):
+            for i in range(len(mod) - 1):
+                if isinstance(mod[i], nn.Conv2d) and isinstance(mod[i + 1], nn.BatchNorm2d):
+                    mod[i], mod[i + 1] = fuse_conv_bn_eval(mod[i], mod[i + 1]), nn.Identity()
+    return fused
+
+
+class PolicyOnly(nn.Module):
+    """ZamatNet without the value head, for clients that only sample moves."""
+
+    def __init__(self, net: ZamatNet):
+        super().__init__()
+        self.net = net
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return self.net.policy(self.net.blocks(self.net.stem(x)))
+
+
+def export_onnx_model(
+    net: ZamatNet,
+    path: Path,
+    opset_version: int = 14,
+    fuse_bn: bool = False,
+    policy_only: bool = False,
+) -> None:
     net_cpu = net.to("cpu").eval()
+    if fuse_bn:
+        try:
+            net_cpu = _fuse_conv_bn(net_cpu)
+        except Exception as e:
+            print(f"[export] Conv+BN fusion failed ({e}); exporting the eager graph.")
+    # The policy-only graph keeps the "policy_value_logits" name the browser reads; "value" is absent.
+    output_names = ["policy_value_logits"] if policy_only else ["policy_value_logits", "value"]
+    if policy_only:
+        net_cpu = PolicyOnly(net_cpu).eval()
     dummy = torch.zeros((1, 12, 9, 9), dtype=torch.float32)
     path.parent.mkdir(parents=True, exist_ok=True)
 
@@ -179,15 +325,11 @@ def export_onnx_model(net: ZamatNet, path: Path, opset_version: int = 14) -> Non
                 dummy,
                 str(path),
                 input_names=["state"],
-                output_names=["policy_value_logits", "value"],
+                output_names=output_names,
                 opset_version=opset_version,
                 export_params=True,
                 do_constant_folding=True,
-                dynamic_axes={
-                    "state": {0: "batch"},
-                    "policy_value_logits": {0: "batch"},
-                    "value": {0: "batch"},
-                },
+                dynamic_axes={"state": {0: "batch"}, **{name: {0: "batch"} for name in output_names}},
             )
             
         except Exception:
@@ -196,7 +338,7 @@ def export_onnx_model(net: ZamatNet, path: Path, opset_version: int = 14) -> Non
                 dummy,
                 str(path),
                 input_names=["state"],
-                output_names=["policy_value_logits", "value"],
+                output_names=output_names,
                 opset_version=opset_version,
                 export_params=True,
                 do_constant_folding=True,
@@ -209,6 +351,239 @@ def export_onnx_model(net: ZamatNet, path: Path, opset_version: int = 14) -> Non
         print(f"[export] Error during re-saving: {e}")
 
 
+ONNX_OPT_LEVELS = ("off", "basic", "extended")
+
+
+def _onnx_node_count(path: Path) -> int:
+    return len(onnx.load(str(path)).graph.node)
+
+
+def _ort_outputs(path: Path, x: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Run an exported model on CPU onnxruntime; batch-1 graphs are fed row by row.
+
+    Policy-only graphs return None for the value.
+    """
+    import onnxruntime as ort
+
+    sess = ort.InferenceSession(str(path), providers=["CPUExecutionProvider"])
+    name = sess.get_inputs()[0].name
+    if sess.get_inputs()[0].shape[0] == 1:
+        outs = [sess.run(None, {name: x[i : i + 1]}) for i in range(len(x))]
+    else:
+        outs = [sess.run(None, {name: x})]
+    logits = np.concatenate([o[0] for o in outs])
+    value = np.concatenate([o[1] for o in outs]) if len(outs[0]) > 1 else None
+    return logits, value
+
+
+def _max_drift(net: ZamatNet, path: Path, x: np.ndarray) -> Tuple[float, float]:
+    """Largest absolute difference between the torch model and the ONNX file (policy, value)."""
+    with torch.inference_mode():
+        ref_logits, ref_value = net.to("cpu").eval()(torch.from_numpy(x))
+    logits, value = _ort_outputs(path, x)
+    value_drift = 0.0 if value is None else float(np.max(np.abs(value.reshape(-1) - ref_value.numpy().reshape(-1))))
+    return float(np.max(np.abs(logits - ref_logits.numpy()))), value_drift
+
+
+def export_inference_model(
+    net: ZamatNet,
+    path: Path,
+    sample_x: np.ndarray,
+    level: str = "basic",
+    atol: float = 1e-3,
+) -> Dict[str, Any]:
+    """Export the shipped inference graph: Conv+BN folded, then onnxruntime's offline optimizer.
+
+    "basic" keeps standard ONNX ops (constant folding, redundant node removal, Conv+BN/Add/Mul
+    fusions); "extended" also fuses Conv+ReLU into com.microsoft FusedConv, which needs an
+    onnxruntime build with contrib ops. Each candidate is checked against the torch model on
+    sample_x; the first one within atol is kept, falling back to the plain export.
+    Returns a report for the prepare stats.
+    """
+    report: Dict[str, Any] = {"level": level, "atol": atol}
+    raw = path.with_name(path.stem + ".raw.onnx")
+    export_onnx_model(net, raw, fuse_bn=True)
+    report["nodes_exported"] = _onnx_node_count(raw)
+    candidates: List[Tuple[str, Path]] = []
+    if level != "off":
+        try:
+            import onnxruntime as ort
+
+            opts = ort.SessionOptions()
+            opts.graph_optimization_level = (
+                ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+                if level == "extended"
+                else ort.GraphOptimizationLevel.ORT_ENABLE_BASIC
+            )
+            opt = path.with_name(path.stem + ".opt.onnx")
+            opts.optimized_model_filepath = str(opt)
+            ort.InferenceSession(str(raw), sess_options=opts, providers=["CPUExecutionProvider"])
+            candidates.append((level, opt))
+        except Exception as e:
+            report["optimizer_error"] = str(e)
+            print(f"[export] onnxruntime optimizer unavailable ({e}); shipping the folded export.")
+    candidates.append(("folded", raw))
+
+    chosen = None
+    try:
+        for name, cand in candidates:
+            policy_drift, value_drift = _max_drift(net, cand, sample_x)
+            report[name] = {"nodes": _onnx_node_count(cand), "policy_drift": policy_drift, "value_drift": value_drift}
+            if policy_drift <= atol and value_drift <= atol:
+                chosen = (name, cand)
+                break
+            print(f"[export] {name} graph drifts from torch (policy {policy_drift:.2e}, value {value_drift:.2e}); not shipped.")
+    except Exception as e:
+        report["verify_error"] = str(e)
+        print(f"[export] Could not verify optimized graphs ({e}); shipping the unfused export.")
+
+    if chosen is None:
+        export_onnx_model(net, path, fuse_bn=False)
+        report["shipped"] = "unfused"
+    else:
+        os.replace(chosen[1], path)
+        report["shipped"] = chosen[0]
+        print(f"[export] Shipped {chosen[0]} graph: {report['nodes_exported']} -> {report[chosen[0]]['nodes']} nodes")
+    for tmp in (raw, path.with_name(path.stem + ".opt.onnx")):
+        if tmp.exists():
+            tmp.unlink()
+    return report
+
+
+def quantize_int8_model(
+    float_path: Path,
+    path: Path,
+    calib_x: np.ndarray,
+    probe_x: np.ndarray,
+    min_agreement: float = 0.97,
+) -> Optional[Dict[str, Any]]:
+    """Write a statically quantized INT8 copy of an exported float model.
+
+    Activations are calibrated on calib_x (training rows); weights are quantized per channel in
+    QDQ format, which onnxruntime-web folds into QLinearConv/QLinearMatMul. The copy is kept
+    only if its legal-move top-1 agrees with the float model on at least min_agreement of
+    probe_x. Returns the report (bytes, floatBytes, policyAgreement, valueDrift) or None.
+    """
+    try:
+        from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+    except ImportError as e:
+        print(f"[int8] onnxruntime.quantization unavailable ({e}); no INT8 model.")
+        return None
+
+    import onnxruntime as ort
+
+    inp = ort.InferenceSession(str(float_path), providers=["CPUExecutionProvider"]).get_inputs()[0]
+    rows = 1 if inp.shape[0] == 1 else 64
+
+    class _Reader(CalibrationDataReader):
+        def __init__(self) -> None:
+            self.chunks = iter([calib_x[i : i + rows] for i in range(0, len(calib_x), rows)])
+
+        def get_next(self) -> Optional[Dict[str, np.ndarray]]:
+            chunk = next(self.chunks, None)
+            return None if chunk is None else {inp.name: np.ascontiguousarray(chunk)}
+
+    try:
+        quantize_static(
+            str(float_path),
+            str(path),
+            _Reader(),
+            quant_format=QuantFormat.QDQ,
+            per_channel=True,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+        )
+        ref_logits, ref_value = _ort_outputs(float_path, probe_x)
+        logits, value = _ort_outputs(path, probe_x)
+    except Exception as e:
+        print(f"[int8] Quantization failed ({e}); no INT8 model.")
+        path.unlink(missing_ok=True)
+        return None
+
+    mask = _legal_masks(probe_x)
+    agree = float(np.mean(
+        np.where(mask, ref_logits, -np.inf).argmax(axis=1) == np.where(mask, logits, -np.inf).argmax(axis=1)
+    ))
+    value_drift = None
+    if ref_value is not None and value is not None:
+        value_drift = float(np.max(np.abs(value.reshape(-1) - ref_value.reshape(-1))))
+    report = {
+        "bytes": path.stat().st_size,
+        "floatBytes": float_path.stat().st_size,
+        "policyAgreement": agree,
+        "valueDrift": value_drift,
+        "calibrationSamples": int(len(calib_x)),
+    }
+    print(
+        f"[int8] {report['floatBytes']} -> {report['bytes']} bytes, top-1 agreement {agree:.3f} "
+        f"on {len(probe_x)} positions"
+    )
+    if agree < min_agreement:
+        print(f"[int8] Agreement below {min_agreement:.3f}; INT8 model not published.")
+        path.unlink(missing_ok=True)
+        return None
+    return report
+
+
+def _ort_latency(path: Path, x: np.ndarray, batch: int, runs: int = 50, warmup: int = 5) -> Dict[str, float]:
+    """p50/p99 wall time in ms of one CPU onnxruntime call at the given batch size."""
+    import onnxruntime as ort
+
+    opts = ort.SessionOptions()
+    opts.intra_op_num_threads = 1
+    opts.inter_op_num_threads = 1
+    sess = ort.InferenceSession(str(path), sess_options=opts, providers=["CPUExecutionProvider"])
+    name = sess.get_inputs()[0].name
+    if sess.get_inputs()[0].shape[0] == 1 and batch > 1:
+        return {}
+    rows = np.resize(np.arange(len(x)), batch)
+    xb = np.ascontiguousarray(x[rows])
+    for _ in range(warmup):
+        sess.run(None, {name: xb})
+    times = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        sess.run(None, {name: xb})
+        times.append((time.perf_counter() - t0) * 1000.0)
+    return {"p50_ms": float(np.percentile(times, 50)), "p99_ms": float(np.percentile(times, 99))}
+
+
+def _export_gate(
+    net: ZamatNet,
+    path: Path,
+    x: np.ndarray,
+    prev_path: Optional[Path] = None,
+    max_drift: float = 1e-3,
+    max_slowdown: float = 1.25,
+) -> Tuple[bool, Dict[str, Any]]:
+    """Load the exported file back through onnxruntime and decide whether it may be published.
+
+    Fails when policy or value outputs drift from torch by more than max_drift on x, or when
+    p50 latency at batch 1 or 32 exceeds max_slowdown times the previous model measured on
+    the same machine in the same run.
+    """
+    report: Dict[str, Any] = {"max_drift": max_drift, "max_slowdown": max_slowdown}
+    try:
+        policy_drift, value_drift = _max_drift(net, path, x)
+        report.update(policy_drift=policy_drift, value_drift=value_drift)
+        report["latency"] = {str(b): _ort_latency(path, x, b) for b in (1, 32)}
+        if prev_path is not None and prev_path.exists():
+            report["prev_latency"] = {str(b): _ort_latency(prev_path, x, b) for b in (1, 32)}
+    except Exception as e:
+        report["error"] = str(e)
+        return False, report
+
+    reasons = []
+    if max(policy_drift, value_drift) > max_drift:
+        reasons.append(f"drift {max(policy_drift, value_drift):.2e} > {max_drift:.0e}")
+    for b, prev in (report.get("prev_latency") or {}).items():
+        cur = report["latency"].get(b) or {}
+        if prev and cur and cur["p50_ms"] > prev["p50_ms"] * max_slowdown:
+            reasons.append(f"batch {b} p50 {cur['p50_ms']:.2f}ms vs {prev['p50_ms']:.2f}ms before")
+    report["reasons"] = reasons
+    return not reasons, report
+
+
 
 
 
@@ -263,6 +638,68 @@ def _rtdb_rest_get(path: str) -> Dict[str, Any]:
     return data if isinstance(data, dict) else {}
 
 
+def _rtdb_rest_iter(path: str, params: Optional[Dict[str, Any]] = None) -> Iterator[Tuple[str, Any]]:
+    """Stream the top-level children of an RTDB node without materializing the body."""
+    import requests
+    with requests.get(_rest_url(path), params=params, timeout=60, stream=True) as r:
+        r.raise_for_status()
+        yield from iter_json_object_items(r.iter_content(chunk_size=64 * 1024))
+
+
+def _rtdb_rest_get_query(path: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    return dict(_rtdb_rest_iter(path, params))
+
+
+def _iter_train_games(db, page_size: int = 200) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Walk trainGamesV3 by key in fixed-size pages, yielding one game at a time.
+
+    Only one page is held in memory; the caller can stop iterating at any point and
+    no further pages are requested.
+    """
+    page_size = max(1, int(page_size))
+    last_key: Optional[str] = None
+    while True:
+        # startAt is inclusive, so every page after the first re-reads the previous last key.
+        limit = page_size + (0 if last_key is None else 1)
+        if db is None:
+            params: Dict[str, Any] = {"orderBy": json.dumps("$key"), "limitToFirst": limit}
+            if last_key is not None:
+                params["startAt"] = json.dumps(last_key)
+            page = _rtdb_rest_get_query("trainGamesV3", params)
+        else:
+            q = db.reference("trainGamesV3").order_by_key()
+            if last_key is not None:
+                q = q.start_at(last_key)
+            page = q.limit_to_first(limit).get() or {}
+        if not isinstance(page, dict):
+            return
+
+        keys = sorted(k for k in page.keys() if k != last_key)
+        for k in keys:
+            yield k, page[k]
+        if len(keys) < page_size:
+            return
+        last_key = keys[-1]
+        del page
+
+
+def _expired_train_game_ids(db, now_ms: int, limit: int = 900) -> Optional[List[str]]:
+    """Ids of trainGamesV3 games whose purgeAt has passed, oldest first, independent of paging.
+
+    limit matches the per-run delete cap in apply. Returns None when the query fails
+    (e.g. no ".indexOn": "purgeAt" rule), so the caller keeps the ids seen while paging.
+    """
+    try:
+        if db is None:
+            params = {"orderBy": json.dumps("purgeAt"), "startAt": 1, "endAt": int(now_ms), "limitToFirst": int(limit)}
+            return [gid for gid, _g in _rtdb_rest_iter("trainGamesV3", params)]
+        q = db.reference("trainGamesV3").order_by_child("purgeAt").start_at(1).end_at(int(now_ms))
+        return list((q.limit_to_first(int(limit)).get() or {}).keys())
+    except Exception as e:
+        print(f"[prepare] purgeAt query failed ({e}); purging only expired games read for training.")
+        return None
+
+
 def _rtdb_rest_patch(path: str, payload: Dict[str, Any]) -> None:
     import requests
     url = _rest_url(path)
@@ -288,75 +725,500 @@ def _rtdb_rest_delete(path: str) -> None:
 
 
 
-@dataclasses.dataclass
-class Sample:
-    x: np.ndarray          
-    a: int                 
-    v: float               
-    w: float               
+class SampleBuffer:
+    """Growable struct-of-arrays store of encoded training samples.
 
+    Each field is one preallocated NumPy array that doubles when full, so memory
+    scales with sample bytes instead of per-sample Python objects.
 
-def _decode_board_b64(b64: str) -> np.ndarray:
-    raw = base64.b64decode(b64.encode("ascii"))
+    In packed mode (default) only the 81-byte board plus p/ic/cp are kept per sample
+    (~94 bytes vs ~3.9 KB of float32 planes) and the 12 planes are expanded per
+    minibatch in batch(); planes mode materializes them up front.
+    """
 
-    arr_u8 = np.frombuffer(raw, dtype=np.uint8, count=N_CELLS)
-    arr_i8 = arr_u8.view(np.int8).astype(np.int16)
-    board = arr_i8.reshape((BOARD_N, BOARD_N))
-    return board
+    PACKED_FIELDS: Tuple[Tuple[str, Tuple[int, ...], Any], ...] = (
+        ("b", (N_CELLS,), np.int8),
+        ("p", (), np.int8),
+        ("ic", (), np.int8),
+        ("cp", (), np.int8),
+        ("a", (), np.int16),
+        ("v", (), np.float32),
+        ("w", (), np.float32),
+    )
+    PLANES_FIELDS: Tuple[Tuple[str, Tuple[int, ...], Any], ...] = (
+        ("x", (12, BOARD_N, BOARD_N), np.float32),
+        ("a", (), np.int16),
+        ("v", (), np.float32),
+        ("w", (), np.float32),
+    )
 
+    def __init__(self, capacity: int = 4096, packed: bool = True):
+        self.n = 0
+        self.packed = bool(packed)
+        self.fields = self.PACKED_FIELDS if self.packed else self.PLANES_FIELDS
+        # gid -> [start, stop) rows; games are appended contiguously.
+        self.game_rows: Dict[str, Tuple[int, int]] = {}
+        cap = max(1, int(capacity))
+        for name, shape, dtype in self.fields:
+            setattr(self, name, np.empty((cap,) + shape, dtype=dtype))
+
+    def __len__(self) -> int:
+        return self.n
+
+    @property
+    def capacity(self) -> int:
+        return int(self.a.shape[0])
+
+    @property
+    def nbytes(self) -> int:
+        return int(sum(getattr(self, name)[: self.n].nbytes for name, _shape, _dtype in self.fields))
+
+    def _reserve(self, extra: int) -> None:
+        need = self.n + int(extra)
+        if need <= self.capacity:
+            return
+        new_cap = max(need, self.capacity * 2)
+        for name, shape, dtype in self.fields:
+            old = getattr(self, name)
+            arr = np.empty((new_cap,) + shape, dtype=dtype)
+            arr[: self.n] = old[: self.n]
+            setattr(self, name, arr)
+
+    def extend(self, b: np.ndarray, p: np.ndarray, ic: np.ndarray, cp: np.ndarray, a: np.ndarray, v: np.ndarray, w: np.ndarray) -> None:
+        k = len(a)
+        if k == 0:
+            return
+        # int8/int16 columns would silently wrap out-of-range values into valid squares or actions.
+        p64, ic64, cp64, a64 = (np.asarray(arr, dtype=np.int64) for arr in (p, ic, cp, a))
+        if (
+            not np.isin(p64, (TOP, BOT)).all()
+            or not np.isin(ic64, (0, 1)).all()
+            or ((cp64 < -1) | (cp64 >= N_CELLS)).any()
+            or ((a64 < 0) | (a64 >= N_ACTIONS)).any()
+        ):
+            raise ValueError("SampleBuffer.extend: p, ic, cp or a out of range")
+        if self.packed:
+            cols = {"b": b, "p": p, "ic": ic, "cp": cp}
+        else:
+            cols = {"x": _encode_boards(b, p, ic, cp)}
+        cols.update(a=a, v=v, w=w)
+
+        self._reserve(k)
+        for name, _shape, _dtype in self.fields:
+            getattr(self, name)[self.n : self.n + k] = cols[name]
+        self.n += k
+
+    def cols(self, idx: np.ndarray) -> Dict[str, np.ndarray]:
+        if not self.packed:
+            raise ValueError("cols() needs a packed SampleBuffer")
+        return {name: getattr(self, name)[idx] for name, _shape, _dtype in self.fields}
+
+    def batch(self, idx: np.ndarray, out: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        if self.packed:
+            x = _encode_boards(self.b[idx], self.p[idx], self.ic[idx], self.cp[idx], out=out)
+        elif out is not None:
+            x = np.take(self.x, idx, axis=0, out=out[: len(idx)])
+        else:
+            x = self.x[idx]
+        return x, self.a[idx].astype(np.int64), self.v[idx], self.w[idx]
+
+    def save(self, path: Path) -> None:
+        if not self.packed:
+            raise ValueError("Only packed SampleBuffers can be saved")
+        path.mkdir(parents=True, exist_ok=True)
+        for name, _shape, _dtype in self.fields:
+            np.save(path / f"{name}.npy", getattr(self, name)[: self.n])
+
+    @classmethod
+    def load(cls, path: Path, mmap: bool = True) -> "SampleBuffer":
+        buf = cls(capacity=1, packed=True)
+        for name, _shape, _dtype in buf.fields:
+            setattr(buf, name, np.load(path / f"{name}.npy", mmap_mode="r" if mmap else None))
+        buf.n = int(buf.a.shape[0])
+        return buf
+
+
+class SampleSet:
+    """Read-only concatenation of row subsets of packed SampleBuffers.
+
+    Lets training draw minibatches across the freshly encoded buffer and memory-mapped
+    cache shards without copying them into one array first.
+    """
 
+    def __init__(self, parts: Sequence[Tuple[SampleBuffer, np.ndarray]]):
+        self.parts = [(buf, np.asarray(rows, dtype=np.int64)) for buf, rows in parts if len(rows)]
+        sizes = [len(rows) for _buf, rows in self.parts]
+        self.offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+
+    def __len__(self) -> int:
+        return int(self.offsets[-1])
+
+    def cols(self, idx: np.ndarray) -> Dict[str, np.ndarray]:
+        idx = np.asarray(idx, dtype=np.int64)
+        part_of = np.searchsorted(self.offsets, idx, side="right") - 1
+        out: Dict[str, np.ndarray] = {}
+        for k, (buf, rows) in enumerate(self.parts):
+            sel = np.flatnonzero(part_of == k)
+            if not len(sel):
+                continue
+            local = rows[idx[sel] - self.offsets[k]]
+            # Sorted reads keep memory-mapped access sequential.
+            order = np.argsort(local, kind="stable")
+            got = buf.cols(local[order])
+            for name, arr in got.items():
+                if name not in out:
+                    out[name] = np.empty((len(idx),) + arr.shape[1:], dtype=arr.dtype)
+                out[name][sel[order]] = arr
+        return out
+
+    def batch(self, idx: np.ndarray, out: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        c = self.cols(idx)
+        x = _encode_boards(c["b"], c["p"], c["ic"], c["cp"], out=out)
+        return x, c["a"].astype(np.int64), c["v"], c["w"]
+
+    def materialize(self, packed: bool = True, chunk: int = 8192) -> SampleBuffer:
+        out = SampleBuffer(capacity=max(1, len(self)), packed=packed)
+        for i in range(0, len(self), chunk):
+            out.extend(**self.cols(np.arange(i, min(len(self), i + chunk))))
+        return out
+
+
+def _augment_cols(cols: Dict[str, np.ndarray], sym: np.ndarray) -> Dict[str, np.ndarray]:
+    """Apply per-row symmetries (indices into SYM_CELLS) to packed sample columns.
+
+    Value targets are from the mover's point of view, so the colour swap leaves v alone.
+    """
+    sym = np.asarray(sym, dtype=np.int64)
+    perm = SYM_CELLS[sym]
+    swap = SYM_COLOR_SWAP[sym]
+
+    b = np.take_along_axis(cols["b"], perm, axis=1)
+    b = np.where(swap[:, None], -b, b).astype(np.int8)
+    cur = np.where(cols["p"] == BOT, BOT, TOP).astype(np.int8)
+    p = np.where(swap, -cur, cur).astype(np.int8)
+    cp = cols["cp"].astype(np.int64)
+    on_board = (cp >= 0) & (cp < N_CELLS)
+    cp = np.where(on_board, perm[np.arange(len(cp)), np.clip(cp, 0, N_CELLS - 1)], cp).astype(np.int8)
+    a = cols["a"].astype(np.int64)
+    # Soufla penalty choices are pseudo-actions with from == to; they name an option, not a square.
+    a = np.where(a // N_CELLS == a % N_CELLS, a, SYM_ACTIONS[sym, a]).astype(cols["a"].dtype)
+    return {**cols, "b": b, "p": p, "cp": cp, "a": a}
+
+
+class AugmentedSet(SampleSet):
+    """Symmetry-expanded view of a SampleSet: row i is base row i % n under symmetry i // n.
+
+    The transforms run on packed rows when a minibatch is drawn, so nothing is stored twice.
+    """
 
-def _encode_state(snap: Dict[str, Any]) -> np.ndarray:
+    def __init__(self, base: SampleSet, symmetries: Sequence[int] = (0, 1)):
+        self.base = base
+        self.symmetries = np.asarray(symmetries, dtype=np.int64)
 
+    def __len__(self) -> int:
+        return len(self.base) * len(self.symmetries)
 
+    def cols(self, idx: np.ndarray) -> Dict[str, np.ndarray]:
+        idx = np.asarray(idx, dtype=np.int64)
+        k, row = np.divmod(idx, len(self.base))
+        out = self.base.cols(row)
+        sym = self.symmetries[k]
+        if not sym.any():
+            return out
+        return _augment_cols(out, sym)
 
 
+class SampleCache:
+    """Persistent packed sample shards under training/_out/cache/samples with a game-id index.
 
+    Each prepare run writes the games it encoded as one shard of .npy files; later runs
+    skip re-encoding those games and memory-map their rows instead.
+    """
 
+    def __init__(self, root: Path, max_age_hours: float = 72.0):
+        self.root = root
+        self.max_age_ms = int(max_age_hours * 3600 * 1000)
+        self.index: Dict[str, List[Any]] = {}
+        self.shards: Dict[str, int] = {}
+        self._open: Dict[str, SampleBuffer] = {}
+        p = self.root / "index.json"
+        if p.exists():
+            try:
+                data = json.loads(p.read_text(encoding="utf-8"))
+                self.index = dict(data.get("games") or {})
+                self.shards = {str(k): int(v) for k, v in (data.get("shards") or {}).items()}
+            except Exception:
+                self.index, self.shards = {}, {}
+
+    def counts(self) -> Dict[str, int]:
+        return {gid: int(stop) - int(start) for gid, (_shard, start, stop) in self.index.items()}
+
+    def open_shard(self, name: str) -> SampleBuffer:
+        if name not in self._open:
+            self._open[name] = SampleBuffer.load(self.root / name, mmap=True)
+        return self._open[name]
+
+    def parts_for(self, gids: Iterable[str]) -> List[Tuple[SampleBuffer, np.ndarray]]:
+        by_shard: Dict[str, List[np.ndarray]] = {}
+        for gid in gids:
+            shard, start, stop = self.index[gid]
+            by_shard.setdefault(shard, []).append(np.arange(int(start), int(stop)))
+        return [(self.open_shard(sh), np.concatenate(rows)) for sh, rows in by_shard.items()]
+
+    def add_shard(self, buf: SampleBuffer) -> Optional[str]:
+        if not len(buf) or not buf.game_rows:
+            return None
+        name = "shard_" + time.strftime("%Y%m%d_%H%M%S", time.gmtime())
+        buf.save(self.root / name)
+        self.shards[name] = int(time.time() * 1000)
+        for gid, (start, stop) in buf.game_rows.items():
+            self.index[gid] = [name, int(start), int(stop)]
+        return name
+
+    def prune(self, now_ms: int) -> List[str]:
+        # trainGamesV3 keeps games for 48h, so older shards can no longer be hit.
+        stale = [name for name, created in self.shards.items() if now_ms - created > self.max_age_ms]
+        for name in stale:
+            self._open.pop(name, None)
+            for f in (self.root / name).glob("*.npy"):
+                f.unlink(missing_ok=True)
+            try:
+                (self.root / name).rmdir()
+            except OSError:
+                pass
+            del self.shards[name]
+        if stale:
+            self.index = {gid: e for gid, e in self.index.items() if e[0] in self.shards}
+        return stale
 
+    def save_index(self) -> None:
+        _write_json(self.root / "index.json", {"games": self.index, "shards": self.shards})
 
 
+class ReplayBuffer:
+    """Bounded, memory-mapped store of packed samples kept across training generations.
 
+    Lives under training/_out/cache/replay as one fixed-capacity .npy per packed field.
+    When full, "fifo" overwrites the oldest rows and "reservoir" keeps a uniform sample
+    of everything ever added.
+    """
 
+    MAX_TRACKED_GAMES = 50_000
+
+    def __init__(self, root: Path, capacity: int = 200_000, policy: str = "fifo", seed: Optional[int] = None):
+        self.root = root
+        self.capacity = max(1, int(capacity))
+        self.policy = policy
+        self.rng = np.random.default_rng(seed)
+        self.size = 0
+        self.head = 0
+        self.seen = 0
+        self.game_ids: List[str] = []
+        self.root.mkdir(parents=True, exist_ok=True)
+
+        meta_path = self.root / "meta.json"
+        meta: Dict[str, Any] = {}
+        if meta_path.exists():
+            try:
+                meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            except Exception:
+                meta = {}
+        old_cap = int(meta.get("capacity") or 0)
+
+        old: Dict[str, np.ndarray] = {}
+        if old_cap and old_cap != self.capacity:
+            old = {name: np.array(np.load(self.root / f"{name}.npy", mmap_mode="r")[: int(meta.get("size") or 0)])
+                   for name, _shape, _dtype in SampleBuffer.PACKED_FIELDS}
+
+        self.arrays: Dict[str, np.ndarray] = {}
+        for name, shape, dtype in SampleBuffer.PACKED_FIELDS:
+            f = self.root / f"{name}.npy"
+            if old_cap == self.capacity and f.exists():
+                self.arrays[name] = np.load(f, mmap_mode="r+")
+            else:
+                self.arrays[name] = np.lib.format.open_memmap(f, mode="w+", dtype=dtype, shape=(self.capacity,) + shape)
+
+        if old_cap == self.capacity:
+            self.size = int(meta.get("size") or 0)
+            self.head = int(meta.get("head") or 0)
+            self.seen = int(meta.get("seen") or 0)
+        elif old:
+            keep = min(self.capacity, len(old["a"]))
+            for name, arr in old.items():
+                self.arrays[name][:keep] = arr[-keep:] if keep else arr[:0]
+            self.size = keep
+            self.head = keep % self.capacity
+            self.seen = int(meta.get("seen") or keep)
+        if old_cap:
+            self.game_ids = [str(g) for g in (meta.get("gameIds") or [])]
+        self._games = set(self.game_ids)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def has_game(self, gid: str) -> bool:
+        return gid in self._games
+
+    def sample(self, k: int) -> SampleBuffer:
+        """Copy k random retained rows into an in-memory packed buffer."""
+        k = min(int(k), self.size)
+        out = SampleBuffer(capacity=max(1, k), packed=True)
+        if k:
+            rows = np.sort(self.rng.choice(self.size, size=k, replace=False))
+            out.extend(**{name: self.arrays[name][rows] for name, _shape, _dtype in SampleBuffer.PACKED_FIELDS})
+        return out
+
+    def _slots_for(self, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (source positions, destination slots) for k incoming rows."""
+        src = np.arange(k)
+        if self.policy == "reservoir":
+            fill = min(k, self.capacity - self.size)
+            dst = np.arange(self.size, self.size + fill)
+            t = self.seen + np.arange(fill, k)
+            j = self.rng.integers(0, t + 1) if len(t) else np.zeros(0, dtype=np.int64)
+            hit = j < self.capacity
+            return np.concatenate([src[:fill], src[fill:][hit]]), np.concatenate([dst, j[hit]])
+        if k > self.capacity:
+            src = src[-self.capacity:]
+        dst = (self.head + np.arange(len(src))) % self.capacity
+        return src, dst
+
+    def add(self, cols: Dict[str, np.ndarray]) -> None:
+        k = len(cols["a"])
+        if k == 0:
+            return
+        src, dst = self._slots_for(k)
+        for name, _shape, _dtype in SampleBuffer.PACKED_FIELDS:
+            self.arrays[name][dst] = cols[name][src]
+        if self.policy == "reservoir":
+            self.size = min(self.capacity, self.size + k)
+        else:
+            self.size = min(self.capacity, self.size + len(src))
+            self.head = int((self.head + len(src)) % self.capacity)
+        self.seen += k
+
+    def add_games(self, game_ids: Sequence[str]) -> None:
+        self.game_ids = (self.game_ids + [str(g) for g in game_ids])[-self.MAX_TRACKED_GAMES:]
+        self._games = set(self.game_ids)
+
+    def flush(self) -> None:
+        for arr in self.arrays.values():
+            if isinstance(arr, np.memmap):
+                arr.flush()
+        _write_json(self.root / "meta.json", {
+            "capacity": self.capacity,
+            "size": self.size,
+            "head": self.head,
+            "seen": self.seen,
+            "policy": self.policy,
+            "gameIds": self.game_ids,
+            "updatedAt": int(time.time() * 1000),
+        })
 
 
+def _decode_board_b64(b64: str) -> np.ndarray:
+    raw = base64.b64decode(b64.encode("ascii"))
 
+    arr_u8 = np.frombuffer(raw, dtype=np.uint8, count=N_CELLS)
+    arr_i8 = arr_u8.view(np.int8).astype(np.int16)
+    board = arr_i8.reshape((BOARD_N, BOARD_N))
+    return board
 
-    b64 = snap.get("b", "")
-    board = _decode_board_b64(b64)
-    cur = int(snap.get("p", 0)) or TOP
-    in_chain = int(snap.get("ic", 0)) == 1
-    cp = int(snap.get("cp", -1))
 
-    planes = np.zeros((12, BOARD_N, BOARD_N), dtype=np.float32)
+# 81 bytes encode to exactly 108 base64 characters with no padding, so well-formed
+# boards can be concatenated and decoded in a single call.
+B64_BOARD_LEN = (N_CELLS // 3) * 4
+
+
+def _decode_boards_b64(b64s: Sequence[Any]) -> Tuple[np.ndarray, List[int]]:
+    """Decode N base64 boards into one contiguous (N,81) int8 buffer.
+
+    Returns the buffer and the sorted indices of malformed entries; their rows are left zeroed.
+    """
+    n = len(b64s)
+    out = np.zeros((n, N_CELLS), dtype=np.int8)
+    bad = {i for i, b in enumerate(b64s) if not isinstance(b, str) or len(b) != B64_BOARD_LEN}
+    good = [i for i in range(n) if i not in bad]
+
+    if good:
+        try:
+            raw = base64.b64decode("".join(b64s[i] for i in good).encode("ascii"), validate=True)
+            out[good] = np.frombuffer(raw, dtype=np.int8).reshape(len(good), N_CELLS)
+        except (binascii.Error, ValueError):
+            for i in good:
+                try:
+                    raw = base64.b64decode(b64s[i].encode("ascii"), validate=True)
+                    out[i] = np.frombuffer(raw, dtype=np.int8)
+                except (binascii.Error, ValueError):
+                    bad.add(i)
+
+    out_of_range = np.flatnonzero(np.any(np.abs(out.astype(np.int16)) > KING, axis=1))
+    bad.update(int(i) for i in out_of_range)
+
+    bad_idx = sorted(bad)
+    if bad_idx:
+        out[bad_idx] = 0
+    return out, bad_idx
 
-    for r in range(BOARD_N):
-        for c in range(BOARD_N):
-            v = int(board[r, c])
-            if v == 0:
-                continue
-            owner = TOP if v > 0 else BOT
-            kind = KING if abs(v) == 2 else MAN
-            if owner == cur:
-                planes[0 if kind == MAN else 1, r, c] = 1.0
-            else:
-                planes[2 if kind == MAN else 3, r, c] = 1.0
 
-    if in_chain and cp is not None and int(cp) >= 0:
-        rr, cc = divmod(int(cp), BOARD_N)
-        if 0 <= rr < BOARD_N and 0 <= cc < BOARD_N:
-            planes[4, rr, cc] = 1.0
+def _encode_states(b64s: Sequence[Any], p: np.ndarray, ic: np.ndarray, cp: np.ndarray) -> Tuple[np.ndarray, List[int]]:
+    boards, bad = _decode_boards_b64(b64s)
+    return _encode_boards(boards, p, ic, cp), bad
 
-    pv = 1.0 if cur == TOP else 0.0
-    planes[5, :, :] = pv
 
-    planes[6, :, :] = IS_WIDE.astype(np.float32)
-    planes[7, :, :] = MASK_BACK_TOP.astype(np.float32)
-    planes[8, :, :] = MASK_BACK_BOT.astype(np.float32)
-    planes[9, :, :] = MASK_CORNERS.astype(np.float32)
-    planes[10, :, :] = MASK_EYES.astype(np.float32)
-    planes[11, :, :] = MASK_MIDBACK.astype(np.float32)
 
+def _encode_state(snap: Dict[str, Any]) -> np.ndarray:
+    board = _decode_board_b64(snap.get("b", "")).reshape(1, N_CELLS)
+    p = np.array([int(snap.get("p", 0))], dtype=np.int64)
+    ic = np.array([int(snap.get("ic", 0))], dtype=np.int64)
+    cp = np.array([int(snap.get("cp", -1))], dtype=np.int64)
+    return _encode_boards(board, p, ic, cp)[0]
+
+
+def _encode_boards(
+    boards: np.ndarray,
+    p: np.ndarray,
+    ic: np.ndarray,
+    cp: np.ndarray,
+    out: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Encode N decoded boards (N,81) plus p/ic/cp arrays into (N,12,9,9) float32 planes.
+
+    When `out` is given its first N rows are overwritten and returned, so a caller can
+    reuse one buffer across minibatches.
+    """
+    boards = np.asarray(boards).reshape(-1, N_CELLS)
+    n = boards.shape[0]
+    cur = np.asarray(p, dtype=np.int64).reshape(n)
+    cur = np.where(cur == 0, TOP, cur)
+    in_chain = np.asarray(ic, dtype=np.int64).reshape(n) == 1
+    cp = np.asarray(cp, dtype=np.int64).reshape(n)
+
+    if out is None:
+        planes = np.zeros((n, 12, N_CELLS), dtype=np.float32)
+    else:
+        planes = out[:n].reshape(n, 12, N_CELLS)
+        planes[:, :6] = 0.0
+
+    v = boards.astype(np.int16, copy=False)
+    occupied = v != 0
+    king = np.abs(v) == 2
+    man = occupied & ~king
+    own = occupied & ((v > 0) == (cur[:, None] == TOP))
+    opp = occupied & ~own
+
+    planes[:, 0] = own & man
+    planes[:, 1] = own & king
+    planes[:, 2] = opp & man
+    planes[:, 3] = opp & king
+
+    rows = np.flatnonzero(in_chain & (cp >= 0) & (cp < N_CELLS))
+    planes[rows, 4, cp[rows]] = 1.0
+
+    planes[:, 5] = (cur == TOP).astype(np.float32)[:, None]
+
+    planes = planes.reshape(n, 12, BOARD_N, BOARD_N)
+    planes[:, 6:] = STATIC_PLANES
     return planes
 
 
@@ -424,35 +1286,22 @@ def _weight_for(sample: Dict[str, Any], winner: Optional[int]) -> Tuple[float, f
 
 
 
-def _make_dataset(games: Dict[str, Dict[str, Any]], max_samples: int = 50_000) -> Tuple[List[Sample], List[str], List[str]]:
-
-
-
-
+def _convert_games(
+    games: List[Tuple[str, Dict[str, Any]]],
+    client_filter: bool = True,
+) -> List[Tuple[str, Optional[Dict[str, np.ndarray]]]]:
+    """Filter, weight and decode a batch of games into per-game packed arrays.
 
-    now_ms = int(time.time() * 1000)
-    dataset: List[Sample] = []
-    used_ids: List[str] = []
-    purge_ids: List[str] = []
-
-
-    for gid, g in games.items():
-        try:
-            purge_at = int(g.get("purgeAt") or 0)
-            if purge_at and purge_at <= now_ms:
-                purge_ids.append(gid)
-        except Exception:
-            pass
-
-
-    for gid, g in games.items():
-        if len(dataset) >= max_samples:
-            break
-        if not isinstance(g, dict):
-            continue
-        if bool(g.get("processed")):
-            continue
-        if not _client_like_filter(g):
+    Runs inline or in a ProcessPoolExecutor worker. Malformed boards are flagged in
+    "ok" rather than dropped so the caller applies max_samples exactly as before.
+    Games rejected by the client filter, or without usable samples, map to None.
+    client_filter=False skips the browser timing checks (locally generated self-play).
+    """
+    rows: List[Tuple[Any, int, int, int, int, float, float, int]] = []
+    spans: List[Tuple[str, Optional[Tuple[int, int]]]] = []
+    for gid, g in games:
+        if client_filter and not _client_like_filter(g):
+            spans.append((gid, None))
             continue
 
         winner_raw = g.get("winner", None)
@@ -462,12 +1311,11 @@ def _make_dataset(games: Dict[str, Dict[str, Any]], max_samples: int = 50_000) -
 
         samples = g.get("samples") or []
         if not isinstance(samples, list) or not samples:
+            spans.append((gid, None))
             continue
 
-        ok_any = False
-        for s in samples:
-            if len(dataset) >= max_samples:
-                break
+        start = len(rows)
+        for si, s in enumerate(samples):
             if not isinstance(s, dict):
                 continue
             try:
@@ -477,21 +1325,201 @@ def _make_dataset(games: Dict[str, Dict[str, Any]], max_samples: int = 50_000) -
                     continue
                 if a < 0 or a >= N_ACTIONS:
                     continue
-                x = _encode_state(snap)
+                b64 = snap.get("b", "")
+                p = int(snap.get("p", 0))
+                ic = int(snap.get("ic", 0))
+                cp = int(snap.get("cp", -1))
+                # Checked here so one bad field drops one sample, not the int8 columns of the batch.
+                if p not in (TOP, BOT) or ic not in (0, 1) or not -1 <= cp < N_CELLS:
+                    continue
                 v_tgt, w = _weight_for(s, winner)
-                dataset.append(Sample(x=x, a=a, v=v_tgt, w=w))
-                ok_any = True
+                rows.append((b64, p, ic, cp, a, v_tgt, w, si))
             except Exception:
                 continue
+        spans.append((gid, (start, len(rows)) if len(rows) > start else None))
+
+    if not rows:
+        return [(gid, None) for gid, _span in spans]
+
+    b64s, ps, ics, cps, acts, vals, wts, sis = zip(*rows)
+    boards, bad = _decode_boards_b64(b64s)
+    ok = np.ones(len(rows), dtype=np.bool_)
+    ok[bad] = False
+    cols = {
+        "b": boards,
+        "ok": ok,
+        "p": np.array(ps, dtype=np.int8),
+        "ic": np.array(ics, dtype=np.int8),
+        "cp": np.array(cps, dtype=np.int8),
+        "a": np.array(acts, dtype=np.int16),
+        "v": np.array(vals, dtype=np.float32),
+        "w": np.array(wts, dtype=np.float32),
+        "si": np.array(sis, dtype=np.int32),
+    }
+    return [
+        (gid, None if span is None else {k: arr[span[0] : span[1]] for k, arr in cols.items()})
+        for gid, span in spans
+    ]
+
+
+def _iter_converted(
+    items: Iterable[Tuple[str, Any]],
+    cached: Dict[str, int],
+    workers: int = 0,
+    batch_games: int = 32,
+    client_filter: bool = True,
+) -> Iterator[Tuple[str, Any, Optional[Dict[str, np.ndarray]]]]:
+    """Yield (gid, game, block) in input order, converting batches inline or on a process pool.
+
+    Processed and cached games are not converted (block is None). With workers, at
+    most 2 * workers batches are in flight, so a lazy stream is read only slightly
+    ahead of the consumer.
+    """
+
+    def _batches() -> Iterator[List[Tuple[str, Any]]]:
+        batch: List[Tuple[str, Any]] = []
+        for gid, g in items:
+            batch.append((gid, g))
+            if len(batch) >= batch_games:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _todo(batch: List[Tuple[str, Any]]) -> List[Tuple[str, Dict[str, Any]]]:
+        return [(gid, g) for gid, g in batch if isinstance(g, dict) and not bool(g.get("processed")) and gid not in cached]
+
+    if workers <= 1:
+        for batch in _batches():
+            conv = dict(_convert_games(_todo(batch), client_filter))
+            for gid, g in batch:
+                yield gid, g, conv.get(gid)
+        return
+
+    pool = ProcessPoolExecutor(max_workers=workers)
+    inflight: deque = deque()
+    try:
+        for batch in _batches():
+            inflight.append((batch, pool.submit(_convert_games, _todo(batch), client_filter)))
+            if len(inflight) < 2 * workers:
+                continue
+            done, fut = inflight.popleft()
+            conv = dict(fut.result())
+            for gid, g in done:
+                yield gid, g, conv.get(gid)
+        while inflight:
+            done, fut = inflight.popleft()
+            conv = dict(fut.result())
+            for gid, g in done:
+                yield gid, g, conv.get(gid)
+    finally:
+        # Reached when the consumer stops at max_samples with batches still queued.
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _make_dataset(
+    games: Union[Dict[str, Dict[str, Any]], Iterable[Tuple[str, Dict[str, Any]]]],
+    max_samples: int = 50_000,
+    chunk_size: int = 4096,
+    cached: Optional[Dict[str, int]] = None,
+    workers: int = 0,
+    client_filter: bool = True,
+) -> Tuple[SampleBuffer, List[str], List[str], int]:
+    """Build the packed training set from a games dict or a (gid, game) stream.
+
+    Iteration stops as soon as max_samples is reached, so a lazy stream is only
+    consumed as far as needed. Games listed in `cached` (gid -> sample count) are
+    not re-encoded; they still count towards max_samples and are reported as used.
+    With workers > 1 the filtering and decoding run on a process pool; results are
+    merged in game order, so the output does not depend on the worker count.
+    client_filter=False accepts games without browser timings (self-play records).
+    Returns (dataset, used_ids, purge_ids, games_seen).
+    """
+    now_ms = int(time.time() * 1000)
+    cached = cached or {}
+    n_cached = 0
+    dataset = SampleBuffer(capacity=min(max_samples, chunk_size), packed=True)
+    pending: List[Tuple[int, Dict[str, np.ndarray]]] = []
+    n_pending = 0
+    game_ids: List[str] = []
+    used_pos: set = set()
+    purge_ids: List[str] = []
+    games_seen = 0
+    items = games.items() if isinstance(games, dict) else games
+
+    def _flush() -> None:
+        nonlocal n_pending
+        if not pending:
+            return
+        gpos = np.concatenate([np.full(len(blk["a"]), j, dtype=np.int64) for j, blk in pending])
+        cols = {k: np.concatenate([blk[k] for _j, blk in pending]) for k in pending[0][1]}
+        bad = np.flatnonzero(~cols["ok"])
+        if len(bad):
+            where = ", ".join(f"{game_ids[gpos[i]]}#{cols['si'][i]}" for i in bad[:20])
+            more = f" (+{len(bad) - 20} more)" if len(bad) > 20 else ""
+            print(f"[prepare] Skipped {len(bad)} malformed boards: {where}{more}")
+        rows = np.flatnonzero(cols["ok"])
+
+        base = len(dataset)
+        kept_gpos = gpos[rows]
+        uniq, first, counts = np.unique(kept_gpos, return_index=True, return_counts=True)
+        for j, f, c in zip(uniq, first, counts):
+            dataset.game_rows[game_ids[j]] = (base + int(f), base + int(f) + int(c))
+
+        dataset.extend(**{k: cols[k][rows] for k in ("b", "p", "ic", "cp", "a", "v", "w")})
+        used_pos.update(int(j) for j in uniq)
+        pending.clear()
+        n_pending = 0
+
+
+    for gid, g, block in _iter_converted(items, cached, workers=workers, client_filter=client_filter):
+        games_seen += 1
+        try:
+            purge_at = int(g.get("purgeAt") or 0)
+            if purge_at and purge_at <= now_ms:
+                purge_ids.append(gid)
+        except Exception:
+            pass
+
+        if not isinstance(g, dict):
+            continue
+        if bool(g.get("processed")):
+            continue
+        if gid in cached:
+            used_pos.add(len(game_ids))
+            game_ids.append(gid)
+            n_cached += cached[gid]
+            if len(dataset) + n_pending + n_cached >= max_samples:
+                break
+            continue
+        if block is None:
+            continue
+
+        # Malformed boards count towards the cap until their chunk is flushed.
+        room = max_samples - (len(dataset) + n_pending + n_cached)
+        if room < len(block["a"]):
+            block = {k: arr[: max(0, room)] for k, arr in block.items()}
+        pending.append((len(game_ids), block))
+        n_pending += len(block["a"])
+        game_ids.append(gid)
+
+        if n_pending >= chunk_size:
+            _flush()
+        if len(dataset) + n_pending + n_cached >= max_samples:
+            break
+
+    _flush()
+    used_ids = [game_ids[j] for j in sorted(used_pos)]
+    return dataset, used_ids, purge_ids, games_seen
 
-        if ok_any:
-            used_ids.append(gid)
 
-    return dataset, used_ids, purge_ids
 
 
 
 
+def _in_holdout(gid: str, fraction: float) -> bool:
+    """Stable per-game validation assignment, independent of run order and worker count."""
+    return fraction > 0 and zlib.crc32(str(gid).encode("utf-8")) % 10_000 < fraction * 10_000
 
 
 def _latest_ckpt(models_dir: Path) -> Optional[Path]:
@@ -509,11 +1537,33 @@ def _latest_ckpt(models_dir: Path) -> Optional[Path]:
 
 
 
-def _load_or_init(models_dir: Path, preferred_version: Optional[str]) -> Tuple[ZamatNet, Optional[dict]]:
+def _arch_from_meta(meta: Any) -> Dict[str, Any]:
+    """Architecture stored in a checkpoint; checkpoints without meta are the original 64x4 dense net."""
+    meta = meta if isinstance(meta, dict) else {}
+    return {
+        "channels": int(meta.get("channels") or 64),
+        "num_blocks": int(meta.get("num_blocks") or 4),
+        "policy_head": str(meta.get("policy_head") or "dense"),
+    }
+
 
+def _features_from_meta(meta: Any) -> int:
+    """Input encoding a checkpoint was trained on; checkpoints from before FEATURE_VERSION are 1."""
+    meta = meta if isinstance(meta, dict) else {}
+    return int(meta.get("features") or 1)
 
 
+def _load_or_init(
+    models_dir: Path,
+    preferred_version: Optional[str],
+    arch: Optional[Dict[str, Any]] = None,
+) -> Tuple[ZamatNet, Optional[dict]]:
+    """Rebuild the latest checkpoint's network, or a fresh one when `arch` asks for a different shape.
 
+    `arch` overrides (None values ignored) are compared against the checkpoint meta;
+    on a mismatch, or a checkpoint trained on another FEATURE_VERSION, training restarts
+    from new weights, optimizer state and step count.
+    """
     ckpt_path = None
     if preferred_version:
         p = models_dir / f"human_ckpt_{preferred_version}.pt"
@@ -522,21 +1572,328 @@ def _load_or_init(models_dir: Path, preferred_version: Optional[str]) -> Tuple[Z
     if ckpt_path is None:
         ckpt_path = _latest_ckpt(models_dir)
 
-    net = ZamatNet(in_channels=12, channels=64, num_blocks=4, n_actions=N_ACTIONS)
-
     payload = None
     if ckpt_path and ckpt_path.exists():
         payload = torch.load(ckpt_path, map_location="cpu")
+
+    ckpt_meta = payload.get("meta") if isinstance(payload, dict) else None
+    ckpt_arch = _arch_from_meta(ckpt_meta)
+    want = {**ckpt_arch, **{k: v for k, v in (arch or {}).items() if v is not None}}
+    net = ZamatNet(in_channels=12, n_actions=N_ACTIONS, **want)
+
+    if isinstance(payload, dict):
         state = payload.get("model")
-        if isinstance(state, dict):
+        if want != ckpt_arch:
+            print(f"[prepare] Architecture {want} differs from checkpoint {ckpt_arch}; starting from new weights.")
+            payload = None
+        elif _features_from_meta(ckpt_meta) != FEATURE_VERSION:
+            print(
+                f"[prepare] Checkpoint was trained on input features v{_features_from_meta(ckpt_meta)}, "
+                f"now v{FEATURE_VERSION}; starting from new weights."
+            )
+            payload = None
+        elif isinstance(state, dict):
             net.load_state_dict(state, strict=True)
     return net, payload
 
 
-def _train_incremental(net: ZamatNet, payload: Optional[dict], dataset: List[Sample], epochs: int = 2, batch_size: int = 256) -> dict:
+def _legal_masks(x: np.ndarray, acts: Optional[np.ndarray] = None, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """(N, N_ACTIONS) bool legal-move masks for a batch of encoded planes.
+
+    Positions are rebuilt from planes 0-5, so augmented and plane-mode datasets need no
+    extra columns; move lists come from dhamet's LRU cache. The recorded action is
+    always kept legal (forced-opening moves and rule drift must not yield -inf targets).
+    """
+    n = x.shape[0]
+    mask = np.zeros((n, N_ACTIONS), dtype=np.bool_) if out is None else out[:n]
+    if out is not None:
+        mask[:] = False
+    flat = x.reshape(n, 12, N_CELLS)
+    cur = np.where(flat[:, 5, 0] > 0.5, TOP, BOT).astype(np.int8)
+    own = flat[:, 0] + 2 * flat[:, 1]
+    opp = flat[:, 2] + 2 * flat[:, 3]
+    boards = ((own - opp) * cur[:, None]).astype(np.int8)
+    chain = flat[:, 4]
+    cps = np.where(chain.max(axis=1) > 0.5, chain.argmax(axis=1), -1)
+    for i in range(n):
+        legal = dhamet.legal_actions_cached(boards[i].tobytes(), int(cur[i]), int(cps[i]))
+        if legal:
+            mask[i, list(legal)] = True
+    if acts is not None:
+        mask[np.arange(n), np.asarray(acts, dtype=np.int64)] = True
+    return mask
+
+
+class BatchPrefetcher:
+    """Builds minibatches on a background thread while the current step runs.
+
+    Planes are written into a small ring of reused (pinned when CUDA is present) buffers;
+    a slot is handed back to the producer once the consumer asks for the next batch,
+    so a yielded batch must not be kept past its training step.
+    """
+
+    def __init__(self, dataset: Any, idx: np.ndarray, batch_size: int, depth: int = 2, legal: bool = False):
+        self.dataset = dataset
+        self.idx = idx
+        self.batch_size = batch_size
+        self.depth = max(1, depth)
+        pin = torch.cuda.is_available()
+        shape = (batch_size, 12, BOARD_N, BOARD_N)
+        self.slots = [torch.empty(shape, dtype=torch.float32, pin_memory=pin) for _ in range(self.depth + 1)]
+        self.masks = (
+            [torch.empty((batch_size, N_ACTIONS), dtype=torch.bool, pin_memory=pin) for _ in self.slots]
+            if legal
+            else None
+        )
+        self.queue: "queue.Queue[Any]" = queue.Queue(maxsize=self.depth)
+        self.free = threading.Semaphore(len(self.slots))
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self._produce, name="batch-prefetch", daemon=True)
+        self.thread.start()
+
+    def _produce(self) -> None:
+        try:
+            for k, i in enumerate(range(0, len(self.idx), self.batch_size)):
+                self.free.acquire()
+                if self.stop.is_set():
+                    return
+                slot = k % len(self.slots)
+                rows = self.idx[i : i + self.batch_size]
+                x, acts, vals, wts = self.dataset.batch(rows, out=self.slots[slot].numpy())
+                if self.masks is not None:
+                    _legal_masks(x, acts, out=self.masks[slot].numpy())
+                self.queue.put((slot, len(rows), acts, vals, wts))
+            self.queue.put(None)
+        except BaseException as e:
+            self.queue.put(e)
+
+    def __iter__(self) -> Iterator[Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, Optional[torch.Tensor]]]:
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                slot, n, acts, vals, wts = item
+                mask = self.masks[slot][:n] if self.masks is not None else None
+                yield self.slots[slot][:n], torch.from_numpy(acts), torch.from_numpy(vals), torch.from_numpy(wts), mask
+                self.free.release()
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        self.stop.set()
+        self.free.release()
+        while self.thread.is_alive():
+            try:
+                self.queue.get(timeout=0.05)
+            except queue.Empty:
+                pass
+            self.free.release()
+        self.thread.join()
+
+
+# Set by SIGTERM/SIGINT so training stops at the next step and prepare still exports.
+_STOP_REQUESTED = threading.Event()
+_STOP_SIGNALS = (signal.SIGTERM, signal.SIGINT)
+
+
+@contextmanager
+def _stop_on_signal() -> Iterator[None]:
+    """Defer SIGTERM and SIGINT while training and exporting; previous handlers are restored on exit.
+
+    Actions cancels a timed-out step with SIGINT and then SIGTERM, so both only request a stop.
+    """
+
+    def _on_signal(signum, _frame) -> None:
+        print(f"[prepare] Received signal {signum}; finishing the current step and exporting.")
+        _STOP_REQUESTED.set()
+
+    prev: Dict[int, Any] = {}
+    try:
+        for sig in _STOP_SIGNALS:
+            prev[sig] = signal.signal(sig, _on_signal)
+    except ValueError:
+        # Not in the main thread.
+        pass
+    try:
+        yield
+    finally:
+        for sig, handler in prev.items():
+            signal.signal(sig, handler)
+
+
+@dataclass
+class TrainConfig:
+    """Knobs for _train_incremental; the defaults reproduce the original training loop."""
+
+    epochs: int = 2
+    batch_size: int = 256
+    threads: int = 0  # intra-op threads; 0 keeps torch's default
+    interop_threads: int = 0  # 0 keeps torch's default
+    channels_last: bool = False
+    bf16: str = "off"  # off | auto | on
+    prefetch: int = 2  # minibatches built ahead on a background thread; 0 builds them inline
+    patience: int = 2  # epochs without validation improvement before stopping
+    min_delta: float = 1e-3
+    time_budget_s: float = 0.0  # 0 = no limit
+    deadline: float = 0.0  # time.time() by which training must have stopped; 0 = none
+    calibrate_steps: int = 200  # steps timed before the run is sized to the deadline
+    compile: str = "off"  # off | auto | compile | script
+    legal_mask: bool = False  # softmax over legal moves only
+    value_weight: float = 0.5  # 0 trains the policy alone (policy-only lite student)
+    kd_alpha: float = 0.5  # share of the loss on teacher soft targets when a teacher is given
+    kd_temperature: float = 2.0
+    seed: int = 42  # shuffle order and INT8 calibration rows; fixed so reruns on the same data match
+
+    @classmethod
+    def perf(cls, **overrides: Any) -> "TrainConfig":
+        """Settings tuned for CPU runners: threads from the usable cores, channels_last, bf16 if native."""
+        cores = _usable_cores()
+        cfg = cls(threads=cores, interop_threads=max(1, min(4, cores // 4)), channels_last=True, bf16="auto")
+        for k, v in overrides.items():
+            if v is not None:
+                setattr(cfg, k, v)
+        return cfg
+
+
+def _usable_cores() -> int:
+    try:
+        return max(1, len(os.sched_getaffinity(0)))
+    except (AttributeError, OSError):
+        return max(1, os.cpu_count() or 1)
+
+
+def _cpu_has_bf16() -> bool:
+    """True when the CPU runs bfloat16 natively (AVX512-BF16 or AMX); elsewhere it is emulated and slower."""
+    try:
+        flags = Path("/proc/cpuinfo").read_text(encoding="utf-8", errors="ignore")
+    except OSError:
+        return False
+    return bool(re.search(r"\b(avx512_bf16|amx_bf16)\b", flags))
+
+
+def _configure_threads(cfg: TrainConfig) -> Tuple[int, int]:
+    if cfg.threads > 0:
+        torch.set_num_threads(cfg.threads)
+    if cfg.interop_threads > 0:
+        try:
+            torch.set_num_interop_threads(cfg.interop_threads)
+        except RuntimeError:
+            # Only settable before the first inter-op parallel work in this process.
+            pass
+    return torch.get_num_threads(), torch.get_num_interop_threads()
+
+
+def _inline_batch(dataset: Any, rows: np.ndarray, legal: bool) -> Tuple[Any, ...]:
+    xs, acts, vals, wts = dataset.batch(rows)
+    mask = torch.from_numpy(_legal_masks(xs, acts)) if legal else None
+    return torch.from_numpy(xs), torch.from_numpy(acts), torch.from_numpy(vals), torch.from_numpy(wts), mask
+
+
+@torch.no_grad()
+def _evaluate(
+    net: ZamatNet,
+    dataset: SampleSet,
+    batch_size: int = 1024,
+    fmt: torch.memory_format = torch.contiguous_format,
+    use_bf16: bool = False,
+    legal_mask: bool = False,
+    value_weight: float = 0.5,
+) -> Dict[str, float]:
+    """Weighted training loss, policy top-1 accuracy and value MSE over a held-out set."""
+    was_training = net.training
+    net.eval()
+    n = len(dataset)
+    loss_sum = 0.0
+    correct = 0
+    sq_err = 0.0
+    for i in range(0, n, batch_size):
+        xs, acts, vals, wts = dataset.batch(np.arange(i, min(n, i + batch_size)))
+        xb = torch.from_numpy(xs).contiguous(memory_format=fmt)
+        ab = torch.from_numpy(acts)
+        vb = torch.from_numpy(vals)
+        wb = torch.from_numpy(wts)
+        with torch.autocast("cpu", dtype=torch.bfloat16, enabled=use_bf16):
+            logits, vpred = net(xb)
+        logits = logits.float()
+        if legal_mask:
+            logits = logits.masked_fill(~torch.from_numpy(_legal_masks(xs, acts)), float("-inf"))
+        loss_pi = F.cross_entropy(logits, ab, reduction="none")
+        loss_v = (vpred.float() - vb) ** 2
+        loss_sum += float(((loss_pi + value_weight * loss_v) * wb).sum())
+        correct += int((logits.argmax(dim=1) == ab).sum())
+        sq_err += float(loss_v.sum())
+    net.train(was_training)
+    n = max(n, 1)
+    return {"loss": loss_sum / n, "policy_top1": correct / n, "value_mse": sq_err / n}
+
+
+def _compile_net(
+    net: ZamatNet,
+    mode: str,
+    batch_size: int = 256,
+    fmt: torch.memory_format = torch.contiguous_format,
+) -> Tuple[nn.Module, str]:
+    """Return (module to run training forwards through, mode in effect).
+
+    "auto" tries torch.compile, then TorchScript. Compilation problems usually only show
+    up on the first call, so each candidate runs one forward/backward here; BatchNorm
+    statistics are restored afterwards. Falls back to the eager module.
+    """
+    if mode == "off":
+        return net, "eager"
+    saved = {k: v.clone() for k, v in net.state_dict().items()}
+    for cand in (("compile", "script") if mode == "auto" else (mode,)):
+        try:
+            if cand == "compile":
+                if not hasattr(torch, "compile"):
+                    raise RuntimeError("torch.compile needs torch >= 2.0")
+                fwd = torch.compile(net, dynamic=False)
+            else:
+                fwd = torch.jit.script(net)
+            x = torch.zeros((batch_size, 12, BOARD_N, BOARD_N), dtype=torch.float32).contiguous(memory_format=fmt)
+            logits, value = fwd(x)
+            (logits.float().sum() + value.float().sum()).backward()
+            net.zero_grad(set_to_none=True)
+            net.load_state_dict(saved)
+            return fwd, cand
+        except Exception as e:
+            net.zero_grad(set_to_none=True)
+            net.load_state_dict(saved)
+            print(f"[train] {cand} unavailable ({type(e).__name__}: {e}); falling back.")
+    return net, "eager"
+
+
+def _train_incremental(
+    net: ZamatNet,
+    payload: Optional[dict],
+    dataset: Union[SampleBuffer, SampleSet],
+    cfg: Optional[TrainConfig] = None,
+    val: Optional[SampleSet] = None,
+    teacher: Optional[nn.Module] = None,
+) -> dict:
+    """Train for up to cfg.epochs, stopping early once the held-out loss plateaus or the
+    time budget runs out; with a validation set the best epoch's weights are kept.
+
+    With a teacher, cfg.kd_alpha of the policy and value loss moves from the recorded
+    targets to the teacher's temperature-softened policy and its value."""
+    cfg = cfg or TrainConfig()
+    intra, inter = _configure_threads(cfg)
+    use_bf16 = cfg.bf16 == "on" or (cfg.bf16 == "auto" and _cpu_has_bf16())
+    fmt = torch.channels_last if cfg.channels_last else torch.contiguous_format
+    print(f"[train] threads={intra}/{inter} channels_last={cfg.channels_last} bf16={use_bf16}")
+
     net.train()
     device = torch.device("cpu")
-    net.to(device)
+    net.to(device, memory_format=fmt)
+    fwd, compiled = _compile_net(net, cfg.compile, batch_size=cfg.batch_size, fmt=fmt)
+    if cfg.compile != "off":
+        print(f"[train] forward path: {compiled}")
+    if teacher is not None:
+        teacher.to(device, memory_format=fmt).eval()
+    kd_a, kd_t = (cfg.kd_alpha, cfg.kd_temperature) if teacher is not None else (0.0, 1.0)
 
 
     opt = torch.optim.Adam(net.parameters(), lr=3e-4, weight_decay=1e-4)
@@ -547,42 +1904,76 @@ def _train_incremental(net: ZamatNet, payload: Optional[dict], dataset: List[Sam
             pass
 
 
-    xs = np.stack([s.x for s in dataset], axis=0)  
-    actions = np.array([s.a for s in dataset], dtype=np.int64)
-    values = np.array([s.v for s in dataset], dtype=np.float32)
-    weights = np.array([s.w for s in dataset], dtype=np.float32)
-
-
-    rng = np.random.default_rng(seed=42)
-    idx = np.arange(xs.shape[0])
+    rng = np.random.default_rng(seed=cfg.seed)
+    idx = np.arange(len(dataset))
     rng.shuffle(idx)
-    xs, actions, values, weights = xs[idx], actions[idx], values[idx], weights[idx]
-
-    x_t = torch.from_numpy(xs).to(device)
-    a_t = torch.from_numpy(actions).to(device)
-    v_t = torch.from_numpy(values).to(device)
-    w_t = torch.from_numpy(weights).to(device)
 
-    n = x_t.shape[0]
+    n = len(dataset)
+    batch_size = cfg.batch_size
     ce = torch.nn.CrossEntropyLoss(reduction="none")
     mse = torch.nn.MSELoss(reduction="none")
 
     step = int(payload.get("step", 0)) if payload else 0
+    t_start = time.perf_counter()
+    limits: List[Tuple[float, str]] = []
+    if cfg.time_budget_s > 0:
+        limits.append((t_start + cfg.time_budget_s, "time_budget"))
+    if cfg.deadline > 0:
+        limits.append((t_start + (cfg.deadline - time.time()), "deadline"))
+    end_at, end_reason = min(limits) if limits else (None, "")
+    steps_per_epoch = -(-n // batch_size)
+    max_steps = cfg.epochs * steps_per_epoch
+    run_steps = 0
+    seen = 0
+    epochs_run = 0
+    stop_reason = "epochs"
+    history: List[Dict[str, float]] = []
+    best_loss = float("inf")
+    best_epoch = 0
+    best_state: Optional[Dict[str, torch.Tensor]] = None
+    stale = 0
+
+    for ep in range(cfg.epochs):
+        t_ep = time.perf_counter()
+        ep_seen = 0
+
+        if cfg.prefetch > 0:
+            batches: Iterable[Tuple[Any, ...]] = BatchPrefetcher(
+                dataset, idx, batch_size, depth=cfg.prefetch, legal=cfg.legal_mask
+            )
+        else:
+            batches = (
+                _inline_batch(dataset, idx[i:i+batch_size], cfg.legal_mask)
+                for i in range(0, n, batch_size)
+            )
 
-    for _ep in range(epochs):
-
-        for i in range(0, n, batch_size):
-            xb = x_t[i:i+batch_size]
-            ab = a_t[i:i+batch_size]
-            vb = v_t[i:i+batch_size]
-            wb = w_t[i:i+batch_size]
-
-            logits, vpred = net(xb)
-            loss_pi = ce(logits, ab)  
-            loss_v = mse(vpred, vb)   
-
-
-            loss = (loss_pi * wb).mean() + 0.50 * (loss_v * wb).mean()
+        for xs, acts, vals, wts, legal in batches:
+            xb = xs.to(device, non_blocking=True).contiguous(memory_format=fmt)
+            ab = acts.to(device)
+            vb = vals.to(device)
+            wb = wts.to(device)
+
+            with torch.autocast("cpu", dtype=torch.bfloat16, enabled=use_bf16):
+                logits, vpred = fwd(xb)
+            logits = logits.float()
+            if legal is not None:
+                logits = logits.masked_fill(~legal.to(device), float("-inf"))
+            loss_pi = ce(logits, ab)
+            loss_v = mse(vpred.float(), vb)
+            if teacher is not None:
+                with torch.no_grad(), torch.autocast("cpu", dtype=torch.bfloat16, enabled=use_bf16):
+                    t_logits, t_value = teacher(xb)
+                t_logits = t_logits.float()
+                if legal is not None:
+                    t_logits = t_logits.masked_fill(~legal.to(device), float("-inf"))
+                p_t = F.softmax(t_logits / kd_t, dim=1)
+                log_p_s = F.log_softmax(logits / kd_t, dim=1)
+                soft_pi = -torch.where(p_t > 0, p_t * log_p_s, torch.zeros_like(p_t)).sum(dim=1) * kd_t * kd_t
+                loss_pi = (1.0 - kd_a) * loss_pi + kd_a * soft_pi
+                loss_v = (1.0 - kd_a) * loss_v + kd_a * mse(vpred.float(), t_value.float())
+
+
+            loss = (loss_pi * wb).mean() + cfg.value_weight * (loss_v * wb).mean()
 
             opt.zero_grad(set_to_none=True)
             loss.backward()
@@ -590,19 +1981,85 @@ def _train_incremental(net: ZamatNet, payload: Optional[dict], dataset: List[Sam
             opt.step()
 
             step += 1
+            run_steps += 1
+            ep_seen += len(ab)
+
+            now = time.perf_counter()
+            if end_at is not None and run_steps == cfg.calibrate_steps:
+                # Size the rest of the run from measured throughput, leaving room for validation passes.
+                rate = run_steps / max(now - t_start, 1e-9)
+                val_s = (len(val) / (rate * batch_size * 3.0)) if val is not None else 0.0
+                left = end_at - now - val_s * (cfg.epochs - ep)
+                max_steps = min(max_steps, run_steps + max(0, int(left * rate * 0.9)))
+                print(
+                    f"[train] {rate:.1f} steps/s; planning {max_steps} steps "
+                    f"(~{max_steps / steps_per_epoch:.1f} of {cfg.epochs} epochs) before the {end_reason}"
+                )
+            if _STOP_REQUESTED.is_set():
+                stop_reason = "signal"
+                break
+            if end_at is not None and now >= end_at:
+                stop_reason = end_reason
+                break
+            if run_steps >= max_steps and run_steps < cfg.epochs * steps_per_epoch:
+                stop_reason = end_reason
+                break
+
+        if isinstance(batches, BatchPrefetcher):
+            batches.close()
+        seen += ep_seen
+        epochs_run = ep + 1
+        dt = time.perf_counter() - t_ep
+        print(f"[train] epoch {ep + 1}/{cfg.epochs}: {ep_seen} samples in {dt:.1f}s ({ep_seen / max(dt, 1e-9):.0f} samples/s)")
+
+        if val is not None:
+            m = _evaluate(net, val, fmt=fmt, use_bf16=use_bf16, legal_mask=cfg.legal_mask, value_weight=cfg.value_weight)
+            history.append({"epoch": ep + 1, **m})
+            print(f"[train]   val loss={m['loss']:.4f} top1={m['policy_top1']:.3f} value_mse={m['value_mse']:.4f}")
+            if m["loss"] < best_loss - cfg.min_delta:
+                best_loss, best_epoch, stale = m["loss"], ep + 1, 0
+                best_state = {k: v.detach().clone() for k, v in net.state_dict().items()}
+            else:
+                stale += 1
+                if stale >= cfg.patience and stop_reason == "epochs":
+                    stop_reason = "plateau"
+        if stop_reason != "epochs":
+            print(f"[train] Stopping after epoch {ep + 1}: {stop_reason}")
+            break
+
+    if best_state is not None and best_epoch != epochs_run:
+        print(f"[train] Restoring weights from epoch {best_epoch} (val loss {best_loss:.4f})")
+        net.load_state_dict(best_state)
+
+    elapsed = time.perf_counter() - t_start
+    samples_per_sec = seen / max(elapsed, 1e-9)
 
+    net.to(memory_format=torch.contiguous_format)
     net.eval()
     return {
         "model": net.state_dict(),
         "optim": opt.state_dict(),
         "step": step,
         "meta": {
-            "channels": 64,
-            "num_blocks": 4,
+            **net.arch(),
             "n_actions": N_ACTIONS,
+            "features": FEATURE_VERSION,
         },
         "trainedAt": int(time.time() * 1000),
         "samplesSeen": int(n),
+        "train": {
+            **asdict(cfg),
+            "threads": intra,
+            "interop_threads": inter,
+            "bf16": use_bf16,
+            "compile": compiled,
+            "samplesPerSec": round(samples_per_sec, 1),
+            "seconds": round(elapsed, 1),
+            "epochsRun": epochs_run,
+            "bestEpoch": best_epoch or epochs_run,
+            "stopReason": stop_reason,
+            "val": history,
+        },
     }
 
 
@@ -610,9 +2067,121 @@ def _train_incremental(net: ZamatNet, payload: Optional[dict], dataset: List[Sam
 
 
 
+# A teacher or lite student with less time left than this is skipped rather than started.
+MIN_STAGE_BUDGET_S = 60.0
+
+
+def _train_teacher(
+    dataset: Union[SampleBuffer, SampleSet],
+    val: Optional[SampleSet],
+    cfg: TrainConfig,
+    ckpt_path: Path,
+    arch: Dict[str, Any],
+    budget_s: float,
+) -> Tuple[ZamatNet, Dict[str, Any]]:
+    """Continue training the wide teacher kept in the runner cache; it is never exported.
+
+    A checkpoint with a different architecture or FEATURE_VERSION is discarded and the
+    teacher starts over. Returns the teacher in eval mode and its training stats.
+    """
+    teacher = ZamatNet(in_channels=12, n_actions=N_ACTIONS, **arch)
+    payload = None
+    if ckpt_path.exists():
+        try:
+            payload = torch.load(ckpt_path, map_location="cpu")
+            meta = payload.get("meta")
+            if _arch_from_meta(meta) == arch and _features_from_meta(meta) == FEATURE_VERSION:
+                teacher.load_state_dict(payload["model"], strict=True)
+            else:
+                print(f"[teacher] Architecture or input features changed ({arch}, v{FEATURE_VERSION}); starting a new teacher.")
+                payload = None
+        except Exception as e:
+            print(f"[teacher] Ignoring unreadable teacher checkpoint ({e})")
+            payload = None
+
+    print(f"[teacher] Training {arch} teacher on {len(dataset)} samples for up to {budget_s / 60:.1f} min")
+    ckpt = _train_incremental(teacher, payload, dataset, replace(cfg, time_budget_s=budget_s), val=val)
+    try:
+        ckpt_path.parent.mkdir(parents=True, exist_ok=True)
+        torch.save(ckpt, ckpt_path)
+    except OSError as e:
+        print(f"[teacher] Could not save the teacher checkpoint ({e})")
+    return teacher.eval(), {**arch, "step": ckpt.get("step"), "warmStart": payload is not None, **(ckpt.get("train") or {})}
+
+
+def _distill_lite(
+    teacher: ZamatNet,
+    dataset: Union[SampleBuffer, SampleSet],
+    val: Optional[SampleSet],
+    cfg: TrainConfig,
+    ckpt_path: Path,
+    onnx_path: Path,
+    sample_x: np.ndarray,
+    arch: Dict[str, Any],
+    budget_s: float,
+    atol: float = 1e-3,
+    deadline: float = 0.0,
+    max_top1_gap: float = 0.05,
+) -> Optional[Dict[str, Any]]:
+    """Distill a narrow policy-only student from the freshly trained net and export it.
+
+    The student checkpoint lives in the runner cache and carries over between runs while
+    its architecture and FEATURE_VERSION are unchanged. It trains until budget_s or its own
+    deadline (the main net's has already passed by now). Returns the pointer entry, or None
+    if its validation top-1 trails the full model's by more than max_top1_gap or the export
+    fails its ONNX check.
+    """
+    student = ZamatNet(in_channels=12, n_actions=N_ACTIONS, **arch)
+    payload = None
+    if ckpt_path.exists():
+        try:
+            payload = torch.load(ckpt_path, map_location="cpu")
+            meta = payload.get("meta")
+            if _arch_from_meta(meta) == arch and _features_from_meta(meta) == FEATURE_VERSION:
+                student.load_state_dict(payload["model"], strict=True)
+            else:
+                payload = None
+        except Exception as e:
+            print(f"[lite] Ignoring unreadable student checkpoint ({e})")
+            payload = None
+
+    lite_cfg = replace(cfg, value_weight=0.0, compile="off", time_budget_s=budget_s, deadline=deadline)
+    print(f"[lite] Distilling {arch} student for up to {budget_s / 60:.1f} min")
+    ckpt = _train_incremental(student, payload, dataset, lite_cfg, val=val, teacher=teacher)
+    ckpt_path.parent.mkdir(parents=True, exist_ok=True)
+    torch.save(ckpt, ckpt_path)
+
+    if val is None:
+        print("[lite] No validation split to compare against the full model; lite model not published.")
+        return None
+    top1 = _evaluate(student, val, legal_mask=cfg.legal_mask, value_weight=0.0)["policy_top1"]
+    full_top1 = _evaluate(teacher, val, legal_mask=cfg.legal_mask)["policy_top1"]
+    if top1 < full_top1 - max_top1_gap:
+        print(f"[lite] Validation top-1 {top1:.3f} trails the full model's {full_top1:.3f}; lite model not published.")
+        return None
+
+    export_onnx_model(student, onnx_path, fuse_bn=True, policy_only=True)
+    try:
+        drift, _ = _max_drift(student, onnx_path, sample_x)
+    except Exception as e:
+        drift = float("inf")
+        print(f"[lite] Could not verify the export ({e})")
+    if drift > atol:
+        print(f"[lite] Policy drift {drift:.2e} exceeds {atol:.0e}; lite model not published.")
+        onnx_path.unlink(missing_ok=True)
+        return None
+    return {
+        "file": "assets/models/human/" + onnx_path.name,
+        **arch,
+        "bytes": onnx_path.stat().st_size,
+        "policyTop1": top1,
+        "fullPolicyTop1": full_top1,
+    }
+
+
 def _now_version_utc() -> str:
 
-    return time.strftime("%Y%m%d_%H%M", time.gmtime())
+    return time.strftime("%Y%m%d_%H%M%S", time.gmtime())
 
 
 def _read_pointer_from_firebase(db, path: str) -> Optional[dict]:
@@ -669,8 +2238,58 @@ def _write_json(path: Path, obj: Any) -> None:
     path.write_text(json.dumps(obj, ensure_ascii=False, indent=2), encoding="utf-8")
 
 
+MODEL_MANIFEST = "manifest.json"
+
+
+def _sha256_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _read_manifest(models_dir: Path) -> Dict[str, Any]:
+    try:
+        manifest = json.loads((models_dir / MODEL_MANIFEST).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        manifest = {}
+    if not isinstance(manifest.get("artifacts"), dict):
+        manifest["artifacts"] = {}
+    return manifest
+
+
+def _store_artifact(models_dir: Path, path: Path, version: str, kind: str) -> Dict[str, Any]:
+    """Move an exported model to its content-addressed name and record it in manifest.json.
+
+    Files are named human_<kind>_<first 16 hex of sha256>; a byte-identical artifact that is
+    already stored is reused, so reruns never overwrite a published file. Returns the
+    manifest entry (file, sha256, bytes, version, kind).
+    """
+    digest = _sha256_file(path)
+    name = f"human_{kind}_{digest[:16]}{path.suffix}"
+    dst = models_dir / name
+    if dst.exists() and _sha256_file(dst) == digest:
+        path.unlink()
+    else:
+        os.replace(path, dst)
+    manifest = _read_manifest(models_dir)
+    prior = manifest["artifacts"].get(name) or {}
+    entry = {
+        "file": "assets/models/human/" + name,
+        "sha256": digest,
+        "bytes": dst.stat().st_size,
+        "version": prior.get("version") or version,
+        "kind": kind,
+    }
+    manifest["artifacts"][name] = {**entry, "createdAt": prior.get("createdAt") or int(time.time() * 1000)}
+    manifest["updatedAt"] = int(time.time() * 1000)
+    _write_json(models_dir / MODEL_MANIFEST, manifest)
+    return entry
+
+
 def _prune_models(models_dir: Path, keep_files: List[str]) -> List[str]:
-    keep_set = set(keep_files)
+    keep_set = set(keep_files) | {"assets/models/human/" + MODEL_MANIFEST}
     removed: List[str] = []
 
     for p in models_dir.glob("*"):
@@ -689,6 +2308,14 @@ def _prune_models(models_dir: Path, keep_files: List[str]) -> List[str]:
             removed.append(repo_rel)
         except Exception:
             pass
+
+    manifest = _read_manifest(models_dir)
+    stale = [name for name in manifest["artifacts"] if not (models_dir / name).exists()]
+    if stale:
+        for name in stale:
+            del manifest["artifacts"][name]
+        manifest["updatedAt"] = int(time.time() * 1000)
+        _write_json(models_dir / MODEL_MANIFEST, manifest)
     return removed
 
 
@@ -696,7 +2323,43 @@ def _prune_models(models_dir: Path, keep_files: List[str]) -> List[str]:
 
 
 
-def cmd_prepare(repo_root: Path) -> int:
+def cmd_prepare(
+    repo_root: Path,
+    max_samples: int = 50_000,
+    packed: bool = True,
+    page_size: int = 200,
+    workers: int = 0,
+    use_cache: bool = True,
+    replay_capacity: int = 200_000,
+    replay_policy: str = "fifo",
+    replay_ratio: float = 1.0,
+    augment: str = "mirror",
+    val_fraction: float = 0.05,
+    train_cfg: Optional[TrainConfig] = None,
+    arch: Optional[Dict[str, Any]] = None,
+    selfplay_max_samples: int = 0,
+    onnx_opt: str = "basic",
+    onnx_atol: float = 1e-3,
+    export_gate: bool = True,
+    gate_max_drift: float = 1e-3,
+    gate_max_slowdown: float = 1.25,
+    lite_channels: int = 0,
+    lite_blocks: int = 2,
+    lite_policy_head: str = "factorized",
+    lite_budget_min: float = 10.0,
+    lite_max_top1_gap: float = 0.05,
+    lite_time_share: float = 0.15,
+    int8: bool = False,
+    int8_calib_samples: int = 512,
+    int8_min_agreement: float = 0.97,
+    teacher_channels: int = 0,
+    teacher_blocks: int = 8,
+    teacher_policy_head: str = "dense",
+    teacher_budget_min: float = 30.0,
+    teacher_time_share: float = 0.4,
+    run_deadline: float = 0.0,
+    export_reserve_s: float = 300.0,
+) -> int:
     out_dir = repo_root / "training" / "_out"
     out_dir.mkdir(parents=True, exist_ok=True)
 
@@ -709,22 +2372,108 @@ def cmd_prepare(repo_root: Path) -> int:
     prev_pointer = None
 
 
-    games: Dict[str, Any] = {}
-    if db is None:
+    cache = SampleCache(out_dir / "cache" / "samples") if use_cache else None
+    if cache is not None:
+        pruned = cache.prune(int(time.time() * 1000))
+        if pruned:
+            print(f"[prepare] Sample cache: pruned {len(pruned)} stale shards")
 
-        games = _rtdb_rest_get("trainGamesV3")
+    games = _iter_train_games(db, page_size=page_size)
+    fresh, used_ids, purge_ids, games_seen = _make_dataset(
+        games,
+        max_samples=max_samples,
+        cached=cache.counts() if cache is not None else None,
+        workers=workers,
+    )
+    # The stream stops at max_samples, so expired games past the cutoff come from their own query.
+    expired = _expired_train_game_ids(db, int(time.time() * 1000))
+    if expired:
+        purge_ids = list(dict.fromkeys(purge_ids + expired))
+
+    cached_ids = [gid for gid in used_ids if gid not in fresh.game_rows]
+    base = fresh
+
+    # Self-play games are local files: they only add training rows and never enter
+    # used_ids, the validation split, the sample cache or the replay buffer.
+    selfplay = SampleBuffer(capacity=1, packed=True)
+    selfplay_done: List[Path] = []
+    if selfplay_max_samples > 0:
+        sp_index: Dict[Path, List[str]] = {}
+        sp_files = sorted((repo_root / SELFPLAY_DIR).glob("selfplay_*.json"))
+        selfplay, sp_ids, _sp_purge, _sp_seen = _make_dataset(
+            _iter_selfplay_games(sp_files, sp_index),
+            max_samples=selfplay_max_samples,
+            workers=workers,
+            client_filter=False,
+        )
+        taken = set(sp_ids)
+        selfplay_done = [f for f, gids in sp_index.items() if all(gid in taken for gid in gids)]
+
+    def _parts_for(gids: Sequence[str]) -> List[Tuple[SampleBuffer, np.ndarray]]:
+        rows = [np.arange(*fresh.game_rows[gid]) for gid in gids if gid in fresh.game_rows]
+        out = [(base, np.concatenate(rows))] if rows else []
+        from_cache = [gid for gid in gids if gid not in fresh.game_rows]
+        if from_cache and cache is not None:
+            out += cache.parts_for(from_cache)
+        return out
+
+    # Whole games are held out so positions of one game never sit on both sides.
+    val_ids = [gid for gid in used_ids if _in_holdout(gid, val_fraction)]
+    train_ids = [gid for gid in used_ids if not _in_holdout(gid, val_fraction)]
+    if cache is not None:
+        try:
+            shard = cache.add_shard(fresh)
+            if shard is not None:
+                base = cache.open_shard(shard)
+            parts, val_parts = _parts_for(train_ids), _parts_for(val_ids)
+            cache.save_index()
+        except Exception as e:
+            print(f"[prepare] Sample cache unavailable ({e}); training from fresh samples only.")
+            cached_ids = []
+            used_ids = list(fresh.game_rows.keys())
+            base = fresh
+            cache = None
+            val_ids = [gid for gid in used_ids if _in_holdout(gid, val_fraction)]
+            train_ids = [gid for gid in used_ids if not _in_holdout(gid, val_fraction)]
+            parts, val_parts = _parts_for(train_ids), _parts_for(val_ids)
     else:
+        parts, val_parts = _parts_for(train_ids), _parts_for(val_ids)
 
-        try:
-            games = db.reference("trainGamesV3").order_by_child("processed").equal_to(False).get() or {}
-        except Exception:
-            games = db.reference("trainGamesV3").get() or {}
+    val_set: Optional[SampleSet] = SampleSet(val_parts)
+    if len(val_set) < 256:
+        # Too small to steer early stopping; keep those samples for training instead.
+        parts, val_parts, val_set = parts + val_parts, [], None
 
-    if not isinstance(games, dict):
-        games = {}
+    current = SampleSet(parts + val_parts)
+    n_cached = len(current) - len(fresh)
 
-    dataset, used_ids, purge_ids = _make_dataset(games)
-    if len(dataset) < 64:
+    # Older generations are mixed in from the replay buffer; the rows are copied out
+    # before this run's samples are appended so eviction cannot touch them.
+    replay: Optional[ReplayBuffer] = None
+    replayed = SampleBuffer(capacity=1, packed=True)
+    if replay_capacity > 0 and len(current) >= 64:
+        try:
+            replay = ReplayBuffer(out_dir / "cache" / "replay", capacity=replay_capacity, policy=replay_policy)
+            replayed = replay.sample(int(round(len(current) * replay_ratio)))
+        except Exception as e:
+            print(f"[prepare] Replay buffer unavailable ({e}); training on this generation only.")
+            replay = None
+
+    def _training_view(extra: List[Tuple[SampleBuffer, np.ndarray]]) -> Any:
+        view: Any = SampleSet(parts + extra + [(selfplay, np.arange(len(selfplay)))])
+        if len(AUGMENT_SYMMETRIES[augment]) > 1:
+            view = AugmentedSet(view, AUGMENT_SYMMETRIES[augment])
+        if not packed:
+            view = view.materialize(packed=False)
+        return view
+
+    dataset = _training_view([(replayed, np.arange(len(replayed)))])
+    print(
+        f"[prepare] Dataset: {len(dataset)} samples ({len(fresh)} encoded, {n_cached} from cache "
+        f"of {len(cached_ids)} games, {len(replayed)} replayed, {len(selfplay)} self-play, augment={augment}, "
+        f"{'packed' if packed else 'planes'}), {len(val_set) if val_set else 0} held out for validation"
+    )
+    if len(current) < 64:
 
         meta = {
             "new": None,
@@ -738,7 +2487,7 @@ def cmd_prepare(repo_root: Path) -> int:
         }
 
         _write_json(out_dir / "next_version.json", meta)
-        print(f"[prepare] Not enough samples to train (got {len(dataset)}). Will only purge old games in apply.")
+        print(f"[prepare] Not enough samples to train (got {len(current)}). Will only purge old games in apply.")
         return 0
 
 
@@ -749,33 +2498,164 @@ def cmd_prepare(repo_root: Path) -> int:
     if isinstance(old_current, dict):
         preferred_ver = str(old_current.get("version") or "") or None
 
-    net, ckpt_payload = _load_or_init(models_dir, preferred_ver)
+    net, ckpt_payload = _load_or_init(models_dir, preferred_ver, arch)
+
+    # The student trains after the main net, so its share comes off the deadline up front;
+    # otherwise the main net spends all of it and the student would ship untrained.
+    distill_lite = lite_channels > 0
+    cfg_deadline = (train_cfg or TrainConfig()).deadline
+    if distill_lite and cfg_deadline > 0:
+        lite_reserve_s = min(lite_budget_min * 60.0, lite_time_share * (cfg_deadline - time.time()))
+        if lite_reserve_s < MIN_STAGE_BUDGET_S:
+            print("[lite] Too little time before the deadline to reserve for the student; no lite model this run.")
+            distill_lite = False
+        else:
+            print(f"[lite] Reserving {lite_reserve_s / 60:.1f} min before the deadline for the student")
+            train_cfg = replace(train_cfg or TrainConfig(), deadline=cfg_deadline - lite_reserve_s)
+
+    with _stop_on_signal():
+        teacher: Optional[ZamatNet] = None
+        teacher_stats: Optional[Dict[str, Any]] = None
+        # The teacher spends the shipped net's deadline, so it only gets a share of what is left.
+        teacher_budget_s = teacher_budget_min * 60.0
+        cfg_deadline = (train_cfg or TrainConfig()).deadline
+        if cfg_deadline > 0:
+            teacher_budget_s = min(teacher_budget_s, teacher_time_share * (cfg_deadline - time.time()))
+        if teacher_channels > 0 and teacher_budget_s < MIN_STAGE_BUDGET_S:
+            print("[teacher] Too little time before the deadline; training on recorded targets only.")
+        elif teacher_channels > 0:
+            # The teacher sees everything the replay buffer retains, not just this run's share.
+            teacher_data = dataset
+            if replay is not None and len(replay) > len(replayed):
+                retained = replay.sample(len(replay))
+                teacher_data = _training_view([(retained, np.arange(len(retained)))])
+            teacher, teacher_stats = _train_teacher(
+                teacher_data,
+                val_set,
+                train_cfg or TrainConfig(),
+                out_dir / "cache" / "teacher.pt",
+                {"channels": teacher_channels, "num_blocks": teacher_blocks, "policy_head": teacher_policy_head},
+                budget_s=teacher_budget_s,
+            )
+            # A teacher that is not yet better than the shipped net would only pull it backwards.
+            if val_set is not None:
+                t_loss = _evaluate(teacher, val_set)["loss"]
+                s_loss = _evaluate(net, val_set)["loss"]
+                teacher_stats.update(valLoss=t_loss, studentValLoss=s_loss)
+                useful = t_loss < s_loss
+            else:
+                useful = bool(teacher_stats.get("warmStart"))
+            teacher_stats["used"] = useful
+            if not useful:
+                print("[teacher] Teacher does not beat the current model yet; training on recorded targets only.")
+                teacher = None
+        ckpt = _train_incremental(net, ckpt_payload, dataset, train_cfg or TrainConfig(), val=val_set, teacher=teacher)
 
 
-    ckpt = _train_incremental(net, ckpt_payload, dataset, epochs=2, batch_size=256)
+        new_ver = _now_version_utc()
 
 
-    new_ver = _now_version_utc()
 
 
 
+        # Export new versioned artifacts under assets/models/human/
+        new_onnx_name = f"human_learned_{new_ver}.onnx"
+        new_ckpt_name = f"human_ckpt_{new_ver}.pt"
 
-    
-    # Export new versioned artifacts under assets/models/human/
-    new_onnx_name = f"human_learned_{new_ver}.onnx"
-    new_ckpt_name = f"human_ckpt_{new_ver}.pt"
+        new_onnx_rel = "assets/models/human/" + new_onnx_name
+        new_ckpt_rel = "assets/models/human/" + new_ckpt_name
 
-    new_onnx_rel = "assets/models/human/" + new_onnx_name
-    new_ckpt_rel = "assets/models/human/" + new_ckpt_name
+        probe = val_set if val_set is not None else dataset
+        sample_x, _a, _v, _w = probe.batch(np.arange(min(256, len(probe))))
+        export_report = export_inference_model(net, repo_root / new_onnx_rel, sample_x, level=onnx_opt, atol=onnx_atol)
+        torch.save(ckpt, repo_root / new_ckpt_rel)
 
-    export_onnx_model(net, repo_root / new_onnx_rel)
-    torch.save(ckpt, repo_root / new_ckpt_rel)
+    gate_report: Optional[Dict[str, Any]] = None
+    if export_gate:
+        prev_onnx = None
+        if isinstance(old_current, dict) and old_current.get("file"):
+            rel = _normalize_assets_human_rel(str(old_current.get("file")))
+            if rel and not re.match(r"^https?://", rel, flags=re.IGNORECASE):
+                prev_onnx = repo_root / rel
+        passed, gate_report = _export_gate(
+            net, repo_root / new_onnx_rel, sample_x, prev_onnx, max_drift=gate_max_drift, max_slowdown=gate_max_slowdown
+        )
+        for b, lat in (gate_report.get("latency") or {}).items():
+            if lat:
+                print(f"[prepare] Export gate: batch {b} p50={lat['p50_ms']:.2f}ms p99={lat['p99_ms']:.2f}ms")
+        if not passed:
+            # Nothing is published and no game is consumed; the next run retrains on the same data.
+            for rel in (new_onnx_rel, new_ckpt_rel):
+                (repo_root / rel).unlink(missing_ok=True)
+            why = "; ".join(gate_report.get("reasons") or []) or gate_report.get("error", "")
+            meta = {
+                "new": None,
+                "old_current": old_current,
+                "old_previous": old_previous,
+                "prev_ptr": None,
+                "used_game_ids": [],
+                "purge_game_ids": purge_ids,
+                "note": f"Export gate failed: {why}",
+                "stats": {"train": ckpt.get("train"), "export": export_report, "gate": gate_report},
+                "createdAt": int(time.time() * 1000),
+            }
+            _write_json(out_dir / "next_version.json", meta)
+            print(f"[prepare] Export gate failed ({why}); {new_onnx_name} discarded, pointer unchanged.")
+            return 0
+
+    shipped = _store_artifact(models_dir, repo_root / new_onnx_rel, new_ver, "learned")
+    new_onnx_rel = shipped["file"]
+    print(f"[prepare] Stored {new_onnx_rel} ({shipped['bytes']} bytes, sha256 {shipped['sha256'][:16]})")
+
+    int8_entry: Optional[Dict[str, Any]] = None
+    if int8 and not _STOP_REQUESTED.is_set():
+        # Seeded so two runs on the same data publish the same INT8 file and sha256.
+        calib_rng = np.random.default_rng((train_cfg or TrainConfig()).seed)
+        calib_idx = calib_rng.permutation(len(dataset))[:int8_calib_samples]
+        calib_x, _a, _v, _w = dataset.batch(np.sort(calib_idx))
+        int8_path = models_dir / f"human_int8_{new_ver}.onnx"
+        int8_report = quantize_int8_model(
+            repo_root / new_onnx_rel, int8_path, calib_x, sample_x, min_agreement=int8_min_agreement
+        )
+        if int8_report is not None:
+            int8_entry = {**int8_report, **_store_artifact(models_dir, int8_path, new_ver, "int8")}
+
+    lite_entry: Optional[Dict[str, Any]] = None
+    # The main net stopped at its (reduced) deadline; the student trains on up to the export reserve.
+    lite_deadline = run_deadline - export_reserve_s if run_deadline > 0 else 0.0
+    if distill_lite and lite_deadline > 0 and lite_deadline - time.time() < MIN_STAGE_BUDGET_S:
+        print("[lite] Not enough time left before the deadline; no lite model this run.")
+    elif distill_lite and not _STOP_REQUESTED.is_set():
+        with _stop_on_signal():
+            lite_entry = _distill_lite(
+                net,
+                dataset,
+                val_set,
+                train_cfg or TrainConfig(),
+                out_dir / "cache" / "lite_student.pt",
+                models_dir / f"human_lite_{new_ver}.onnx",
+                sample_x,
+                {"channels": lite_channels, "num_blocks": lite_blocks, "policy_head": lite_policy_head},
+                budget_s=lite_budget_min * 60.0,
+                atol=onnx_atol,
+                deadline=lite_deadline,
+                max_top1_gap=lite_max_top1_gap,
+            )
+        if lite_entry is not None:
+            lite_entry.update(_store_artifact(models_dir, repo_root / lite_entry["file"], new_ver, "lite"))
 
+    # Clients key their model cache by sha256, so an unchanged file is never downloaded twice.
     new_pointer = {
         "version": new_ver,
         "file": new_onnx_rel,
+        "sha256": shipped["sha256"],
+        "bytes": shipped["bytes"],
         "updatedAt": int(time.time() * 1000),
     }
+    if int8_entry is not None:
+        new_pointer["int8"] = int8_entry
+    if lite_entry is not None:
+        new_pointer["lite"] = lite_entry
 
     # Previous pointer follows the current pointer prior to this run (if any),
     # but we normalize legacy paths to assets/models/human/.
@@ -791,8 +2671,18 @@ def cmd_prepare(repo_root: Path) -> int:
                 "file": prev_file_rel,
                 "updatedAt": int(time.time() * 1000),
             }
+            if old_current.get("sha256"):
+                prev_pointer["sha256"] = str(old_current.get("sha256"))
 
     keep_files: List[str] = [new_onnx_rel, new_ckpt_rel]
+    if lite_entry is not None:
+        keep_files.append(lite_entry["file"])
+    if int8_entry is not None:
+        keep_files.append(int8_entry["file"])
+    for key in ("lite", "int8"):
+        old_extra = old_current.get(key) if isinstance(old_current, dict) else None
+        if isinstance(old_extra, dict) and old_extra.get("file"):
+            keep_files.append(_normalize_assets_human_rel(str(old_extra.get("file"))))
 
     # Keep previous ONNX + checkpoint if present (keep only 2 generations)
     if prev_pointer is not None and prev_file_rel:
@@ -805,6 +2695,30 @@ def cmd_prepare(repo_root: Path) -> int:
 
     removed = _prune_models(models_dir, keep_files)
 
+    if replay is not None:
+        # Games retrained from the sample cache after a failed apply are already retained.
+        new_ids = list(fresh.game_rows.keys())
+        retained_parts = [(fresh, np.arange(len(fresh)))]
+        if cache is not None:
+            repeat = [gid for gid in cached_ids if not replay.has_game(gid)]
+            retained_parts += cache.parts_for(repeat)
+            new_ids += repeat
+        retained = SampleSet(retained_parts)
+        try:
+            for i in range(0, len(retained), 8192):
+                replay.add(retained.cols(np.arange(i, min(len(retained), i + 8192))))
+            replay.add_games(new_ids)
+            replay.flush()
+            print(f"[prepare] Replay buffer: {len(replay)}/{replay.capacity} samples ({replay.policy})")
+        except Exception as e:
+            print(f"[prepare] Replay buffer update failed ({e})")
+
+    for f in selfplay_done:
+        try:
+            f.unlink()
+        except OSError:
+            pass
+
     meta = {
         "new": new_pointer,
         "old_current": old_current,
@@ -813,9 +2727,17 @@ def cmd_prepare(repo_root: Path) -> int:
         "used_game_ids": used_ids,
         "purge_game_ids": purge_ids,
         "stats": {
-            "games_seen": len(games),
+            "games_seen": games_seen,
             "games_used": len(used_ids),
             "samples_used": len(dataset),
+            "samples_cached": n_cached,
+            "samples_replayed": len(replayed),
+            "samples_selfplay": len(selfplay),
+            "augment": augment,
+            "train": ckpt.get("train"),
+            "teacher": teacher_stats,
+            "export": export_report,
+            "gate": gate_report,
             "files_removed": removed,
         },
         "createdAt": int(time.time() * 1000),
@@ -848,6 +2770,36 @@ def _safe_get_dict(db, path: str) -> Dict[str, Any]:
         return {}
 
 
+def _iter_items(db, path: str) -> Iterator[Tuple[str, Any]]:
+    """Yield (key, child) pairs of a node; streamed over REST, one get() on the Admin SDK."""
+    if db is None:
+        yield from _rtdb_rest_iter(path)
+        return
+    d = db.reference(path).get()
+    if isinstance(d, dict):
+        yield from d.items()
+
+
+def _safe_iter_items(db, path: str) -> Iterator[Tuple[str, Any]]:
+    try:
+        yield from _iter_items(db, path)
+    except Exception:
+        return
+
+
+def _safe_shallow_keys(db, path: str) -> List[str]:
+    try:
+        if db is None:
+            return list(_rtdb_rest_get_query(path, {"shallow": "true"}).keys())
+        try:
+            d = db.reference(path).get(shallow=True)
+        except TypeError:
+            d = db.reference(path).get()
+        return list(d.keys()) if isinstance(d, dict) else []
+    except Exception:
+        return []
+
+
 def _cleanup_operational_data(db, now_ms: int) -> None:
 
 
@@ -863,40 +2815,52 @@ def _cleanup_operational_data(db, now_ms: int) -> None:
 
     updates: Dict[str, Any] = {}
 
-    games = _safe_get_dict(db, "games")
+    # Only the fields needed below are kept per room, so the games node is streamed
+    # instead of being held in memory as a whole.
+    games: Dict[str, Dict[str, Any]] = {}
     to_delete_game_ids: List[str] = []
-    for gid, g in games.items():
-        if not isinstance(g, dict):
-            continue
-        status = str(g.get("status") or "")
-        created = int(g.get("createdAt") or 0)
-        ended = int(g.get("endedAt") or 0)
-        accepted = int(g.get("acceptedAt") or 0)
+    try:
+        for gid, g in _iter_items(db, "games"):
+            if not isinstance(g, dict):
+                continue
+            pls = g.get("players") if isinstance(g.get("players"), dict) else {}
+            games[gid] = {
+                "status": g.get("status"),
+                "players": {"white": pls.get("white"), "black": pls.get("black")},
+            }
+            status = str(g.get("status") or "")
+            created = int(g.get("createdAt") or 0)
+            ended = int(g.get("endedAt") or 0)
+            accepted = int(g.get("acceptedAt") or 0)
 
 
-        if status == "pending":
-            if created and now_ms - created > MAX_PENDING_MS:
-                to_delete_game_ids.append(gid)
-            continue
+            if status == "pending":
+                if created and now_ms - created > MAX_PENDING_MS:
+                    to_delete_game_ids.append(gid)
+                continue
 
 
-        if status and status != "active":
-            to_delete_game_ids.append(gid)
-            continue
+            if status and status != "active":
+                to_delete_game_ids.append(gid)
+                continue
 
 
-        if created and now_ms - created > MAX_ACTIVE_MS:
-            to_delete_game_ids.append(gid)
-            continue
+            if created and now_ms - created > MAX_ACTIVE_MS:
+                to_delete_game_ids.append(gid)
+                continue
 
 
-        if ended and now_ms - ended > 60_000:
-            to_delete_game_ids.append(gid)
-            continue
+            if ended and now_ms - ended > 60_000:
+                to_delete_game_ids.append(gid)
+                continue
 
 
-        if not accepted and created and now_ms - created > MAX_PENDING_MS:
-            to_delete_game_ids.append(gid)
+            if not accepted and created and now_ms - created > MAX_PENDING_MS:
+                to_delete_game_ids.append(gid)
+    except Exception as e:
+        # A partially streamed games node would make live rooms look orphaned below.
+        print(f"[apply] Operational cleanup: games read interrupted ({e}); skipping.")
+        return
 
     for gid in to_delete_game_ids:
         updates[f"games/{gid}"] = None
@@ -906,14 +2870,12 @@ def _cleanup_operational_data(db, now_ms: int) -> None:
 
 
     for root_path in ("chats", "rtc", "spectators"):
-        d = _safe_get_dict(db, root_path)
-        for gid in d.keys():
+        for gid in _safe_shallow_keys(db, root_path):
             if gid not in games:
                 updates[f"{root_path}/{gid}"] = None
 
 
-    inv_root = _safe_get_dict(db, "invites")
-    for to_uid, invs in inv_root.items():
+    for to_uid, invs in _safe_iter_items(db, "invites"):
         if not isinstance(invs, dict):
             continue
         for inv_id, inv in invs.items():
@@ -937,8 +2899,6 @@ def _cleanup_operational_data(db, now_ms: int) -> None:
                 updates[f"invites/{to_uid}/{inv_id}"] = None
 
 
-    players = _safe_get_dict(db, "players")
-
     def _extract_uid(side_val: Any) -> str:
 
 
@@ -947,7 +2907,7 @@ def _cleanup_operational_data(db, now_ms: int) -> None:
             return str(side_val.get("uid") or "").strip()
         return str(side_val or "").strip()
 
-    for uid, p in players.items():
+    for uid, p in _safe_iter_items(db, "players"):
         if not isinstance(p, dict):
             updates[f"players/{uid}"] = None
             continue
@@ -995,6 +2955,369 @@ def _cleanup_operational_data(db, now_ms: int) -> None:
     )
 
 
+def cmd_bench(steps: int = 50, batch_size: int = 256, modes: Sequence[str] = ("off", "compile", "script"), channels_last: bool = False) -> int:
+    """Time training steps and ONNX export per forward path on random positions."""
+    import tempfile
+
+    rng = np.random.default_rng(0)
+    n = batch_size * 4
+    boards = rng.choice(np.array([0, 0, 0, 1, -1, 2, -2], dtype=np.int8), size=(n, N_CELLS))
+    data = SampleBuffer(capacity=n, packed=True)
+    data.extend(
+        b=boards,
+        p=rng.choice(np.array([TOP, BOT], dtype=np.int8), size=n),
+        ic=np.zeros(n, dtype=np.int8),
+        cp=np.full(n, -1, dtype=np.int8),
+        a=rng.integers(0, N_ACTIONS, size=n).astype(np.int16),
+        v=rng.uniform(-1, 1, size=n).astype(np.float32),
+        w=np.ones(n, dtype=np.float32),
+    )
+    fmt = torch.channels_last if channels_last else torch.contiguous_format
+    batches = [data.batch(np.arange(i, i + batch_size)) for i in range(0, n, batch_size)]
+
+    rows = []
+    for mode in modes:
+        torch.manual_seed(0)
+        net = ZamatNet().train().to(memory_format=fmt)
+        opt = torch.optim.Adam(net.parameters(), lr=3e-4)
+        t0 = time.perf_counter()
+        fwd, used = _compile_net(net, mode, batch_size=batch_size, fmt=fmt)
+        t_compile = time.perf_counter() - t0
+        times = []
+        for k in range(steps + 5):
+            xs, acts, vals, wts = batches[k % len(batches)]
+            t0 = time.perf_counter()
+            logits, vpred = fwd(torch.from_numpy(xs).contiguous(memory_format=fmt))
+            loss = F.cross_entropy(logits, torch.from_numpy(acts)) + 0.5 * F.mse_loss(vpred, torch.from_numpy(vals))
+            opt.zero_grad(set_to_none=True)
+            loss.backward()
+            opt.step()
+            if k >= 5:
+                times.append(time.perf_counter() - t0)
+        net.to(memory_format=torch.contiguous_format)
+        with tempfile.TemporaryDirectory() as tmp:
+            t0 = time.perf_counter()
+            export_onnx_model(net, Path(tmp) / "bench.onnx", fuse_bn=mode != "off")
+            t_export = time.perf_counter() - t0
+            size = (Path(tmp) / "bench.onnx").stat().st_size
+        step_ms = float(np.median(times)) * 1000.0
+        rows.append((mode, used, t_compile, step_ms, batch_size / (step_ms / 1000.0), t_export, size))
+
+    print(f"{'mode':>8} {'path':>8} {'setup s':>8} {'step ms':>8} {'samples/s':>10} {'export s':>9} {'onnx MB':>8}")
+    for mode, used, t_compile, step_ms, sps, t_export, size in rows:
+        print(f"{mode:>8} {used:>8} {t_compile:8.2f} {step_ms:8.2f} {sps:10.0f} {t_export:9.2f} {size / 1e6:8.2f}")
+    return 0
+
+
+SELFPLAY_DIR = Path("training") / "_out" / "selfplay"
+
+
+class _SelfPlayGame:
+    """One self-play game: engine position, turn bookkeeping for soufla, and the record being built."""
+
+    def __init__(self, gid: str, starter: int, model_version: Optional[str]):
+        self.gid = gid
+        self.pos = dhamet.play_forced_opening(dhamet.initial_position(starter))
+        self.started_ms = int(time.time() * 1000)
+        self.samples: List[Dict[str, Any]] = []
+        self.steps: List[Any] = []
+        self.plies = 0
+        self.penalties = 0
+        self.winner: Optional[int] = None
+        self.end_reason: Optional[str] = None
+        self.model_version = model_version
+        self._begin_turn()
+
+    def _begin_turn(self) -> None:
+        self.turn_start = self.pos
+        self.started_from: Optional[int] = None
+        self.moved_from: Optional[int] = None
+        self.captures_done = 0
+
+    def state(self) -> Dict[str, Any]:
+        board = bytes(v & 0xFF for v in self.pos.board())
+        return {
+            "b": base64.b64encode(board).decode("ascii"),
+            "p": self.pos.player,
+            "ic": 1 if self.pos.chain >= 0 else 0,
+            "cp": self.pos.chain,
+        }
+
+    def play(self, a: int) -> None:
+        pos = self.pos
+        actor = pos.player
+        if a == ACTION_ENDCHAIN:
+            fr, to = pos.chain, pos.chain
+            step: Any = "END"
+        else:
+            fr, to = divmod(a, N_CELLS)
+            step = [f"{fr // BOARD_N}.{fr % BOARD_N}", f"{to // BOARD_N}.{to % BOARD_N}"]
+        was_man = abs(pos.at(fr)) == MAN
+        nxt, jumped = dhamet.play(pos, a)
+        if a != ACTION_ENDCHAIN and self.moved_from is None:
+            self.moved_from = fr
+        if jumped >= 0:
+            if self.started_from is None:
+                self.started_from = fr
+            self.captures_done += 1
+        self.samples.append({
+            "s": self.state(),
+            "a": int(a),
+            "actor": actor,
+            "cap": 1 if jumped >= 0 else 0,
+            "crown": 1 if was_man and abs(nxt.at(to)) == KING else 0,
+            "trap": 0,
+            "t": int(time.time() * 1000),
+        })
+        self.steps.append(step)
+        self.plies += 1
+        self.pos = nxt
+        if nxt.player != actor:
+            self._end_turn(to)
+
+    def _end_turn(self, last_to: int) -> None:
+        offenders = dhamet.soufla_offenders(self.turn_start, self.started_from, self.captures_done)
+        if offenders:
+            # As computeSouflaPending: a plain step by an offender counts as starting from its origin.
+            origin = self.started_from
+            if origin is None and self.moved_from in offenders:
+                origin = self.moved_from
+            # The penalizer always takes the "remove" option; the piece that moved now stands on last_to.
+            idx = last_to if offenders[0] == origin else offenders[0]
+            self.pos = dhamet.remove_piece(self.pos, idx)
+            self.penalties += 1
+        result = dhamet.outcome(self.pos)
+        if result is not None:
+            self.winner = result if result != 0 else None
+            self.end_reason = "win" if result != 0 else "draw"
+        self._begin_turn()
+
+    @property
+    def done(self) -> bool:
+        return self.end_reason is not None
+
+    def record(self) -> Dict[str, Any]:
+        ended = int(time.time() * 1000)
+        return {
+            "source": "selfplay",
+            "modelVersion": self.model_version,
+            "samples": self.samples,
+            "steps": self.steps,
+            "souflaPenalties": self.penalties,
+            "winner": self.winner,
+            "endReason": self.end_reason,
+            "startedAt": self.started_ms,
+            "endedAt": ended,
+            "durationMs": ended - self.started_ms,
+        }
+
+
+def _selfplay_worker(
+    model_path: str,
+    out_path: str,
+    n_games: int,
+    concurrency: int = 64,
+    seed: int = 0,
+    threads: int = 1,
+    temperature: float = 1.0,
+    greedy_after: int = 30,
+    max_plies: int = 400,
+    model_version: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Play n_games with up to `concurrency` games sharing each onnxruntime batch; write them to out_path."""
+    import onnxruntime as ort
+
+    opts = ort.SessionOptions()
+    opts.intra_op_num_threads = max(1, threads)
+    opts.inter_op_num_threads = 1
+    sess = ort.InferenceSession(model_path, sess_options=opts, providers=["CPUExecutionProvider"])
+    in_name = sess.get_inputs()[0].name
+    out_name = sess.get_outputs()[0].name
+    # The fallback export has a fixed batch of 1; such models are run one position at a time.
+    fixed_batch = sess.get_inputs()[0].shape[0] == 1
+
+    rng = np.random.default_rng(seed)
+    prefix = f"sp{int(time.time())}_{seed}"
+    planes = np.zeros((concurrency, 12, BOARD_N, BOARD_N), dtype=np.float32)
+    boards = np.zeros((concurrency, N_CELLS), dtype=np.int8)
+    p = np.zeros(concurrency, dtype=np.int64)
+    ic = np.zeros(concurrency, dtype=np.int64)
+    cp = np.zeros(concurrency, dtype=np.int64)
+
+    started = 0
+    finished: Dict[str, Dict[str, Any]] = {}
+    active: List[_SelfPlayGame] = []
+    positions = 0
+    t0 = time.perf_counter()
+    while active or started < n_games:
+        while len(active) < concurrency and started < n_games:
+            active.append(_SelfPlayGame(f"{prefix}_{started:05d}", TOP if started % 2 == 0 else BOT, model_version))
+            started += 1
+
+        n = len(active)
+        for i, g in enumerate(active):
+            boards[i] = g.pos.board()
+            p[i], ic[i], cp[i] = g.pos.player, 1 if g.pos.chain >= 0 else 0, g.pos.chain
+        x = _encode_boards(boards[:n], p[:n], ic[:n], cp[:n], out=planes)
+        if fixed_batch:
+            logits = np.concatenate([sess.run([out_name], {in_name: x[i : i + 1]})[0] for i in range(n)])
+        else:
+            logits = sess.run([out_name], {in_name: x})[0]
+        positions += n
+
+        still: List[_SelfPlayGame] = []
+        for i, g in enumerate(active):
+            legal = np.asarray(dhamet.legal_actions(g.pos), dtype=np.int64)
+            if len(legal) == 0:
+                # No move at all loses for the side to move (simTerminalScore).
+                g.winner, g.end_reason = -g.pos.player, "win"
+            else:
+                z = logits[i, legal].astype(np.float64)
+                if g.plies >= greedy_after or temperature <= 0:
+                    a = int(legal[int(np.argmax(z))])
+                else:
+                    z = (z - z.max()) / temperature
+                    prob = np.exp(z)
+                    a = int(rng.choice(legal, p=prob / prob.sum()))
+                g.play(a)
+                if not g.done and g.plies >= max_plies:
+                    g.end_reason = "maxPlies"
+            if g.done:
+                finished[g.gid] = g.record()
+            else:
+                still.append(g)
+        active = still
+
+    seconds = time.perf_counter() - t0
+    _write_json(Path(out_path), finished)
+    winners = [g.get("winner") for g in finished.values()]
+    return {
+        "file": out_path,
+        "games": len(finished),
+        "positions": positions,
+        "samples": sum(len(g["samples"]) for g in finished.values()),
+        "seconds": seconds,
+        "top": winners.count(TOP),
+        "bot": winners.count(BOT),
+        "draws": winners.count(None),
+    }
+
+
+def _latest_onnx(models_dir: Path) -> Optional[Path]:
+    """Newest full model by manifest version, else the most recently written human_learned_*.onnx."""
+    entries = [e for e in _read_manifest(models_dir)["artifacts"].values() if e.get("kind") == "learned"]
+    for e in sorted(entries, key=lambda e: str(e.get("version") or ""), reverse=True):
+        path = models_dir / Path(str(e.get("file") or "")).name
+        if path.exists():
+            return path
+    files = sorted(models_dir.glob("human_learned_*.onnx"), key=lambda p: p.stat().st_mtime)
+    return files[-1] if files else None
+
+
+def cmd_selfplay(
+    repo_root: Path,
+    games: int = 256,
+    model: Optional[str] = None,
+    workers: int = 0,
+    concurrency: int = 64,
+    threads: int = 0,
+    temperature: float = 1.0,
+    greedy_after: int = 30,
+    max_plies: int = 400,
+    seed: Optional[int] = None,
+) -> int:
+    """Generate self-play games with the exported model into training/_out/selfplay/."""
+    model_path = Path(model).resolve() if model else _latest_onnx(repo_root / "assets" / "models" / "human")
+    if model_path is None or not model_path.exists():
+        print("[selfplay] No human_learned_*.onnx model found.")
+        return 1
+    entry = _read_manifest(model_path.parent)["artifacts"].get(model_path.name) or {}
+    m = re.match(r"^human_learned_(.+)\.onnx$", model_path.name)
+    model_version = entry.get("version") or (m.group(1) if m else None)
+
+    n_workers = max(1, workers)
+    threads = threads or max(1, _usable_cores() // n_workers)
+    seed = int(time.time()) if seed is None else seed
+    out_dir = repo_root / SELFPLAY_DIR
+    out_dir.mkdir(parents=True, exist_ok=True)
+    stamp = time.strftime("%Y%m%d_%H%M%S", time.gmtime())
+    jobs = []
+    for w in range(n_workers):
+        share = games // n_workers + (1 if w < games % n_workers else 0)
+        if share > 0:
+            out_path = out_dir / f"selfplay_{stamp}_{w}.json"
+            jobs.append(dict(
+                model_path=str(model_path), out_path=str(out_path), n_games=share,
+                concurrency=concurrency, seed=seed + w, threads=threads, temperature=temperature,
+                greedy_after=greedy_after, max_plies=max_plies, model_version=model_version,
+            ))
+
+    print(f"[selfplay] {games} games with {model_path.name}: {len(jobs)} workers x {threads} threads, batch {concurrency}")
+    t0 = time.perf_counter()
+    if len(jobs) == 1:
+        results = [_selfplay_worker(**jobs[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=len(jobs)) as pool:
+            results = list(pool.map(_selfplay_worker_kw, jobs))
+    seconds = time.perf_counter() - t0
+
+    for r in results:
+        print(
+            f"[selfplay] {Path(r['file']).name}: {r['games']} games, {r['samples']} samples, "
+            f"{r['games'] / max(r['seconds'], 1e-9):.2f} games/s, {r['positions'] / max(r['seconds'], 1e-9):.0f} positions/s"
+        )
+    n_games = sum(r["games"] for r in results)
+    n_pos = sum(r["positions"] for r in results)
+    print(
+        f"[selfplay] Total: {n_games} games in {seconds:.1f}s -> {n_games / max(seconds, 1e-9):.2f} games/s, "
+        f"{n_pos / max(seconds, 1e-9):.0f} positions/s "
+        f"(TOP {sum(r['top'] for r in results)} / BOT {sum(r['bot'] for r in results)} / "
+        f"draws {sum(r['draws'] for r in results)})"
+    )
+    return 0
+
+
+def _selfplay_worker_kw(job: Dict[str, Any]) -> Dict[str, Any]:
+    return _selfplay_worker(**job)
+
+
+def _iter_selfplay_games(files: Sequence[Path], index: Dict[Path, List[str]]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Yield (gid, game) from self-play files written by cmd_selfplay, oldest first.
+
+    index receives the game ids of every file opened, so the caller can tell which
+    files were consumed completely.
+    """
+    for path in files:
+        try:
+            games = json.loads(path.read_text(encoding="utf-8")) or {}
+        except (OSError, ValueError) as e:
+            print(f"[prepare] Skipping unreadable self-play file {path.name} ({e})")
+            continue
+        index[path] = list(games.keys())
+        yield from games.items()
+
+
+def cmd_verify_rules(max_games: int = 200, page_size: int = 200, show: int = 5) -> int:
+    """Replay recorded trainGamesV3 games through training/dhamet.py and report disagreements."""
+    db = _firebase_connect()
+    checked = bad = mismatches = 0
+    for gid, g in _iter_train_games(db, page_size=page_size):
+        if max_games > 0 and checked >= max_games:
+            break
+        if not isinstance(g, dict):
+            continue
+        checked += 1
+        problems = dhamet.cross_check_game(g)
+        if problems:
+            bad += 1
+            mismatches += len(problems)
+            print(f"[verify-rules] {gid}: {len(problems)} mismatches")
+            for p in problems[:show]:
+                print(f"  {p}")
+    print(f"[verify-rules] games={checked} with_mismatches={bad} mismatches={mismatches}")
+    return 1 if bad else 0
+
+
 def cmd_apply(repo_root: Path) -> int:
     meta_path = repo_root / "training" / "_out" / "next_version.json"
     if not meta_path.exists():
@@ -1083,20 +3406,190 @@ def cmd_apply(repo_root: Path) -> int:
 
 
 def main() -> int:
+    started = time.time()
     ap = argparse.ArgumentParser()
     sub = ap.add_subparsers(dest="cmd", required=True)
 
     p1 = sub.add_parser("prepare")
     p1.add_argument("--repo-root", required=True)
+    p1.add_argument("--max-samples", type=int, default=50_000)
+    p1.add_argument("--dataset-mode", choices=["packed", "planes"], default="packed",
+                    help="packed keeps int8 boards and expands planes per minibatch")
+    p1.add_argument("--page-size", type=int, default=200, help="trainGamesV3 games fetched per RTDB read")
+    p1.add_argument("--workers", type=int, default=0,
+                    help="processes for filtering/decoding games (0 or 1 = in-process)")
+    p1.add_argument("--no-sample-cache", action="store_true", help="do not read or write training/_out/cache/samples")
+    p1.add_argument("--replay-capacity", type=int, default=200_000,
+                    help="samples kept across generations in training/_out/cache/replay (0 disables)")
+    p1.add_argument("--replay-policy", choices=["fifo", "reservoir"], default="fifo")
+    p1.add_argument("--replay-ratio", type=float, default=1.0,
+                    help="replayed samples mixed in per new sample")
+    p1.add_argument("--augment", choices=sorted(AUGMENT_SYMMETRIES), default="mirror",
+                    help="mirror: left-right reflection; all: also vertical flip with colours swapped")
+    p1.add_argument("--perf", action="store_true",
+                    help="tune threads from usable cores, use channels_last and bf16 where native")
+    p1.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    p1.add_argument("--interop-threads", type=int, default=None, help="torch inter-op threads")
+    p1.add_argument("--bf16", choices=["off", "auto", "on"], default=None, help="bfloat16 autocast for training")
+    p1.add_argument("--channels", type=int, default=None, help="ZamatNet width (default: from checkpoint, else 64)")
+    p1.add_argument("--blocks", type=int, default=None, help="residual blocks (default: from checkpoint, else 4)")
+    p1.add_argument("--policy-head", choices=["dense", "factorized"], default=None,
+                    help="factorized scores from x to squares instead of a 6562-way Linear (default: from checkpoint)")
+    p1.add_argument("--compile", choices=["off", "auto", "compile", "script"], default=None,
+                    help="compiled training forward; also folds Conv+BN before ONNX export")
+    p1.add_argument("--legal-mask", action="store_true", default=None,
+                    help="restrict the policy softmax to legal moves (training/dhamet.py)")
+    p1.add_argument("--prefetch", type=int, default=None, help="minibatches prepared ahead of the training step (0 = inline)")
+    p1.add_argument("--epochs", type=int, default=6, help="maximum epochs; early stopping usually ends sooner")
+    p1.add_argument("--patience", type=int, default=2, help="epochs without validation improvement before stopping")
+    p1.add_argument("--val-fraction", type=float, default=0.05, help="share of games held out for validation")
+    p1.add_argument("--time-budget-min", type=float, default=90.0, help="training wall-clock budget in minutes (0 = none)")
+    p1.add_argument("--deadline-min", type=float, default=0.0,
+                    help="minutes from start by which prepare must finish, e.g. the job timeout (0 = none)")
+    p1.add_argument("--export-reserve-min", type=float, default=5.0,
+                    help="minutes kept free before the deadline for export and bookkeeping")
+    p1.add_argument("--onnx-opt", choices=ONNX_OPT_LEVELS, default="basic",
+                    help="onnxruntime offline graph optimization for the shipped model (extended adds contrib-op fusions)")
+    p1.add_argument("--onnx-atol", type=float, default=1e-3,
+                    help="largest output difference vs torch accepted for an optimized graph")
+    p1.add_argument("--no-export-gate", action="store_true",
+                    help="publish without loading the export back through onnxruntime")
+    p1.add_argument("--gate-max-drift", type=float, default=1e-3,
+                    help="largest policy/value difference vs torch on held-out states")
+    p1.add_argument("--gate-max-slowdown", type=float, default=1.25,
+                    help="largest p50 latency ratio vs the current model at batch 1 and 32")
+    p1.add_argument("--lite-channels", type=int, default=0,
+                    help="also distill a policy-only student of this width (0 = no lite model)")
+    p1.add_argument("--lite-blocks", type=int, default=2)
+    p1.add_argument("--lite-policy-head", choices=["dense", "factorized"], default="factorized")
+    p1.add_argument("--lite-budget-min", type=float, default=10.0, help="training budget for the student in minutes")
+    p1.add_argument("--lite-max-top1-gap", type=float, default=0.05,
+                    help="largest validation top-1 shortfall vs the full model accepted for the student")
+    p1.add_argument("--lite-time-share", type=float, default=0.15,
+                    help="largest share of the time before the deadline held back from the main net for the student")
+    p1.add_argument("--int8", action="store_true",
+                    help="also publish a statically quantized INT8 copy of the shipped model")
+    p1.add_argument("--int8-calib-samples", type=int, default=512, help="training rows used to calibrate activations")
+    p1.add_argument("--int8-min-agreement", type=float, default=0.97,
+                    help="minimum legal-move top-1 agreement with the float model on validation rows")
+    p1.add_argument("--teacher-channels", type=int, default=0,
+                    help="train a persistent wide teacher in training/_out/cache and distill the shipped net from it (0 = off)")
+    p1.add_argument("--teacher-blocks", type=int, default=8)
+    p1.add_argument("--teacher-policy-head", choices=["dense", "factorized"], default="dense")
+    p1.add_argument("--teacher-budget-min", type=float, default=30.0, help="teacher training budget in minutes")
+    p1.add_argument("--teacher-time-share", type=float, default=0.4,
+                    help="largest share of the time left before the deadline given to the teacher")
+    p1.add_argument("--kd-alpha", type=float, default=None, help="share of the loss on teacher soft targets")
+    p1.add_argument("--kd-temperature", type=float, default=None, help="softmax temperature for teacher policy targets")
+    p1.add_argument("--seed", type=int, default=None, help="seed for the shuffle order and INT8 calibration rows (default 42)")
+    p1.add_argument("--selfplay-max-samples", type=int, default=0,
+                    help="self-play samples from training/_out/selfplay mixed into training (0 = none)")
+
+    p3 = sub.add_parser("bench", help="compare eager, torch.compile and TorchScript training/export speed")
+    p3.add_argument("--steps", type=int, default=50)
+    p3.add_argument("--batch-size", type=int, default=256)
+    p3.add_argument("--modes", default="off,compile,script", help="comma-separated: off, compile, script, auto")
+    p3.add_argument("--channels-last", action="store_true")
+
+    p5 = sub.add_parser("selfplay", help="generate games with the exported model via onnxruntime")
+    p5.add_argument("--repo-root", required=True)
+    p5.add_argument("--games", type=int, default=256)
+    p5.add_argument("--model", default=None, help="ONNX file (default: newest assets/models/human/human_learned_*.onnx)")
+    p5.add_argument("--workers", type=int, default=0, help="processes, each with its own onnxruntime session")
+    p5.add_argument("--concurrency", type=int, default=64, help="games batched into one inference call per worker")
+    p5.add_argument("--threads", type=int, default=0, help="onnxruntime threads per worker (0 = cores / workers)")
+    p5.add_argument("--temperature", type=float, default=1.0)
+    p5.add_argument("--greedy-after", type=int, default=30, help="plies sampled at temperature before playing greedily")
+    p5.add_argument("--max-plies", type=int, default=400, help="plies after which a game is scored as a draw")
+    p5.add_argument("--seed", type=int, default=None)
+
+    p4 = sub.add_parser("verify-rules", help="cross-check recorded games against the Python rules engine")
+    p4.add_argument("--max-games", type=int, default=200, help="games replayed (0 = all)")
+    p4.add_argument("--page-size", type=int, default=200)
+    p4.add_argument("--show", type=int, default=5, help="mismatches printed per game")
 
     p2 = sub.add_parser("apply")
     p2.add_argument("--repo-root", required=True)
 
     args = ap.parse_args()
+    if args.cmd == "bench":
+        modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+        return cmd_bench(steps=args.steps, batch_size=args.batch_size, modes=modes, channels_last=args.channels_last)
+    if args.cmd == "verify-rules":
+        return cmd_verify_rules(max_games=args.max_games, page_size=args.page_size, show=args.show)
     repo_root = Path(args.repo_root).resolve()
 
+    if args.cmd == "selfplay":
+        return cmd_selfplay(
+            repo_root,
+            games=args.games,
+            model=args.model,
+            workers=args.workers,
+            concurrency=args.concurrency,
+            threads=args.threads,
+            temperature=args.temperature,
+            greedy_after=args.greedy_after,
+            max_plies=args.max_plies,
+            seed=args.seed,
+        )
+
     if args.cmd == "prepare":
-        return cmd_prepare(repo_root)
+        tune = dict(
+            threads=args.threads,
+            interop_threads=args.interop_threads,
+            bf16=args.bf16,
+            prefetch=args.prefetch,
+            compile=args.compile,
+            legal_mask=args.legal_mask,
+            kd_alpha=args.kd_alpha,
+            kd_temperature=args.kd_temperature,
+            seed=args.seed,
+            epochs=args.epochs,
+            patience=args.patience,
+            time_budget_s=args.time_budget_min * 60.0,
+            deadline=(started + (args.deadline_min - args.export_reserve_min) * 60.0) if args.deadline_min > 0 else None,
+        )
+        if args.perf:
+            train_cfg = TrainConfig.perf(**tune)
+        else:
+            train_cfg = TrainConfig(**{k: v for k, v in tune.items() if v is not None})
+        return cmd_prepare(
+            repo_root,
+            max_samples=args.max_samples,
+            packed=args.dataset_mode == "packed",
+            page_size=args.page_size,
+            workers=args.workers,
+            use_cache=not args.no_sample_cache,
+            replay_capacity=args.replay_capacity,
+            replay_policy=args.replay_policy,
+            replay_ratio=args.replay_ratio,
+            augment=args.augment,
+            val_fraction=args.val_fraction,
+            train_cfg=train_cfg,
+            arch={"channels": args.channels, "num_blocks": args.blocks, "policy_head": args.policy_head},
+            selfplay_max_samples=args.selfplay_max_samples,
+            onnx_opt=args.onnx_opt,
+            onnx_atol=args.onnx_atol,
+            export_gate=not args.no_export_gate,
+            lite_channels=args.lite_channels,
+            lite_blocks=args.lite_blocks,
+            lite_policy_head=args.lite_policy_head,
+            lite_budget_min=args.lite_budget_min,
+            lite_max_top1_gap=args.lite_max_top1_gap,
+            lite_time_share=args.lite_time_share,
+            int8=args.int8,
+            int8_calib_samples=args.int8_calib_samples,
+            int8_min_agreement=args.int8_min_agreement,
+            teacher_channels=args.teacher_channels,
+            teacher_blocks=args.teacher_blocks,
+            teacher_policy_head=args.teacher_policy_head,
+            teacher_budget_min=args.teacher_budget_min,
+            teacher_time_share=args.teacher_time_share,
+            run_deadline=(started + args.deadline_min * 60.0) if args.deadline_min > 0 else 0.0,
+            export_reserve_s=args.export_reserve_min * 60.0,
+            gate_max_drift=args.gate_max_drift,
+            gate_max_slowdown=args.gate_max_slowdown,
+        )
     if args.cmd == "apply":
         return cmd_apply(repo_root)
     return 2